@@ -0,0 +1,292 @@
+#! /usr/bin/env python
+
+import json
+
+from flask import Blueprint, Response, jsonify, abort, request, current_app
+from flask.ext.security import login_required
+from flask.ext.login import current_user
+
+from data_model import Market, Order
+import market_maker
+import history
+import events
+import portfolio
+
+# seconds between keep-alive comments on idle streams
+HEARTBEAT_INTERVAL = 15
+
+# most orders accepted by one batch submission
+MAX_ORDERS = 1000
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+def get_market(id):
+    try:
+        return market_maker.get_market_snapshot(id)
+    except Market.DoesNotExist:
+        abort(404)
+
+def format_date(date):
+    return date.strftime(history.DATE_FORMAT)
+
+def get_book(id):
+    market = get_market(id)
+    book = current_app.extensions['matching_service'].get_order_book_snapshot(id)
+
+    return dict(
+        market=id,
+        price=market['price'],
+        sell=book['sell_levels'],
+        buy=book['buy_levels'])
+
+def get_order(order):
+    return dict(
+        id=order.id,
+        market=order.market_id,
+        type=order.type,
+        status=order.status,
+        price=order.price,
+        quantity=order.quantity,
+        filled_quantity=order.filled_quantity)
+
+def get_own_order(id):
+    try:
+        order = Order.get(Order.id == id)
+    except Order.DoesNotExist:
+        abort(404)
+
+    if order.user_id != current_user.id:
+        abort(404)
+
+    return order
+
+def parse_orders(orders, keys, **values):
+    # orders of a request body, None when they are malformed
+    if not isinstance(orders, list) or len(orders) > MAX_ORDERS:
+        return None
+
+    parsed = list()
+    for order in orders:
+        try:
+            order = dict(values, **dict((key, order[key]) for key in keys))
+            if 'market' in order:
+                order['market'] = int(order['market'])
+        except (TypeError, ValueError, KeyError):
+            return None
+        parsed.append(order)
+
+    return parsed
+
+def format_event(event, type=None):
+    lines = list()
+    if 'id' in event:
+        lines.append('id: %s' % event['id'])
+    lines.append('event: %s' % (type or event['type']))
+    lines.append('data: %s' % json.dumps(event))
+
+    return '\n'.join(lines) + '\n\n'
+
+@api.route('/markets')
+@login_required
+def markets():
+    # open markets with the top of their books, read from their summaries
+    return jsonify(markets=[
+        dict(market, last_date=format_date(market['last_date']) if market['last_date'] else None)
+        for market in market_maker.get_open_markets_snapshot()
+        ])
+
+@api.route('/markets/<int:id>')
+@login_required
+def market(id):
+    market = get_market(id)
+
+    return jsonify(
+        id=market['id'],
+        name=market['name'],
+        status=market['status'],
+        opening_date=format_date(market['opening_date']),
+        closing_date=format_date(market['closing_date']),
+        price=market['price'],
+        volume=market['volume'])
+
+@api.route('/markets/<int:id>/book')
+@login_required
+def book(id):
+    # depth is aggregated in (price, quantity) levels, best prices first
+    return jsonify(**get_book(id))
+
+@api.route('/markets/<int:id>/trades')
+@login_required
+def trades(id):
+    # keyset pagination, the next page starts before the last date and id
+    # returned
+    try:
+        (limit, before) = history.parse_page_args(request.args)
+    except ValueError:
+        abort(400)
+
+    trades = [
+        dict(id=point.id, date=format_date(point.date), price=point.price, quantity=point.volume)
+        for point in history.get_history(id, before, limit)
+        ]
+
+    last = trades[-1] if len(trades) == limit else dict(date=None, id=None)
+    return jsonify(
+        trades=trades,
+        before=last['date'],
+        before_id=last['id'])
+
+@api.route('/markets/<int:id>/stream')
+@login_required
+def stream(id):
+    """Server-sent events of a market.
+
+    The stream opens with a 'snapshot' event holding the whole book, then
+    only sends what changed: 'book' events with the new quantity of the
+    levels that moved (0 when a level is gone), 'trade' events for every
+    clear and a 'market' event when the market is resolved. A 'reset' event
+    asks the client to reconnect, its events could not be kept up with.
+    """
+    get_market(id)
+
+    # subscribe before reading the book, no change is missed in between
+    subscription = events.subscribe(id)
+    sequence = events.get_sequence(id)
+    snapshot = dict(get_book(id), id=sequence)
+
+    def generate():
+        try:
+            yield format_event(snapshot, 'snapshot')
+            while True:
+                event = subscription.get(HEARTBEAT_INTERVAL)
+                if subscription.overflowed:
+                    yield format_event(dict(market=id), 'reset')
+                    return
+                if event is None:
+                    yield ': heartbeat\n\n'
+                elif event['id'] > sequence:
+                    # level quantities are absolute, events the snapshot
+                    # may already include are only skipped by sequence
+                    yield format_event(event)
+        finally:
+            events.unsubscribe(subscription)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+
+    return response
+
+@api.route('/orders', methods=['POST'])
+@login_required
+def submit_orders():
+    """Register a batch of orders of the current user.
+
+    The body is {"orders": [{"market": id, "type": "buy" or "sell", "price":
+    price, "quantity": quantity}, ...]}. Either every order is registered
+    or none is, and each market is cleared once for the whole batch.
+    """
+    body = request.get_json(silent=True)
+    orders = parse_orders(
+        body.get('orders') if isinstance(body, dict) else None,
+        ('market', 'type', 'price', 'quantity'),
+        user=current_user.id)
+    if orders is None:
+        return jsonify(error='expected at most %d orders with market, type, price and quantity' % MAX_ORDERS), 400
+
+    matching_service = current_app.extensions['matching_service']
+    try:
+        created = matching_service.submit_orders(orders)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    return jsonify(orders=[get_order(order) for order in created]), 201
+
+@api.route('/orders', methods=['DELETE'])
+@login_required
+def cancel_orders():
+    # every pending order of the current user, optionally in one market
+    market = request.args.get('market', type=int)
+    matching_service = current_app.extensions['matching_service']
+    cancelled = matching_service.cancel_user_orders(current_user.id, market)
+
+    return jsonify(orders=[get_order(order) for order in cancelled])
+
+@api.route('/orders/<int:id>', methods=['GET'])
+@login_required
+def order(id):
+    return jsonify(**get_order(get_own_order(id)))
+
+@api.route('/orders/<int:id>', methods=['DELETE'])
+@login_required
+def cancel_order(id):
+    order = get_own_order(id)
+    matching_service = current_app.extensions['matching_service']
+    if not matching_service.cancel_orders([order]):
+        return jsonify(error='order %s is not pending' % id), 409
+
+    return jsonify(**get_order(Order.get(Order.id == id)))
+
+@api.route('/orders/<int:id>', methods=['PATCH'])
+@login_required
+def amend_order(id):
+    """Change the price or quantity of a pending order.
+
+    Reducing the quantity keeps the order and its queue position, other
+    changes answer with the new order that replaced it.
+    """
+    order = get_own_order(id)
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify(error='expected price or quantity'), 400
+
+    matching_service = current_app.extensions['matching_service']
+    try:
+        amended = matching_service.amend_order(order, body.get('price'), body.get('quantity'))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    if amended is None:
+        return jsonify(error='order %s is not pending' % id), 409
+
+    return jsonify(**get_order(amended))
+
+@api.route('/markets/<int:id>/quotes', methods=['PUT'])
+@login_required
+def replace_quotes(id):
+    # the pending orders of the current user in the market are swapped for
+    # the quotes of the body in one transaction
+    body = request.get_json(silent=True)
+    quotes = parse_orders(
+        body.get('orders') if isinstance(body, dict) else None,
+        ('type', 'price', 'quantity'))
+    if quotes is None:
+        return jsonify(error='expected at most %d orders with type, price and quantity' % MAX_ORDERS), 400
+
+    matching_service = current_app.extensions['matching_service']
+    try:
+        created = matching_service.replace_quotes(id, current_user.id, quotes)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    return jsonify(orders=[get_order(order) for order in created])
+
+@api.route('/portfolio')
+@login_required
+def own_portfolio():
+    # holdings, cash and open orders of the user, positions marked at the
+    # price of their market
+    return jsonify(**portfolio.get_portfolio(current_user.id))
+
+@api.route('/leaderboard')
+@login_required
+def leaderboard():
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+
+    return jsonify(leaders=market_maker.get_leaderboard_snapshot(limit))
+
+def build_api(app, matching_service):
+    app.extensions['matching_service'] = matching_service
+    app.register_blueprint(api)
+
+    return api
@@ -0,0 +1,181 @@
+#! /usr/bin/env python
+
+import argparse
+import datetime
+import time
+
+import peewee
+
+from data_model import atomic, chunked, Market, MarketHistory, Order, Transaction
+
+# archived rows keep their id, moving a batch twice only overwrites it
+archive_database = peewee.Proxy()
+
+class ArchiveModel(peewee.Model):
+    class Meta:
+        database = archive_database
+
+class ArchivedOrder(ArchiveModel):
+    market = peewee.IntegerField(db_column='market_id', null=True)
+    user = peewee.IntegerField(db_column='user_id', null=True)
+    price = peewee.FloatField()
+    quantity = peewee.IntegerField()
+    filled_quantity = peewee.IntegerField(default=0)
+    type = peewee.TextField()
+    status = peewee.TextField()
+
+    class Meta:
+        db_table = 'archived_order'
+        indexes = (
+            (('market', 'user'), False),
+            )
+
+class ArchivedMarketHistory(ArchiveModel):
+    market = peewee.IntegerField(db_column='market_id')
+    date = peewee.DateTimeField()
+    price = peewee.FloatField()
+    volume = peewee.FloatField()
+
+    class Meta:
+        db_table = 'archived_markethistory'
+        indexes = (
+            (('market', 'date'), False),
+            )
+
+class ArchivedTransaction(ArchiveModel):
+    account = peewee.IntegerField(db_column='account_id')
+    date = peewee.DateTimeField()
+    amount = peewee.FloatField()
+
+    class Meta:
+        db_table = 'archived_transaction'
+        indexes = (
+            (('account', 'date'), False),
+            )
+
+ARCHIVE_MODELS = (ArchivedOrder, ArchivedMarketHistory, ArchivedTransaction)
+
+def set_archive_database(database):
+    # a separate file, or the main database itself, archive tables have
+    # their own names
+    archive_database.initialize(database)
+
+def create_archive_tables():
+    for Model in ARCHIVE_MODELS:
+        Model.create_table(fail_silently=True)
+
+def get_archivable_markets(before):
+    markets = Market.select(Market.id).where(
+        Market.status << ['closed', 'resolved'],
+        Market.closing_date < before)
+
+    return [market.id for market in markets]
+
+def move_rows(query, Model, Archived, batch_size=500, pause=0, delete=None):
+    """Move the rows of a query to the archive, one batch at a time.
+
+    Every batch is copied to the archive first, then deleted from the main
+    database in its own short transaction, so trading goes on between
+    batches. A batch interrupted after its copy is copied again by the next
+    run, archived rows keep their id and are simply replaced.
+    """
+    fields = [Archived._meta.fields[name] for name in Archived._meta.sorted_field_names]
+    columns = [getattr(Model, field.name) for field in fields]
+
+    moved = 0
+    last_id = 0
+    while True:
+        rows = list(query.select(*columns).where(Model.id > last_id).order_by(Model.id).limit(batch_size).dicts())
+        if not rows:
+            return moved
+        last_id = rows[-1]['id']
+
+        with archive_database.atomic():
+            for batch in chunked(rows, 100):
+                Archived.insert_many(batch).upsert().execute()
+
+        with atomic():
+            Model.delete().where(Model.id << [row['id'] for row in rows]).execute()
+            if delete is not None:
+                delete(rows)
+
+        moved += len(rows)
+        if pause:
+            time.sleep(pause)
+
+def archive_orders(market_ids, batch_size=500, pause=0):
+    # pending orders of closed markets stay until they are resolved
+    moved = 0
+    for ids in chunked(market_ids, 500):
+        query = Order.select().where(Order.market << ids, Order.status != 'pending')
+        moved += move_rows(query, Order, ArchivedOrder, batch_size, pause)
+
+    return moved
+
+def archive_market_history(market_ids, batch_size=500, pause=0):
+    moved = 0
+    for ids in chunked(market_ids, 500):
+        query = MarketHistory.select().where(MarketHistory.market << ids)
+        moved += move_rows(query, MarketHistory, ArchivedMarketHistory, batch_size, pause)
+
+    return moved
+
+def roll_up_transactions(rows):
+    # the archived amounts of every account are added to its rollup row, the
+    # ledger left in the main database still sums up to the balance
+    amounts = dict()
+    dates = dict()
+    for row in rows:
+        amounts[row['account']] = amounts.get(row['account'], 0) + row['amount']
+        dates[row['account']] = max(dates.get(row['account'], row['date']), row['date'])
+
+    rollups = Transaction.select().where(
+        Transaction.account << list(amounts),
+        Transaction.rollup == True)
+
+    for rollup in rollups:
+        Transaction.update(
+            amount=Transaction.amount + amounts.pop(rollup.account_id),
+            date=max(rollup.date, dates[rollup.account_id])
+            ).where(Transaction.id == rollup.id).execute()
+
+    for (account_id, amount) in amounts.items():
+        Transaction.create(account=account_id, date=dates[account_id], amount=amount, rollup=True)
+
+def archive_transactions(before, batch_size=500, pause=0):
+    query = Transaction.select().where(
+        Transaction.date < before,
+        Transaction.rollup == False)
+
+    return move_rows(query, Transaction, ArchivedTransaction, batch_size, pause, roll_up_transactions)
+
+def archive(before, batch_size=500, pause=0):
+    """Move what trading does not read anymore to the archive.
+
+    Cleared and cancelled orders and the history of markets closed before
+    the given date are archived, along with ledger rows older than it.
+    Candles of archived markets stay in the main database for charts.
+    """
+    create_archive_tables()
+    market_ids = get_archivable_markets(before)
+
+    return dict(
+        markets=len(market_ids),
+        orders=archive_orders(market_ids, batch_size, pause),
+        history=archive_market_history(market_ids, batch_size, pause),
+        transactions=archive_transactions(before, batch_size, pause))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='move old orders, history and transactions to an archive')
+    parser.add_argument('--days', type=float, default=7, help='archive what is older than this many days')
+    parser.add_argument('--archive', default='pythia_archive.sqlite', help='archive database file')
+    parser.add_argument('--batch-size', type=int, default=500, help='rows moved per transaction')
+    parser.add_argument('--pause', type=float, default=0, help='seconds to wait between batches')
+    args = parser.parse_args()
+
+    set_archive_database(peewee.SqliteDatabase(args.archive))
+
+    before = datetime.datetime.now() - datetime.timedelta(days=args.days)
+    counts = archive(before, args.batch_size, args.pause)
+    print('archived %(orders)d orders and %(history)d history points of %(markets)d markets, '
+        '%(transactions)d transactions' % counts)
@@ -1,29 +1,102 @@
 #! /usr/bin/env
 
 import datetime
+import threading
 
-from data_model import Account, Transaction
+from data_model import atomic, chunked, insert_many, Account, Transaction
+from instrumentation import timed
+import risk
+
+# write-through cache of account ids by user id, accounts are never deleted
+_account_ids = dict()
+_account_ids_database = None
+_account_ids_lock = threading.Lock()
+
+def get_cached_account_ids(user_ids):
+    global _account_ids_database
+
+    with _account_ids_lock:
+        # ids cached from another database (e.g. after set_database) are stale
+        if _account_ids_database is not Account._meta.database:
+            _account_ids.clear()
+            _account_ids_database = Account._meta.database
+
+        return dict((user_id, _account_ids[user_id]) for user_id in user_ids if user_id in _account_ids)
+
+def cache_account_ids(account_ids):
+    with _account_ids_lock:
+        if _account_ids_database is Account._meta.database:
+            _account_ids.update(account_ids)
+
+def clear_account_ids():
+    with _account_ids_lock:
+        _account_ids.clear()
 
 def create_account(user):
     account = Account.create(
         user=user,
         balance=0
         )
+    cache_account_ids({account.user_id: account.id})
     return account
 
-def execute_transaction(user, price):
+def get_account_ids(user_ids):
+    user_ids = set(user_ids)
+    account_ids = get_cached_account_ids(user_ids)
+
+    missing_ids = [user_id for user_id in user_ids if user_id not in account_ids]
+    for ids in chunked(missing_ids, 500):
+        for account in Account.select(Account.id, Account.user).where(Account.user << ids):
+            account_ids[account.user_id] = account.id
+
+    for user_id in user_ids:
+        if user_id not in account_ids:
+            account_ids[user_id] = create_account(user_id).id
+
+    cache_account_ids(account_ids)
+    return account_ids
+
+def get_account_id(user):
+    user_id = getattr(user, 'id', user)
+
+    return get_account_ids([user_id])[user_id]
+
+@timed
+def execute_transfers(transfers, date=None):
+    # transfers are (user, amount) pairs, every one of them is written to the
+    # ledger and balances move once per account by the net amount
+    transfers = [(getattr(user, 'id', user), amount) for (user, amount) in transfers]
+    if not transfers:
+        return
+
+    if date is None:
+        date = datetime.datetime.now()
+
+    balances = dict()
+    for (user_id, amount) in transfers:
+        balances[user_id] = balances.get(user_id, 0) + amount
+
     try:
-        account = user.account.get()
-    except Account.DoesNotExist:
-        account = create_account(user)
-
-    transaction = Transaction.create(
-        account = account,
-        date = datetime.datetime.now(),
-        amount = price
-        )
-    transaction.save()
+        with atomic():
+            account_ids = get_account_ids(balances)
 
-    account.balance += transaction.amount
-    account.save()
+            insert_many(Transaction, [
+                dict(account=account_ids[user_id], date=date, amount=amount)
+                for (user_id, amount) in transfers
+                ])
 
+            # the balance is updated in sql, concurrent transfers cannot
+            # overwrite each other
+            for (user_id, amount) in balances.items():
+                if amount:
+                    Account.update(
+                        balance=Account.balance + amount
+                        ).where(Account.id == account_ids[user_id]).execute()
+    except Exception:
+        # accounts created in the rolled back transaction do not exist
+        clear_account_ids()
+        raise
+
+def execute_transaction(user, price):
+    execute_transfers([(user, price)])
+    risk.add_cash([(getattr(user, 'id', user), price)])
@@ -0,0 +1,106 @@
+#! /usr/bin/env python
+
+import sys
+import os.path as osp
+import argparse
+import datetime
+import random
+import tempfile
+import shutil
+import threading
+import time
+import peewee
+
+BENCH = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(BENCH)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import User, Market
+import prediction_market
+
+def reset_tables(database):
+    # other backends may hold tables of a previous run
+    cascade = isinstance(database, peewee.PostgresqlDatabase)
+    for Model in reversed(data_model.MODELS):
+        Model.drop_table(fail_silently=True, cascade=cascade)
+    data_model.create_tables()
+
+def get_client(app, user):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = str(user.id)
+        session['_fresh'] = True
+
+    return client
+
+def post_orders(client, market, n_orders, seed, latencies):
+    rng = random.Random(seed)
+    for i in range(n_orders):
+        start = time.time()
+        response = client.post('/market/%d' % market.id, data=dict(
+            price=rng.randint(40, 60),
+            quantity=rng.randint(1, 10),
+            action=rng.choice(('BUY', 'SELL'))))
+        latencies.append(time.time() - start)
+        assert response.status_code == 302, response.status_code
+
+def bench(url, n_threads, n_orders):
+    database = data_model.set_database(url)
+    reset_tables(database)
+
+    now = datetime.datetime.now()
+    market = Market.create(
+        name='bench', description='bench', status='open',
+        opening_date=now, closing_date=now + datetime.timedelta(1),
+        price=50, volume=0)
+    users = [User.create(email='user%d' % i, password='') for i in range(n_threads)]
+    data_model.close_database()
+
+    app = prediction_market.app
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RUN_SCHEDULER'] = False
+
+    latencies = list()
+    threads = [
+        threading.Thread(target=post_orders, args=(get_client(app, user), market, n_orders // n_threads, i, latencies))
+        for (i, user) in enumerate(users)
+        ]
+
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    prediction_market.matching_service.flush()
+    elapsed = time.time() - start
+
+    latencies.sort()
+    return (
+        len(latencies) / elapsed,
+        latencies[len(latencies) // 2],
+        latencies[int(len(latencies) * 0.99)])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='orders posted to /market/<id> by concurrent clients on each backend')
+    parser.add_argument('--database', action='append', default=[],
+        help='url of an extra database to benchmark, e.g. postgresql+pool://localhost/pythia_bench, its tables are dropped')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--orders', type=int, default=2000)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        urls = [
+            ('sqlite, rollback journal', 'sqlite:///%s?journal_mode=delete' % osp.join(temp_dir, 'delete.sqlite')),
+            ('sqlite, wal', 'sqlite:///%s' % osp.join(temp_dir, 'wal.sqlite')),
+            ('sqlite, wal, pooled', 'sqlite+pool:///%s' % osp.join(temp_dir, 'pool.sqlite')),
+            ] + [(url, url) for url in args.database]
+
+        print('%-28s %10s %10s %10s' % ('backend', 'orders/s', 'p50 (ms)', 'p99 (ms)'))
+        for (name, url) in urls:
+            (throughput, p50, p99) = bench(url, args.threads, args.orders)
+            print('%-28s %10.0f %10.1f %10.1f' % (name, throughput, p50 * 1000, p99 * 1000))
+    finally:
+        shutil.rmtree(temp_dir)
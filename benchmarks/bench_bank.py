@@ -0,0 +1,70 @@
+#! /usr/bin/env python
+
+import sys
+import os.path as osp
+import argparse
+import random
+import tempfile
+import shutil
+import time
+import peewee
+
+BENCH = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(BENCH)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import User, Account, insert_many
+import bank
+
+def setup(temp_dir, name, n_users):
+    database = peewee.SqliteDatabase(osp.join(temp_dir, name), check_same_thread=False)
+    data_model.set_database(database)
+    data_model.create_tables()
+
+    with data_model.atomic():
+        insert_many(User, [dict(email='user%d' % i, password='') for i in range(n_users)])
+
+    return [user.id for user in User.select(User.id)]
+
+def get_transfers(user_ids, n_transfers, seed=0):
+    rng = random.Random(seed)
+    return [(rng.choice(user_ids), float(rng.randint(-100, 100))) for i in range(n_transfers)]
+
+def check(transfers):
+    balances = dict()
+    for (user_id, amount) in transfers:
+        balances[user_id] = balances.get(user_id, 0) + amount
+
+    for account in Account.select():
+        assert account.balance == balances[account.user_id]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='bulk transfers against one transaction per transfer')
+    parser.add_argument('--transfers', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        user_ids = setup(temp_dir, 'loop.sqlite', args.users)
+        transfers = get_transfers(user_ids, args.transfers)
+        start = time.time()
+        for (user_id, amount) in transfers:
+            bank.execute_transaction(user_id, amount)
+        loop = time.time() - start
+        check(transfers)
+
+        user_ids = setup(temp_dir, 'bulk.sqlite', args.users)
+        transfers = get_transfers(user_ids, args.transfers)
+        start = time.time()
+        bank.execute_transfers(transfers)
+        bulk = time.time() - start
+        check(transfers)
+
+        print('%d transfers over %d users' % (args.transfers, args.users))
+        print('execute_transaction loop: %8.3f s' % loop)
+        print('execute_transfers:        %8.3f s (%.0fx)' % (bulk, loop / bulk))
+    finally:
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,72 @@
+#! /usr/bin/env python
+
+import sys
+import os.path as osp
+import random
+import timeit
+import collections
+
+BENCH = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(BENCH)
+sys.path.append(ROOT)
+
+import market_maker
+
+UnitOrder = collections.namedtuple('UnitOrder', ['price', 'quantity'])
+
+def get_unit_market_clearing_price(sell_orders, buy_orders):
+    # previous implementation expanding every order into unit orders
+    unit_sell_orders = list()
+    for order in sell_orders:
+        for i in range(order.quantity):
+            unit_sell_orders.append(order.price)
+
+    unit_buy_orders = list()
+    for order in buy_orders:
+        for i in range(order.quantity):
+            unit_buy_orders.append(order.price)
+
+    k = 0
+    K = min(len(unit_sell_orders), len(unit_buy_orders))
+    while (k < K and unit_sell_orders[k] <= unit_buy_orders[k]):
+        k+=1
+
+    return k
+
+def make_orders(n_orders, max_quantity, seed=0):
+    rng = random.Random(seed)
+    sell_orders = sorted([
+        UnitOrder(rng.randint(0, 100), rng.randint(1, max_quantity))
+        for i in range(n_orders)
+        ], key=lambda order: order.price)
+    buy_orders = sorted([
+        UnitOrder(rng.randint(0, 100), rng.randint(1, max_quantity))
+        for i in range(n_orders)
+        ], key=lambda order: -order.price)
+
+    return sell_orders, buy_orders
+
+def bench(n_orders, max_quantity, repeat=3, unit=True):
+    (sell_orders, buy_orders) = make_orders(n_orders, max_quantity)
+
+    levels = min(timeit.repeat(
+        lambda: market_maker.get_market_clearing_price(None, sell_orders, buy_orders),
+        number=1, repeat=repeat))
+
+    units = None
+    if unit:
+        units = min(timeit.repeat(
+            lambda: get_unit_market_clearing_price(sell_orders, buy_orders),
+            number=1, repeat=repeat))
+
+    return levels, units
+
+if __name__ == '__main__':
+    print('%8s %12s %12s %12s' % ('orders', 'max qty', 'levels (ms)', 'units (ms)'))
+    for (n_orders, max_quantity) in ((100, 10), (100, 1000), (100, 100000), (1000, 1000000), (100000, 1000000)):
+        # the unit expansion allocates one entry per share, skip it past 10M shares
+        unit = n_orders * max_quantity <= 10000000
+        (levels, units) = bench(n_orders, max_quantity, unit=unit)
+        print('%8d %12d %12.3f %12s' % (
+            n_orders, max_quantity, levels * 1000, '%.3f' % (units * 1000) if unit else '-'))
@@ -0,0 +1,118 @@
+#! /usr/bin/env python
+
+import sys
+import os
+import os.path as osp
+import argparse
+import datetime
+import random
+import tempfile
+import shutil
+import timeit
+import peewee
+
+BENCH = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(BENCH)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import User, Market, MarketHistory, Stock, Order, Account
+from data_model import insert_many
+from order_book import OrderBook
+import migrations
+
+def seed(n_orders, n_markets, n_users, pending_ratio, seed=0):
+    rng = random.Random(seed)
+    now = datetime.datetime.now()
+    database = data_model.get_database()
+
+    with database.atomic():
+        insert_many(User, [dict(email='user%d' % i, password='') for i in range(n_users)])
+        insert_many(Market, [
+            dict(name='market%d' % i, description='', status='open',
+                opening_date=now, closing_date=now, price=50, volume=0)
+            for i in range(n_markets)
+            ])
+        insert_many(Account, [dict(user=i + 1, balance=0) for i in range(n_users)])
+
+    batch = list()
+    for i in range(n_orders):
+        batch.append(dict(
+            market=rng.randint(1, n_markets),
+            user=rng.randint(1, n_users),
+            price=rng.randint(1, 99),
+            quantity=rng.randint(1, 10),
+            type=rng.choice(('buy', 'sell')),
+            status='pending' if rng.random() < pending_ratio else 'cleared'))
+
+        if len(batch) == 100000 or i == n_orders - 1:
+            with database.atomic():
+                insert_many(Order, batch)
+                insert_many(Stock, [dict(market=o['market'], user=o['user'], quantity=o['quantity']) for o in batch[::10]])
+                insert_many(MarketHistory, [dict(market=o['market'], date=now, price=o['price'], volume=1) for o in batch[::10]])
+            batch = list()
+
+def get_queries(n_markets, n_users, rng):
+    return (
+        ('order book load', lambda: list(OrderBook.load(rng.randint(1, n_markets)).get_sell_orders())),
+        ('sell orders by price', lambda: list(Order.select().where(
+            Order.market == rng.randint(1, n_markets),
+            Order.type == 'sell',
+            Order.status == 'pending').order_by(Order.price.asc()))),
+        ('stock by market, user', lambda: list(Stock.select().where(
+            Stock.market == rng.randint(1, n_markets),
+            Stock.user == rng.randint(1, n_users)))),
+        ('history by market, date', lambda: list(MarketHistory.select().where(
+            MarketHistory.market == rng.randint(1, n_markets)).order_by(MarketHistory.date.desc()))),
+        ('account by user', lambda: list(Account.select().where(
+            Account.user == rng.randint(1, n_users)))),
+        ('open markets', lambda: list(Market.select().where(Market.status == 'open'))),
+        )
+
+def drop_indexes(database):
+    for Model in data_model.MODELS:
+        for (field_names, unique) in Model._meta.indexes or ():
+            database.drop_index(Model, [Model._meta.fields[name] for name in field_names], True)
+    database.execute_sql('DROP INDEX IF EXISTS "order_pending"')
+    database.execute_sql('DELETE FROM "schemamigration"')
+
+def time_queries(queries, number):
+    timings = list()
+    for (name, query) in queries:
+        timings.append(min(timeit.repeat(query, number=number, repeat=3)) / number)
+
+    return timings
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='time the hot queries with and without indexes')
+    parser.add_argument('--orders', type=int, default=2000000)
+    parser.add_argument('--markets', type=int, default=20)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--pending', type=float, default=0.05)
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        database = peewee.SqliteDatabase(osp.join(temp_dir, 'pythia.sqlite'), check_same_thread=False)
+        data_model.set_database(database)
+        data_model.create_tables()
+        seed(args.orders, args.markets, args.users, args.pending)
+
+        queries = get_queries(args.markets, args.users, random.Random(1))
+
+        drop_indexes(database)
+        database.execute_sql('ANALYZE')
+        before = time_queries(queries, args.number)
+
+        migrations.migrate()
+        database.execute_sql('ANALYZE')
+        after = time_queries(queries, args.number)
+
+        print('%d orders, %d markets, %d users' % (args.orders, args.markets, args.users))
+        print('%-26s %14s %14s %8s' % ('query', 'before (ms)', 'after (ms)', 'speedup'))
+        for ((name, query), b, a) in zip(queries, before, after):
+            print('%-26s %14.3f %14.3f %7.1fx' % (name, b * 1000, a * 1000, b / a))
+    finally:
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,75 @@
+#! /usr/bin/env python
+
+import sys
+import os.path as osp
+import argparse
+import datetime
+import random
+import tempfile
+import shutil
+import time
+import peewee
+
+BENCH = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(BENCH)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import User, Market
+from matching_service import MatchingService
+
+class CountingMatchingService(MatchingService):
+
+    def __init__(self, *args, **kwargs):
+        super(CountingMatchingService, self).__init__(*args, **kwargs)
+        self.clears = 0
+
+    def clear(self, market_id):
+        self.clears += 1
+        super(CountingMatchingService, self).clear(market_id)
+
+def bench(n_orders, **market_config):
+    temp_dir = tempfile.mkdtemp()
+    try:
+        database = peewee.SqliteDatabase(osp.join(temp_dir, 'pythia.sqlite'), check_same_thread=False)
+        data_model.set_database(database)
+        data_model.create_tables()
+
+        now = datetime.datetime.now()
+        market = Market.create(
+            name='bench', description='bench', status='open',
+            opening_date=now, closing_date=now + datetime.timedelta(1),
+            price=50, volume=0, **market_config)
+        users = [User.create(email='user%d' % i, password='') for i in range(10)]
+
+        rng = random.Random(0)
+        service = CountingMatchingService().start()
+
+        start = time.time()
+        for i in range(n_orders):
+            service.submit(
+                market, rng.choice(users), rng.randint(40, 60), rng.randint(1, 10),
+                rng.choice(('buy', 'sell')))
+        submitted = time.time()
+        service.flush()
+        cleared = time.time()
+        service.stop()
+
+        return submitted - start, cleared - start, service.clears
+    finally:
+        shutil.rmtree(temp_dir)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='burst of orders on one market, continuous and batch clearing')
+    parser.add_argument('--orders', type=int, default=2000)
+    args = parser.parse_args()
+
+    print('%-28s %14s %14s %8s %10s' % ('mode', 'submit (s)', 'cleared (s)', 'clears', 'orders/s'))
+    for (name, config) in (
+            ('continuous', dict()),
+            ('batch, 100 ms', dict(clearing_mode='batch', batch_interval=100)),
+            ('batch, 200 orders', dict(clearing_mode='batch', batch_size=200)),
+            ):
+        (submit, cleared, clears) = bench(args.orders, **config)
+        print('%-28s %14.3f %14.3f %8d %10.0f' % (name, submit, cleared, clears, args.orders / cleared))
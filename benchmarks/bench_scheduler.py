@@ -0,0 +1,67 @@
+#! /usr/bin/env python
+
+import sys
+import os.path as osp
+import argparse
+import datetime
+import tempfile
+import shutil
+import time
+import peewee
+
+BENCH = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(BENCH)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import Market, insert_many
+from scheduler import MarketScheduler
+import market_maker
+
+def setup(temp_dir, name, n_markets, n_due):
+    database = peewee.SqliteDatabase(osp.join(temp_dir, name), check_same_thread=False)
+    data_model.set_database(database)
+    data_model.create_tables()
+
+    now = datetime.datetime.now()
+    with data_model.atomic():
+        insert_many(Market, [
+            dict(name='market%d' % i, description='', status='open',
+                opening_date=now, price=50, volume=0,
+                closing_date=now + datetime.timedelta(hours=-1 if i < n_due else 1))
+            for i in range(n_markets)
+            ])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='closing markets on page views against the scheduler')
+    parser.add_argument('--markets', type=int, default=10000)
+    parser.add_argument('--due', type=int, default=1000)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        # what the home view used to do on every page load
+        setup(temp_dir, 'scan.sqlite', args.markets, args.due)
+        start = time.time()
+        markets = Market.select().where(Market.status == 'open')
+        closed = sum([market_maker.close_market(market) for market in markets])
+        scan = time.time() - start
+        assert closed == args.due
+
+        setup(temp_dir, 'scheduler.sqlite', args.markets, args.due)
+        scheduler = MarketScheduler()
+        start = time.time()
+        scheduler.load()
+        loaded = time.time()
+        closed = len(scheduler.close_due())
+        scheduled = time.time()
+        assert closed == args.due
+        assert Market.select().where(Market.status == 'closed').count() == args.due
+
+        print('%d open markets, %d due' % (args.markets, args.due))
+        print('page view scan:       %8.3f s' % scan)
+        print('scheduler load:       %8.3f s (once per refresh)' % (loaded - start))
+        print('scheduler close due:  %8.3f s' % (scheduled - loaded))
+    finally:
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,314 @@
+#! /usr/bin/env python
+
+import sys
+import os.path as osp
+import argparse
+import contextlib
+import datetime
+import json
+import random
+import tempfile
+import shutil
+import time
+
+BENCH = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(BENCH)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import User, Market, Order, Account, insert_many
+import market_maker
+import bank
+import portfolio
+
+# seeded orders: buy and sell prices are drawn around MID_PRICE, the two
+# sides overlap by about SPREAD so that every book has something to clear
+MID_PRICE = 50
+SPREAD = 4
+
+def get_price(rng, type, distribution):
+    if distribution == 'normal':
+        mean = MID_PRICE + (SPREAD if type == 'sell' else -SPREAD) / 2.
+        price = int(round(rng.gauss(mean, 5)))
+    else:
+        price = rng.randint(MID_PRICE - 20, MID_PRICE + 20)
+
+    return min(max(price, 1), 99)
+
+def get_quantity(rng, distribution):
+    if distribution == 'pareto':
+        # a few very large orders, most of them small
+        return min(int(rng.paretovariate(1.5)), 1000)
+
+    return rng.randint(1, 10)
+
+def get_market(rng, n_markets, distribution):
+    if distribution == 'zipf':
+        # market k gets about 1/k of the orders
+        return min(int(rng.paretovariate(1)), n_markets)
+
+    return rng.randint(1, n_markets)
+
+def seed(n_users, n_markets, n_orders, prices='normal', quantities='uniform', markets='uniform', seed=0):
+    # rows are inserted in bulk, books are loaded from them as usual
+    rng = random.Random(seed)
+    now = datetime.datetime.now()
+    database = data_model.get_database()
+
+    with database.atomic():
+        insert_many(User, [dict(email='user%d' % i, password='', active=True) for i in range(n_users)])
+        insert_many(Account, [dict(user=i + 1, balance=0) for i in range(n_users)])
+        insert_many(Market, [
+            dict(name='market%d' % i, description='', status='open',
+                opening_date=now, closing_date=now + datetime.timedelta(1), price=MID_PRICE, volume=0)
+            for i in range(n_markets)
+            ])
+
+    batch = list()
+    for i in range(n_orders):
+        type = rng.choice(('buy', 'sell'))
+        batch.append(dict(
+            market=get_market(rng, n_markets, markets),
+            user=rng.randint(1, n_users),
+            type=type,
+            status='pending',
+            price=get_price(rng, type, prices),
+            quantity=get_quantity(rng, quantities),
+            filled_quantity=0))
+
+        if len(batch) == 100000 or i == n_orders - 1:
+            with database.atomic():
+                insert_many(Order, batch)
+            batch = list()
+
+@contextlib.contextmanager
+def count_queries(database, counter):
+    # every statement goes through execute_sql, whichever thread runs it
+    execute_sql = database.execute_sql
+
+    def counting_execute_sql(*args, **kwargs):
+        counter[0] += 1
+        return execute_sql(*args, **kwargs)
+
+    database.execute_sql = counting_execute_sql
+    try:
+        yield counter
+    finally:
+        del database.execute_sql
+
+def percentile(latencies, q):
+    return latencies[min(int(len(latencies) * q), len(latencies) - 1)]
+
+def measure(operation, number, flush=None):
+    """Run operation(i) number times.
+
+    Returns the throughput, p50 and p99 latencies (ms) and the queries per
+    operation, flush waits for work the operations left to background
+    threads, it is part of the throughput and the query counts.
+    """
+    counter = [0]
+    latencies = list()
+    with count_queries(data_model.get_database(), counter):
+        start = time.time()
+        for i in range(number):
+            operation_start = time.time()
+            operation(i)
+            latencies.append(time.time() - operation_start)
+        if flush is not None:
+            flush()
+        elapsed = time.time() - start
+
+    latencies.sort()
+    return dict(
+        ops_per_s=number / elapsed,
+        p50_ms=percentile(latencies, 0.5) * 1000,
+        p99_ms=percentile(latencies, 0.99) * 1000,
+        queries=float(counter[0]) / number)
+
+def get_library_scenarios(args, rng):
+    user_ids = range(1, args.users + 1)
+    market_ids = range(1, args.markets + 1)
+
+    def place_order(i):
+        type = rng.choice(('buy', 'sell'))
+        market_maker.place_order(
+            rng.choice(market_ids), rng.choice(user_ids), type,
+            get_price(rng, type, args.prices), get_quantity(rng, args.quantities))
+
+    def submit_orders(i):
+        orders = list()
+        for j in range(100):
+            type = rng.choice(('buy', 'sell'))
+            orders.append(dict(
+                market=rng.choice(market_ids), user=rng.choice(user_ids), type=type,
+                price=get_price(rng, type, args.prices), quantity=get_quantity(rng, args.quantities)))
+        market_maker.submit_orders(orders)
+
+    def execute_transfers(i):
+        bank.execute_transfers([(rng.choice(user_ids), float(rng.randint(-100, 100))) for j in range(1000)])
+
+    return (
+        # the first scenario loads every book
+        ('get_market_clearing_price', lambda i: market_maker.get_market_clearing_price(market_ids[i % len(market_ids)]), max(args.number, len(market_ids))),
+        ('place_order', place_order, args.number),
+        ('submit_orders, 100 orders', submit_orders, max(args.number // 100, 1)),
+        ('execute_transaction', lambda i: bank.execute_transaction(rng.choice(user_ids), 1.), args.number),
+        ('execute_transfers, 1000 transfers', execute_transfers, max(args.number // 100, 1)),
+        # every seeded book crosses, clearing one market empties it
+        ('clear_market', lambda i: market_maker.clear_market(Market.get(Market.id == market_ids[i])), len(market_ids)),
+        # every account and the stocks the clears created
+        ('get_leaderboard, 100 leaders', lambda i: portfolio.get_leaderboard(100), max(args.number // 10, 1)),
+        )
+
+def get_client(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    return client
+
+def get_flask_scenarios(args, rng):
+    import prediction_market
+
+    app = prediction_market.app
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RUN_SCHEDULER'] = False
+    client = get_client(app, 1)
+    market_ids = range(1, args.markets + 1)
+
+    def get(url):
+        response = client.get(url)
+        assert response.status_code == 200, (url, response.status_code)
+
+    def post_order(i):
+        type = rng.choice(('buy', 'sell'))
+        response = client.post('/market/%d' % rng.choice(market_ids), data=dict(
+            price=get_price(rng, type, args.prices),
+            quantity=get_quantity(rng, args.quantities),
+            action=type.upper()))
+        assert response.status_code == 302, response.status_code
+
+    def post_orders(i):
+        orders = list()
+        for j in range(10):
+            type = rng.choice(('buy', 'sell'))
+            orders.append(dict(
+                market=rng.choice(market_ids), type=type,
+                price=get_price(rng, type, args.prices), quantity=get_quantity(rng, args.quantities)))
+        response = client.post('/api/orders', data=json.dumps(dict(orders=orders)), content_type='application/json')
+        assert response.status_code == 201, response.status_code
+
+    flush = prediction_market.matching_service.flush
+
+    return (
+        ('GET /', lambda i: get('/'), args.number),
+        ('GET /market/<id>', lambda i: get('/market/%d' % rng.choice(market_ids)), args.number),
+        ('GET /api/markets/<id>/book', lambda i: get('/api/markets/%d/book' % rng.choice(market_ids)), args.number),
+        ('POST /market/<id>', post_order, args.number, flush),
+        ('POST /api/orders, 10 orders', post_orders, max(args.number // 10, 1), flush),
+        )
+
+def run(args):
+    rng = random.Random(args.seed)
+    results = dict()
+
+    scenarios = list()
+    if 'library' in args.drivers:
+        scenarios.extend(get_library_scenarios(args, rng))
+    if 'flask' in args.drivers:
+        scenarios.extend(get_flask_scenarios(args, rng))
+
+    for scenario in scenarios:
+        (name, operation, number) = scenario[:3]
+        results[name] = measure(operation, number, *scenario[3:])
+        report(name, results[name])
+
+    return results
+
+def report(name, result, baseline=None, regressions=()):
+    line = '%-36s %10.0f %10.2f %10.2f %10.1f' % (
+        name, result['ops_per_s'], result['p50_ms'], result['p99_ms'], result['queries'])
+    if baseline is not None:
+        line += ' %+9.0f%% %+9.0f%%   %s' % (
+            (result['p99_ms'] / baseline['p99_ms'] - 1) * 100 if baseline['p99_ms'] else 0,
+            (result['queries'] / baseline['queries'] - 1) * 100 if baseline['queries'] else 0,
+            ', '.join(regressions))
+    print(line)
+
+def get_regressions(result, baseline, tolerance, query_tolerance):
+    # queries only vary with how background clearing batched the orders,
+    # they get a tighter tolerance than timings
+    regressions = list()
+    if result['ops_per_s'] * (1 + tolerance) < baseline['ops_per_s']:
+        regressions.append('throughput')
+    for key in ('p50_ms', 'p99_ms'):
+        if result[key] > baseline[key] * (1 + tolerance):
+            regressions.append(key[:3])
+    if result['queries'] > baseline['queries'] * (1 + query_tolerance) + 0.5:
+        regressions.append('queries')
+
+    return regressions
+
+def get_config(args):
+    return dict((key, getattr(args, key)) for key in (
+        'users', 'markets', 'orders', 'prices', 'quantities', 'market_popularity', 'number', 'seed'))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='seed synthetic markets, users and orders then time the order, clearing and bank paths')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--markets', type=int, default=20)
+    parser.add_argument('--orders', type=int, default=200000, help='orders seeded before timing')
+    parser.add_argument('--prices', choices=('normal', 'uniform'), default='normal')
+    parser.add_argument('--quantities', choices=('uniform', 'pareto'), default='uniform')
+    parser.add_argument('--market-popularity', choices=('uniform', 'zipf'), default='uniform')
+    parser.add_argument('--number', type=int, default=200, help='operations timed per scenario')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--drivers', choices=('library', 'flask'), action='append',
+        help='library functions, flask routes through the test client, or both (the default)')
+    parser.add_argument('--save', help='save the results as a baseline to this json file')
+    parser.add_argument('--baseline', help='compare with a baseline json file, exits with 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='relative slowdown allowed before a timing regresses')
+    parser.add_argument('--query-tolerance', type=float, default=0.1, help='relative increase of queries allowed')
+    args = parser.parse_args()
+    args.drivers = args.drivers or ['library', 'flask']
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        data_model.set_database('sqlite:///%s' % osp.join(temp_dir, 'pythia.sqlite'))
+        data_model.create_tables()
+        seed(args.users, args.markets, args.orders, args.prices, args.quantities, args.market_popularity, args.seed)
+
+        print('%d users, %d markets, %d orders' % (args.users, args.markets, args.orders))
+        print('%-36s %10s %10s %10s %10s' % ('scenario', 'ops/s', 'p50 (ms)', 'p99 (ms)', 'queries'))
+        results = run(args)
+    finally:
+        if 'prediction_market' in sys.modules:
+            sys.modules['prediction_market'].matching_service.stop()
+        data_model.close_database()
+        shutil.rmtree(temp_dir)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(dict(config=get_config(args), results=results), f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['config'] != get_config(args):
+            print('warning: the baseline was run with %s' % baseline['config'])
+
+        print('')
+        print('compared with %s' % args.baseline)
+        print('%-36s %10s %10s %10s %10s %10s %10s   %s' % (
+            'scenario', 'ops/s', 'p50 (ms)', 'p99 (ms)', 'queries', 'p99', 'queries', 'regressed'))
+        failed = False
+        for name in sorted(results):
+            if name not in baseline['results']:
+                continue
+            regressions = get_regressions(results[name], baseline['results'][name], args.tolerance, args.query_tolerance)
+            report(name, results[name], baseline['results'][name], regressions)
+            failed = failed or bool(regressions)
+
+        sys.exit(1 if failed else 0)
@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+
+import time
+import threading
+import collections
+
+class LocalBackend(object):
+    """In-process LRU store with a time to live per entry.
+
+    Backends share the get/set/delete/flush_all interface of memcached
+    clients, so a shared cache can be plugged in when several processes
+    serve the site.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+
+            (value, expires) = entry
+            if expires and expires < time.time():
+                return None
+
+            # most recently used entries are kept at the end
+            self.entries[key] = entry
+            return value
+
+    def set(self, key, value, time_to_live=0):
+        expires = time.time() + time_to_live if time_to_live else 0
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, expires)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def flush_all(self):
+        with self.lock:
+            self.entries.clear()
+
+class Cache(object):
+    """Read-through cache of plain values over a pluggable backend.
+
+    Cached values are invalidated explicitly when what they were built from
+    changes, the time to live only bounds staleness from writers the
+    process does not know about.
+    """
+
+    def __init__(self, backend=None, time_to_live=10):
+        self.backend = backend if backend is not None else LocalBackend()
+        self.time_to_live = time_to_live
+        self.source = None
+        self.invalidations = 0
+        # values are stored and invalidated under the lock, loaded outside
+        self.lock = threading.Lock()
+
+    def bind(self, source):
+        # values loaded from another source (e.g. after set_database) are stale
+        with self.lock:
+            if source is not self.source:
+                self.invalidations += 1
+                self.backend.flush_all()
+                self.source = source
+
+    def get(self, key, load):
+        value = self.backend.get(key)
+        if value is None:
+            with self.lock:
+                invalidations = self.invalidations
+            value = load()
+
+            # a value loaded while something was invalidated may be stale
+            with self.lock:
+                if invalidations == self.invalidations:
+                    self.backend.set(key, value, self.time_to_live)
+
+        return value
+
+    def delete(self, *keys):
+        with self.lock:
+            self.invalidations += 1
+            for key in keys:
+                self.backend.delete(key)
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += 1
+            self.backend.flush_all()
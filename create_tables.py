@@ -1,5 +1,7 @@
 #! /usr/bin/env python 
 
 from data_model import create_tables
+from migrations import migrate
 
-create_tables()
\ No newline at end of file
+create_tables()
+migrate()
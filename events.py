@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class Subscription(object):
+    """Events of one market waiting to be read by a subscriber.
+
+    Subscribers reading slower than events are published do not hold
+    memory forever: once max_pending events are waiting the subscription
+    is marked as overflowed and stops receiving, the reader is expected to
+    start over from a fresh snapshot.
+    """
+
+    def __init__(self, market_id, max_pending=1000):
+        self.market_id = market_id
+        self.queue = queue.Queue(max_pending)
+        self.overflowed = False
+
+    def put(self, event):
+        if self.overflowed:
+            return
+
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout=None):
+        # None when no event was published before the timeout
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class EventBus(object):
+    """In-process publish/subscribe of market events.
+
+    Every event of a market carries a sequence number, so a reader can tell
+    which events a snapshot read at some sequence already includes.
+    Publishing to a market nobody watches only bumps its sequence.
+    Listeners get the events of every market, e.g. to forward them to
+    another process.
+    """
+
+    def __init__(self, max_pending=1000):
+        self.max_pending = max_pending
+        self.subscriptions = dict()
+        self.sequences = dict()
+        self.listeners = list()
+        self.lock = threading.Lock()
+
+    def subscribe(self, market_id):
+        subscription = Subscription(market_id, self.max_pending)
+        with self.lock:
+            self.subscriptions.setdefault(market_id, set()).add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.market_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.market_id]
+
+    def add_listener(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+
+    def has_subscribers(self, market_id):
+        return bool(self.listeners) or market_id in self.subscriptions
+
+    def get_sequence(self, market_id):
+        with self.lock:
+            return self.sequences.get(market_id, 0)
+
+    def publish(self, market_id, type, **data):
+        with self.lock:
+            sequence = self.sequences[market_id] = self.sequences.get(market_id, 0) + 1
+            subscriptions = list(self.subscriptions.get(market_id, ()))
+
+        event = dict(data, id=sequence, market=market_id, type=type)
+        for subscription in subscriptions:
+            subscription.put(event)
+        for listener in self.listeners:
+            listener(event)
+
+        return event
+
+bus = EventBus()
+
+def subscribe(market_id):
+    return bus.subscribe(market_id)
+
+def unsubscribe(subscription):
+    bus.unsubscribe(subscription)
+
+def has_subscribers(market_id):
+    return bus.has_subscribers(market_id)
+
+def get_sequence(market_id):
+    return bus.get_sequence(market_id)
+
+def publish(market_id, type, **data):
+    return bus.publish(market_id, type, **data)
@@ -0,0 +1,161 @@
+#! /usr/bin/env python
+
+import datetime
+import operator
+import functools
+
+from data_model import insert_many, MarketHistory, MarketCandle
+
+# candle resolutions in seconds
+RESOLUTIONS = (1, 60, 300, 900, 3600)
+
+# most points a market chart embeds, whatever the activity of the market
+CHART_POINTS = 300
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# dates of the trades and candles served in pages, and of their cursors
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# most points served in one page
+MAX_PAGE = 1000
+
+def get_candle_date(date, resolution):
+    delta = date - EPOCH
+    seconds = delta.days * 86400 + delta.seconds
+
+    return EPOCH + datetime.timedelta(seconds=seconds - seconds % resolution)
+
+def add_trade(market, date, price, volume):
+    """Fold a trade into the current candle of every resolution.
+
+    The candles the trade falls in are read with one query, then each one
+    is updated, or created when the trade opens it.
+    """
+    market_id = getattr(market, 'id', market)
+    dates = dict((resolution, get_candle_date(date, resolution)) for resolution in RESOLUTIONS)
+
+    candles = MarketCandle.select().where(
+        MarketCandle.market == market_id,
+        functools.reduce(operator.or_, [
+            (MarketCandle.resolution == resolution) & (MarketCandle.date == candle_date)
+            for (resolution, candle_date) in dates.items()
+            ]))
+    candles = dict((candle.resolution, candle) for candle in candles)
+
+    new_candles = list()
+    for (resolution, candle_date) in dates.items():
+        candle = candles.get(resolution)
+        if candle is None:
+            new_candles.append(dict(
+                market=market_id,
+                resolution=resolution,
+                date=candle_date,
+                open=price,
+                high=price,
+                low=price,
+                close=price,
+                volume=volume))
+        else:
+            MarketCandle.update(
+                high=max(candle.high, price),
+                low=min(candle.low, price),
+                close=price,
+                volume=MarketCandle.volume + volume
+                ).where(MarketCandle.id == candle.id).execute()
+
+    insert_many(MarketCandle, new_candles)
+
+def rebuild_candles(market):
+    """Recompute the candles of a market from its whole history."""
+    market_id = getattr(market, 'id', market)
+    MarketCandle.delete().where(MarketCandle.market == market_id).execute()
+
+    history = MarketHistory.select(
+        MarketHistory.date, MarketHistory.price, MarketHistory.volume
+        ).where(MarketHistory.market == market_id).order_by(MarketHistory.date.asc())
+
+    candles = dict()
+    for point in history:
+        for resolution in RESOLUTIONS:
+            key = (resolution, get_candle_date(point.date, resolution))
+            candle = candles.get(key)
+            if candle is None:
+                candles[key] = dict(
+                    market=market_id,
+                    resolution=resolution,
+                    date=key[1],
+                    open=point.price,
+                    high=point.price,
+                    low=point.price,
+                    close=point.price,
+                    volume=point.volume)
+            else:
+                candle['high'] = max(candle['high'], point.price)
+                candle['low'] = min(candle['low'], point.price)
+                candle['close'] = point.price
+                candle['volume'] += point.volume
+
+    insert_many(MarketCandle, list(candles.values()))
+
+def get_page(query, Model, before, limit):
+    # keyset on (date, id), trades cleared together share their date
+    if before is not None:
+        (date, id) = before
+        query = query.where((Model.date < date) | ((Model.date == date) & (Model.id < id)))
+
+    return query.order_by(Model.date.desc(), Model.id.desc()).limit(limit)
+
+def parse_page_args(args):
+    """Limit and (date, id) cursor of a page requested by the query string
+    args of a request, the cursor is None for the first page.
+
+    Raises ValueError when the cursor is malformed.
+    """
+    # a page holds at least one point, or the cursor of the next page
+    # would be lost
+    limit = min(max(args.get('limit', 100, type=int), 1), MAX_PAGE)
+    before = args.get('before')
+    if before:
+        before = (datetime.datetime.strptime(before, DATE_FORMAT), int(args.get('before_id', '')))
+
+    return (limit, before)
+
+def get_history(market, before=None, limit=100):
+    """Page through the trades of a market, most recent first.
+
+    Pages are keyed on the (date, id) of the last trade seen, pass it as
+    before to get the next page.
+    """
+    market_id = getattr(market, 'id', market)
+    history = MarketHistory.select().where(MarketHistory.market == market_id)
+
+    return get_page(history, MarketHistory, before, limit)
+
+def get_candles(market, resolution, before=None, limit=100):
+    """Page through the candles of a market, most recent first."""
+    market_id = getattr(market, 'id', market)
+    candles = MarketCandle.select().where(
+        MarketCandle.market == market_id,
+        MarketCandle.resolution == resolution)
+
+    return get_page(candles, MarketCandle, before, limit)
+
+def get_chart_resolution(opening_date, closing_date, points=CHART_POINTS):
+    # finest resolution fitting the lifetime of the market in the chart
+    delta = closing_date - opening_date
+    seconds = delta.days * 86400 + delta.seconds
+
+    for resolution in RESOLUTIONS:
+        if seconds <= resolution * points:
+            return resolution
+
+    return RESOLUTIONS[-1]
+
+def get_chart(market, opening_date, closing_date, points=CHART_POINTS):
+    # the chart is bounded by points however many trades the market had
+    resolution = get_chart_resolution(opening_date, closing_date, points)
+    candles = list(get_candles(market, resolution, limit=points))
+    candles.reverse()
+
+    return candles
@@ -0,0 +1,236 @@
+#! /usr/bin/env python
+
+import bisect
+import functools
+import json
+import logging
+import threading
+import time
+
+from data_model import get_database
+
+logger = logging.getLogger(__name__)
+
+# histogram buckets, seconds a stage took and queries it ran
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# the same statement run this many times under one root stage is reported
+# as an n+1 pattern, a query per row where one query for all rows would do
+N_PLUS_ONE_THRESHOLD = 10
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics(object):
+    """Histograms of the time and the queries of every stage, and the n+1
+    patterns seen so far."""
+
+    def __init__(self):
+        self.seconds = dict()
+        self.queries = dict()
+        self.n_plus_one = dict()
+        self.lock = threading.Lock()
+
+    def observe(self, name, seconds, queries):
+        with self.lock:
+            histogram = self.seconds.get(name)
+            if histogram is None:
+                histogram = self.seconds[name] = Histogram(SECONDS_BUCKETS)
+                self.queries[name] = Histogram(QUERIES_BUCKETS)
+            histogram.observe(seconds)
+            self.queries[name].observe(queries)
+
+    def flag_n_plus_one(self, name, sql, count):
+        # True the first time the statement is flagged under this stage
+        with self.lock:
+            key = (name, sql)
+            flagged = key in self.n_plus_one
+            self.n_plus_one[key] = max(self.n_plus_one.get(key, 0), count)
+
+        return not flagged
+
+    def render(self):
+        # prometheus text format
+        lines = list()
+        with self.lock:
+            for (metric, histograms) in (('pythia_stage_seconds', self.seconds), ('pythia_stage_queries', self.queries)):
+                lines.append('# TYPE %s histogram' % metric)
+                for name in sorted(histograms):
+                    histogram = histograms[name]
+                    cumulated = 0
+                    for (bound, count) in zip(histogram.buckets + ('+Inf', ), histogram.counts):
+                        cumulated += count
+                        lines.append('%s_bucket{stage="%s",le="%s"} %d' % (metric, name, bound, cumulated))
+                    lines.append('%s_sum{stage="%s"} %s' % (metric, name, histogram.sum))
+                    lines.append('%s_count{stage="%s"} %d' % (metric, name, histogram.count))
+
+            lines.append('# TYPE pythia_n_plus_one_queries gauge')
+            for ((name, sql), count) in sorted(self.n_plus_one.items()):
+                lines.append('pythia_n_plus_one_queries{stage="%s",statement="%s"} %d' % (
+                    name, sql.replace('\\', '\\\\').replace('"', '\\"'), count))
+
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+# queries run and stage open on each thread
+_local = threading.local()
+
+_enabled = False
+_patched = list()
+
+class Stage(object):
+    """Wall clock time and queries of one stage of a thread.
+
+    A stage opened while no other one is open on its thread is a root,
+    e.g. a request or a clear run by the matching service. Roots log one
+    structured line with the stages they went through and look for n+1
+    query patterns.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.parent = getattr(_local, 'stage', None)
+        self.root = self if self.parent is None else self.parent.root
+        if self.parent is None:
+            self.stages = dict()
+            self.statements = dict()
+        _local.stage = self
+
+        self.queries = getattr(_local, 'queries', 0)
+        self.start = time.time()
+
+        return self
+
+    def __exit__(self, type, value, traceback):
+        seconds = time.time() - self.start
+        queries = getattr(_local, 'queries', 0) - self.queries
+        _local.stage = self.parent
+
+        metrics.observe(self.name, seconds, queries)
+        if self.parent is not None:
+            stage = self.root.stages.setdefault(self.name, [0, 0., 0])
+            stage[0] += 1
+            stage[1] += seconds
+            stage[2] += queries
+            return
+
+        for (sql, count) in self.statements.items():
+            if count >= N_PLUS_ONE_THRESHOLD and metrics.flag_n_plus_one(self.name, sql, count):
+                logger.warning('n+1 queries: %s ran %d times under %s', sql, count, self.name)
+
+        logger.info(json.dumps(dict(
+            stage=self.name,
+            ms=round(seconds * 1000, 3),
+            queries=queries,
+            error=type.__name__ if type is not None else None,
+            stages=dict(
+                (name, dict(calls=calls, ms=round(stage_seconds * 1000, 3), queries=stage_queries))
+                for (name, (calls, stage_seconds, stage_queries)) in self.stages.items()),
+            ), sort_keys=True))
+
+class NullStage(object):
+    # what stage() gives while instrumentation is off
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+NULL_STAGE = NullStage()
+
+def stage(name):
+    if not _enabled:
+        return NULL_STAGE
+
+    return Stage(name)
+
+def start(name):
+    # for stages that do not fit in a with block, e.g. a request
+    if not _enabled:
+        return None
+
+    return Stage(name).__enter__()
+
+def stop(stage, exception=None):
+    if stage is not None:
+        stage.__exit__(type(exception) if exception is not None else None, exception, None)
+
+def timed(function):
+    """Run every call of a function in a stage named after it.
+
+    While instrumentation is off the only cost is the check of the flag.
+    """
+    name = '%s.%s' % (function.__module__, function.__name__)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+
+        with Stage(name):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+def count_query(sql):
+    _local.queries = getattr(_local, 'queries', 0) + 1
+
+    stage = getattr(_local, 'stage', None)
+    if stage is not None:
+        statements = stage.root.statements
+        statements[sql] = statements.get(sql, 0) + 1
+
+def patch(Database):
+    # every query of peewee goes through execute_sql of its database
+    execute_sql = Database.execute_sql
+
+    def counting_execute_sql(self, sql, *args, **kwargs):
+        count_query(sql)
+        return execute_sql(self, sql, *args, **kwargs)
+
+    _patched.append((Database, Database.__dict__.get('execute_sql')))
+    Database.execute_sql = counting_execute_sql
+
+def enable(database=None):
+    """Start timing stages and counting the queries of database (the
+    current one by default)."""
+    global _enabled
+
+    Database = type(database or get_database())
+    if not any(patched is Database for (patched, execute_sql) in _patched):
+        patch(Database)
+    _enabled = True
+
+def disable():
+    global _enabled
+
+    _enabled = False
+    while _patched:
+        (Database, execute_sql) = _patched.pop()
+        if execute_sql is not None:
+            Database.execute_sql = execute_sql
+        else:
+            del Database.execute_sql
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    global metrics
+
+    metrics = Metrics()
@@ -0,0 +1,381 @@
+#! /usr/bin/env python
+
+import argparse
+import os
+import struct
+import threading
+import time
+import zlib
+
+from peewee import fn
+
+from data_model import Order, Account
+from order_book import OrderBook, set_order_book
+
+# journal files start with a magic, then every record is its length and the
+# crc32 of its payload followed by the payload itself
+JOURNAL_MAGIC = b'PYJ2'
+SNAPSHOT_MAGIC = b'PYS2'
+
+HEADER = struct.Struct('<II')
+SNAPSHOT_HEADER = struct.Struct('<QQ')  # journal offset, last order id
+
+# every payload starts with the record type and the time it was written
+RECORD = struct.Struct('<Bd')
+
+ORDER_PLACED = 1
+ORDER_CANCELLED = 2
+ORDER_REDUCED = 3
+MARKET_CLEARED = 4
+MARKET_CLOSED = 5
+MARKET_RESOLVED = 6
+
+# records only found in snapshots
+SNAPSHOT_ORDER = 10
+SNAPSHOT_BALANCE = 11
+SNAPSHOT_POSITION = 12
+
+FORMATS = {
+    ORDER_PLACED: struct.Struct('<QQQBHq'),  # order, market, user, side, price, quantity
+    ORDER_CANCELLED: struct.Struct('<QQ'),  # order, market
+    ORDER_REDUCED: struct.Struct('<QQq'),  # order, market, quantity left
+    MARKET_CLEARED: struct.Struct('<QHqI'),  # market, price, quantity, fills
+    MARKET_CLOSED: struct.Struct('<Q'),  # market
+    MARKET_RESOLVED: struct.Struct('<QB'),  # market, outcome
+    SNAPSHOT_ORDER: struct.Struct('<QQQBHqq'),  # order, market, user, side, price, quantity, filled
+    SNAPSHOT_BALANCE: struct.Struct('<Qd'),  # user, balance
+    SNAPSHOT_POSITION: struct.Struct('<QQq'),  # market, user, quantity
+    }
+
+# fills follow their MARKET_CLEARED record: order, user, side, quantity
+FILL = struct.Struct('<QQBq')
+
+SIDES = ('buy', 'sell')
+
+# value of a stock when its market pays out, see resolution.py
+PAYOUT = 100
+
+def encode(type, values, fills=()):
+    payload = RECORD.pack(type, time.time()) + FORMATS[type].pack(*values)
+    payload += b''.join(FILL.pack(*fill) for fill in fills)
+
+    return HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff) + payload
+
+def decode(payload):
+    (type, date) = RECORD.unpack_from(payload)
+    values = FORMATS[type].unpack_from(payload, RECORD.size)
+
+    fills = list()
+    if type == MARKET_CLEARED:
+        offset = RECORD.size + FORMATS[type].size
+        for i in range(values[-1]):
+            fills.append(FILL.unpack_from(payload, offset + i * FILL.size))
+
+    return (type, date, values, fills)
+
+def read_records(path, offset=None, magic=JOURNAL_MAGIC):
+    """Yield (offset after the record, type, date, values, fills).
+
+    Reading stops at the first truncated or corrupted record, the tail a
+    crash may leave behind.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError('%s is not a journal' % path)
+        if offset is not None:
+            f.seek(offset)
+
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+
+            (length, crc) = HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) & 0xffffffff != crc:
+                return
+
+            (type, date, values, fills) = decode(payload)
+            yield (f.tell(), type, date, values, fills)
+
+class JournalState(object):
+    """What replaying a journal rebuilds: pending orders, balances and
+    positions, as they are after every record applied so far."""
+
+    def __init__(self):
+        self.orders = dict()
+        self.balances = dict()
+        self.positions = dict()
+        self.last_order_id = 0
+
+    def apply(self, type, values, fills=()):
+        if type == ORDER_PLACED or type == SNAPSHOT_ORDER:
+            (order_id, market_id, user_id, side, price, quantity) = values[:6]
+            filled = values[6] if type == SNAPSHOT_ORDER else 0
+            self.orders[order_id] = [market_id, user_id, side, price, quantity, filled]
+            self.last_order_id = max(self.last_order_id, order_id)
+        elif type == ORDER_CANCELLED:
+            self.orders.pop(values[0], None)
+        elif type == ORDER_REDUCED:
+            order = self.orders.get(values[0])
+            if order is not None:
+                order[4] = values[2]
+        elif type == MARKET_CLEARED:
+            (market_id, price, quantity, n_fills) = values
+            for (order_id, user_id, side, fill_quantity) in fills:
+                order = self.orders.get(order_id)
+                if order is not None:
+                    order[4] -= fill_quantity
+                    order[5] += fill_quantity
+                    if order[4] <= 0:
+                        del self.orders[order_id]
+
+                # sellers are paid and buyers pay the clearing price
+                sign = 1 if SIDES[side] == 'sell' else -1
+                self.balances[user_id] = self.balances.get(user_id, 0) + sign * price * fill_quantity
+                key = (market_id, user_id)
+                self.positions[key] = self.positions.get(key, 0) - sign * fill_quantity
+        elif type == MARKET_RESOLVED:
+            (market_id, outcome) = values
+            for key in [key for key in self.positions if key[0] == market_id]:
+                if outcome:
+                    self.balances[key[1]] = self.balances.get(key[1], 0) + self.positions[key] * PAYOUT
+                del self.positions[key]
+            for order_id in [order_id for (order_id, order) in self.orders.items() if order[0] == market_id]:
+                del self.orders[order_id]
+        elif type == SNAPSHOT_BALANCE:
+            self.balances[values[0]] = values[1]
+        elif type == SNAPSHOT_POSITION:
+            self.positions[(values[0], values[1])] = values[2]
+
+    def get_market_orders(self):
+        # pending orders of every market, in the order they were placed
+        markets = dict()
+        for order_id in sorted(self.orders):
+            markets.setdefault(self.orders[order_id][0], list()).append((order_id, self.orders[order_id]))
+
+        return markets
+
+def get_snapshot_path(path):
+    return path + '.snapshot'
+
+def write_snapshot(path, state, offset):
+    # written aside then renamed, a crash leaves the previous snapshot
+    records = [encode(SNAPSHOT_ORDER, [order_id] + order) for (order_id, order) in sorted(state.orders.items())]
+    records.extend(encode(SNAPSHOT_BALANCE, item) for item in sorted(state.balances.items()))
+    records.extend(encode(SNAPSHOT_POSITION, key + (quantity, )) for (key, quantity) in sorted(state.positions.items()))
+
+    snapshot_path = get_snapshot_path(path)
+    with open(snapshot_path + '.tmp', 'wb') as f:
+        f.write(SNAPSHOT_MAGIC + SNAPSHOT_HEADER.pack(offset, state.last_order_id))
+        f.write(b''.join(records))
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(snapshot_path + '.tmp', snapshot_path)
+
+def replay(path):
+    """Rebuild the state of a journal from its last snapshot and its tail.
+
+    Returns the state and the offset of the end of the last valid record.
+    """
+    state = JournalState()
+    offset = len(JOURNAL_MAGIC)
+
+    snapshot_path = get_snapshot_path(path)
+    if os.path.exists(snapshot_path):
+        with open(snapshot_path, 'rb') as f:
+            f.seek(len(SNAPSHOT_MAGIC))
+            (offset, state.last_order_id) = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+
+        start = len(SNAPSHOT_MAGIC) + SNAPSHOT_HEADER.size
+        for (end, type, date, values, fills) in read_records(snapshot_path, start, SNAPSHOT_MAGIC):
+            state.apply(type, values, fills)
+
+    if os.path.exists(path):
+        for (offset, type, date, values, fills) in read_records(path, offset):
+            state.apply(type, values, fills)
+
+    return (state, offset)
+
+class Journal(object):
+    """Append-only log of what market_maker did.
+
+    Records are appended once the database transaction they describe has
+    committed. The journal keeps the replayed state up to date as it
+    writes, and snapshots it every snapshot_interval records, so reopening
+    it only replays the records written since the last snapshot.
+    """
+
+    def __init__(self, path, snapshot_interval=10000, sync=False):
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self.sync = sync
+        self.lock = threading.Lock()
+
+        (self.state, offset) = replay(path)
+        self.records = 0
+
+        if os.path.exists(path) and os.path.getsize(path):
+            self.file = open(path, 'r+b')
+        else:
+            self.file = open(path, 'w+b')
+            self.file.write(JOURNAL_MAGIC)
+            offset = len(JOURNAL_MAGIC)
+
+        # a torn record at the end is dropped before appending
+        self.file.seek(offset)
+        self.file.truncate()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def append(self, type, values, fills=()):
+        record = encode(type, values, fills)
+        with self.lock:
+            self.file.write(record)
+            self.file.flush()
+            if self.sync:
+                os.fsync(self.file.fileno())
+
+            self.state.apply(type, values, fills)
+            self.records += 1
+            if self.snapshot_interval and self.records % self.snapshot_interval == 0:
+                write_snapshot(self.path, self.state, self.file.tell())
+
+    def snapshot(self):
+        with self.lock:
+            write_snapshot(self.path, self.state, self.file.tell())
+
+_journal = None
+
+def open_journal(path, snapshot_interval=10000, sync=False):
+    global _journal
+
+    close_journal()
+    _journal = Journal(path, snapshot_interval, sync)
+
+    return _journal
+
+def close_journal():
+    global _journal
+
+    if _journal is not None:
+        _journal.close()
+        _journal = None
+
+def get_journal():
+    return _journal
+
+# recording is a no-op while no journal is open
+
+def record_orders_placed(orders):
+    if _journal is not None:
+        for order in orders:
+            _journal.append(ORDER_PLACED, (
+                order.id, order.market_id, order.user_id or 0,
+                SIDES.index(order.type), order.price, order.quantity))
+
+def record_orders_cancelled(orders):
+    if _journal is not None:
+        for order in orders:
+            _journal.append(ORDER_CANCELLED, (order.id, order.market_id))
+
+def record_order_reduced(order, quantity):
+    if _journal is not None:
+        _journal.append(ORDER_REDUCED, (order.id, order.market_id, quantity))
+
+def record_market_cleared(market_id, price, quantity, fills):
+    # fills are (order id, user id, type, quantity) tuples
+    if _journal is not None:
+        _journal.append(MARKET_CLEARED, (market_id, price, quantity, len(fills)), [
+            (order_id, user_id or 0, SIDES.index(type), fill_quantity)
+            for (order_id, user_id, type, fill_quantity) in fills
+            ])
+
+def record_markets_closed(market_ids):
+    if _journal is not None:
+        for market_id in market_ids:
+            _journal.append(MARKET_CLOSED, (market_id, ))
+
+def record_market_resolved(market_id, outcome):
+    if _journal is not None:
+        _journal.append(MARKET_RESOLVED, (market_id, bool(outcome)))
+
+def get_pending_digests(markets):
+    # count, last id and quantity of the pending orders of every market
+    return dict(
+        (market_id, (len(orders), orders[-1][0], sum(order[4] for (order_id, order) in orders)))
+        for (market_id, orders) in markets.items())
+
+def restore_order_books():
+    """Load the books of every market from the journal instead of the
+    database.
+
+    A market is only restored when its pending orders in the database are
+    those of the journal. Orders cancelled while the journal was closed,
+    e.g. by resolution.py which runs in its own process, or placed before
+    it was opened would restore stale books, those markets are then
+    loaded from the database as usual.
+    """
+    if _journal is None:
+        return 0
+
+    with _journal.lock:
+        markets = _journal.state.get_market_orders()
+        digests = get_pending_digests(markets)
+
+        pending = Order.select(
+            Order.market, fn.Count(Order.id), fn.Max(Order.id), fn.Sum(Order.quantity)
+            ).where(Order.status == 'pending').group_by(Order.market).tuples()
+        restored = set(
+            market_id for (market_id, count, last_id, quantity) in pending
+            if digests.get(market_id) == (count, last_id, quantity))
+
+    for (market_id, orders) in markets.items():
+        if market_id not in restored:
+            continue
+
+        book = OrderBook(market_id, Order._meta.database)
+        for (order_id, (market_id, user_id, side, price, quantity, filled)) in orders:
+            book.add(Order(
+                id=order_id, market=market_id, user=user_id or None, type=SIDES[side],
+                status='pending', price=price, quantity=quantity, filled_quantity=filled))
+        set_order_book(book)
+
+    return len(restored)
+
+def verify(state):
+    # compare the replayed state with the database, returns the differences
+    differences = list()
+    pending = dict((order.id, order.quantity) for order in Order.select(Order.id, Order.quantity).where(Order.status == 'pending'))
+    replayed = dict((order_id, order[4]) for (order_id, order) in state.orders.items())
+    for order_id in sorted(set(pending) | set(replayed)):
+        if pending.get(order_id) != replayed.get(order_id):
+            differences.append('order %s: %s in the database, %s replayed' % (order_id, pending.get(order_id), replayed.get(order_id)))
+
+    for account in Account.select(Account.user, Account.balance):
+        if abs(account.balance - state.balances.get(account.user_id, 0)) > 1e-6:
+            differences.append('user %s: balance %s in the database, %s replayed' % (
+                account.user_id, account.balance, state.balances.get(account.user_id, 0)))
+
+    return differences
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='replay, snapshot or verify a market_maker journal')
+    parser.add_argument('command', choices=('replay', 'snapshot', 'verify'))
+    parser.add_argument('journal', help='journal file')
+    args = parser.parse_args()
+
+    (state, offset) = replay(args.journal)
+    if args.command == 'replay':
+        print('%d pending orders in %d markets, %d balances, %d positions, replayed up to byte %d' % (
+            len(state.orders), len(state.get_market_orders()), len(state.balances), len(state.positions), offset))
+    elif args.command == 'snapshot':
+        write_snapshot(args.journal, state, offset)
+        print('snapshot written at byte %d' % offset)
+    else:
+        differences = verify(state)
+        for difference in differences:
+            print(difference)
+        print('%d differences' % len(differences))
@@ -1,182 +1,447 @@
 #! /usr/bin/env python
 
 import datetime
-
-from data_model import Market, Stock, Order, MarketHistory
-import bank
+import numbers
+
+from data_model import get_database, atomic, chunked, insert_many_ids, Market, Order, MarketHistory
+from order_book import get_order_book, MAX_PRICE
+from settlement import Settlement
+from cache import Cache
+import history
+import events
+import journal
+import summary
+import portfolio
+import risk
+from instrumentation import timed
+
+# plain value snapshots of what the market pages show, invalidated whenever
+# what they were built from changes
+snapshots = Cache()
 
 def call(market, user, price, quantity):
-    order = Order.create(
-        market=market, 
-        user=user,
-        type='buy',
-        status='pending',
-        price=price,
-        quantity=quantity)
-    order.save()
-
-    return order
+    return place_order(market, user, 'buy', price, quantity)
 
 def put(market, user, price, quantity):
-    order = Order.create(
-        market=market, 
-        user=user,
-        type='sell',
-        status='pending',
-        price=price,
-        quantity=quantity)
-    order.save()
+    return place_order(market, user, 'sell', price, quantity)
+
+@timed
+def place_order(market, user, type, price, quantity):
+    validate_order(type, price, quantity)
+    book = get_order_book(market)
+    with risk.reserving([dict(market=market, user=user, type=type, price=price, quantity=quantity)]):
+        order = Order.create(
+            market=market, 
+            user=user,
+            type=type,
+            status='pending',
+            price=int(price),
+            quantity=quantity)
+    book.add(order)
+    journal.record_orders_placed([order])
+    invalidate_snapshots(order.market_id, 'book')
+    update_summary(order.market_id)
+    publish_book(order.market_id, [(order.type, order.price)])
 
     return order
 
+def validate_order(type, price, quantity):
+    if type not in ('buy', 'sell'):
+        raise ValueError('unknown order type %r' % (type,))
+    # prices are whole ticks, integral floats such as 42.0 are accepted
+    if isinstance(price, bool) or not isinstance(price, numbers.Real) or price != int(price) or not 0 <= price <= MAX_PRICE:
+        raise ValueError('invalid price %r' % (price,))
+    if isinstance(quantity, bool) or not isinstance(quantity, numbers.Integral) or quantity < 1:
+        raise ValueError('invalid quantity %r' % (quantity,))
+
+def validate_orders(orders):
+    # every order is checked and its market must be open before anything
+    # of a batch is written
+    orders = list(orders)
+    for order in orders:
+        validate_order(order['type'], order['price'], order['quantity'])
+
+    now = datetime.datetime.now()
+    market_ids = set(getattr(order['market'], 'id', order['market']) for order in orders)
+    open_ids = set()
+    for ids in chunked(market_ids, 500):
+        open_ids.update(market.id for market in Market.select(Market.id).where(
+            Market.id << ids,
+            Market.status == 'open',
+            Market.closing_date > now))
+
+    for market_id in market_ids - open_ids:
+        raise ValueError('market %s is not open' % market_id)
+
+    return orders
+
+def create_orders(orders):
+    # inserted in batches in the caller's transaction, not one query each
+    rows = [
+        dict(
+            market=getattr(order['market'], 'id', order['market']),
+            user=getattr(order['user'], 'id', order['user']),
+            type=order['type'],
+            status='pending',
+            price=int(order['price']),
+            quantity=order['quantity'],
+            filled_quantity=0)
+        for order in orders
+        ]
+
+    return [Order(id=id, **row) for (id, row) in zip(insert_many_ids(Order, rows), rows)]
+
+def cancel_pending_orders(query):
+    # orders are read and cancelled in the caller's transaction, only those
+    # still pending are returned
+    orders = list(query.where(Order.status == 'pending'))
+    for ids in chunked([order.id for order in orders], 500):
+        Order.update(status='cancelled').where(
+            Order.id << ids,
+            Order.status == 'pending').execute()
+
+    for order in orders:
+        order.status = 'cancelled'
+
+    return orders
+
+def update_order_books(created=(), cancelled=()):
+    # books and the journal only change once the orders are committed
+    journal.record_orders_cancelled(cancelled)
+    journal.record_orders_placed(created)
+
+    levels = dict()
+    for order in cancelled:
+        get_order_book(order.market_id).remove(order)
+        levels.setdefault(order.market_id, set()).add((order.type, order.price))
+
+    for order in created:
+        get_order_book(order.market_id).add(order)
+        levels.setdefault(order.market_id, set()).add((order.type, order.price))
+
+    for (market_id, market_levels) in levels.items():
+        invalidate_snapshots(market_id, 'book')
+        update_summary(market_id)
+        publish_book(market_id, market_levels)
+
+@timed
+def submit_orders(orders):
+    """Register many orders, possibly across markets, at once.
+
+    orders are dicts with market, user, type, price and quantity keys. They
+    are all inserted in one transaction: either every order is registered
+    or a ValueError is raised and none is.
+    """
+    orders = validate_orders(orders)
+    with risk.reserving(orders):
+        with atomic():
+            created = create_orders(orders)
+
+    update_order_books(created=created)
+
+    return created
+
+def cancel_orders(orders):
+    """Cancel orders given by id, returns those that were still pending."""
+    order_ids = [getattr(order, 'id', order) for order in orders]
+    with atomic():
+        cancelled = list()
+        for ids in chunked(order_ids, 500):
+            cancelled.extend(cancel_pending_orders(Order.select().where(Order.id << ids)))
+
+    risk.remove_orders(cancelled)
+    update_order_books(cancelled=cancelled)
+
+    return cancelled
+
+def cancel_order(order):
+    return bool(cancel_orders([order]))
+
+def cancel_user_orders(user, market=None):
+    # every pending order of a user, in one market or all of them
+    query = Order.select().where(Order.user == getattr(user, 'id', user))
+    if market is not None:
+        query = query.where(Order.market == getattr(market, 'id', market))
+
+    with atomic():
+        cancelled = cancel_pending_orders(query)
+
+    risk.remove_orders(cancelled)
+    update_order_books(cancelled=cancelled)
+
+    return cancelled
+
+def amend_order(order, price=None, quantity=None):
+    """Change the price or the quantity of a pending order.
+
+    Reducing the quantity at the same price is done in place and keeps the
+    queue position of the order. Any other change cancels it and registers
+    a new order, which queues behind those already at its price. Returns
+    the pending order, or None when the order was not pending anymore.
+    """
+    try:
+        order = Order.get(Order.id == getattr(order, 'id', order), Order.status == 'pending')
+    except Order.DoesNotExist:
+        return None
+
+    price = order.price if price is None else price
+    quantity = order.quantity if quantity is None else quantity
+    validate_order(order.type, price, quantity)
+
+    if price == order.price and quantity <= order.quantity:
+        if quantity == order.quantity:
+            return order
+
+        reduced = Order.update(quantity=quantity).where(
+            Order.id == order.id,
+            Order.status == 'pending').execute()
+        if not reduced:
+            return None
+
+        get_order_book(order.market_id).reduce(order, order.quantity - quantity)
+        risk.reduce_order(order, order.quantity - quantity)
+        journal.record_order_reduced(order, quantity)
+        invalidate_snapshots(order.market_id, 'book')
+        update_summary(order.market_id)
+        publish_book(order.market_id, [(order.type, order.price)])
+        order.quantity = quantity
+
+        return order
+
+    created = replace_orders([order], [dict(
+        market=order.market_id, user=order.user_id, type=order.type,
+        price=int(price), quantity=quantity)])
+
+    return created[0] if created else None
+
+def replace_orders(orders, new_orders):
+    """Cancel orders and register new ones in one transaction.
+
+    The new orders are only registered if every order to cancel was still
+    pending, otherwise None is returned and nothing changes.
+    """
+    new_orders = validate_orders(new_orders)
+    order_ids = [getattr(order, 'id', order) for order in orders]
+
+    with atomic() as transaction:
+        cancelled = list()
+        for ids in chunked(order_ids, 500):
+            cancelled.extend(cancel_pending_orders(Order.select().where(Order.id << ids)))
+
+        if len(cancelled) != len(set(order_ids)):
+            transaction.rollback()
+            return None
+
+        # the new orders are checked as if the cancelled ones were gone
+        with risk.reserving(new_orders, cancelled):
+            created = create_orders(new_orders)
+
+    update_order_books(created=created, cancelled=cancelled)
+
+    return created
+
+def replace_quotes(market, user, quotes):
+    """Swap every pending order of a user in a market for new quotes.
+
+    quotes are dicts with type, price and quantity keys. Market makers
+    refresh their quotes with one call, the old quotes are cancelled and
+    the new ones registered in one transaction.
+    """
+    new_orders = validate_orders([
+        dict(quote, market=market, user=user) for quote in quotes
+        ])
+
+    query = Order.select().where(
+        Order.market == getattr(market, 'id', market),
+        Order.user == getattr(user, 'id', user))
+
+    with atomic():
+        cancelled = cancel_pending_orders(query)
+        with risk.reserving(new_orders, cancelled):
+            created = create_orders(new_orders)
+
+    update_order_books(created=created, cancelled=cancelled)
+
+    return created
+
 def get_sell_orders(market):
-    sell_orders = Order.select().where(
-        Order.market == market, 
-        Order.type == 'sell',
-        Order.status == 'pending'
-        ).order_by(Order.price.asc())
+    sell_orders = get_order_book(market).get_sell_orders()
 
     return sell_orders
 
 def get_buy_orders(market):
-    buy_orders = Order.select().where(
-        Order.market == market, 
-        Order.type == 'buy',
-        Order.status == 'pending'
-        ).order_by(Order.price.desc())
+    buy_orders = get_order_book(market).get_buy_orders()
 
     return buy_orders
 
-def get_market_clearing_price(market, sell_orders=None, buy_orders=None):
-    if not sell_orders:
-        sell_orders = get_sell_orders(market)
-    if not buy_orders:
-        buy_orders = get_buy_orders(market)
+def get_price_levels(orders):
+    # aggregate consecutive orders at the same price into (price, quantity) levels
+    level_price = None
+    level_quantity = 0
+    for order in orders:
+        if order.quantity <= 0:
+            continue
+        if level_quantity and order.price == level_price:
+            level_quantity += order.quantity
+        else:
+            if level_quantity:
+                yield level_price, level_quantity
+            level_price = order.price
+            level_quantity = order.quantity
 
-    unit_sell_orders = list()
-    for order in sell_orders:
-        for i in range(order.quantity):
-            unit_sell_orders.append(order.price)
+    if level_quantity:
+        yield level_price, level_quantity
 
-    unit_buy_orders = list()
-    for order in buy_orders:
-        for i in range(order.quantity):
-            unit_buy_orders.append(order.price)
+@timed
+def get_market_clearing_price(market, sell_orders=None, buy_orders=None):
+    if sell_orders is None and buy_orders is None:
+        # levels are read from the ladders of the book, only the part of
+        # each side that crosses the other one can clear
+        book = get_order_book(market)
+        with book.lock:
+            if not book.is_crossed():
+                return None, None
+
+            sell_levels = iter(book.get_levels('sell', book.get_best_price('buy')))
+            buy_levels = iter(book.get_levels('buy', book.get_best_price('sell')))
+    else:
+        if sell_orders is None:
+            sell_orders = get_sell_orders(market)
+        if buy_orders is None:
+            buy_orders = get_buy_orders(market)
+
+        sell_levels = get_price_levels(sell_orders)
+        buy_levels = get_price_levels(buy_orders)
+
+    return get_clearing_price(sell_levels, buy_levels)
+
+def get_clearing_price(sell_levels, buy_levels):
+    # (price, quantity) levels of each side, best prices first
+    (sell_levels, buy_levels) = (iter(sell_levels), iter(buy_levels))
+
+    # the k-th share sold is matched with the k-th share bought as long as
+    # prices cross, walk both sides one price level at a time
+    (sell_price, sell_quantity) = next(sell_levels, (None, 0))
+    (buy_price, buy_quantity) = next(buy_levels, (None, 0))
 
     price = None;
     quantity = None;
     k = 0
-    K = min(len(unit_sell_orders), len(unit_buy_orders))
-    while (k < K and unit_sell_orders[k] <= unit_buy_orders[k]):
-        k+=1
+    while (sell_quantity and buy_quantity and sell_price <= buy_price):
+        last_sell_price = sell_price
+        last_buy_price = buy_price
+
+        step = min(sell_quantity, buy_quantity)
+        k += step
+        sell_quantity -= step
+        buy_quantity -= step
+
+        if not sell_quantity:
+            (sell_price, sell_quantity) = next(sell_levels, (None, 0))
+        if not buy_quantity:
+            (buy_price, buy_quantity) = next(buy_levels, (None, 0))
 
     if k > 0:
         quantity = k
-        last_buy_price = unit_buy_orders[k-1]
-        last_sell_price = unit_sell_orders[k-1]
-        price = (last_buy_price + last_sell_price)/2
+        # prices are ticks, a midpoint between two ticks is rounded down
+        price = (last_buy_price + last_sell_price) // 2
 
     return price, quantity
 
-def do_sell_stock(order, price, quantity):
+def do_sell_stock(order, price, quantity, settlement):
     # resolve monetary transaction
-    bank.execute_transaction(order.user, price * quantity)
+    settlement.transfer(order.user_id, price * quantity)
 
-    # attribute stocks
-    try:
-        stock = Stock.get(Stock.market == order.market, Stock.user == order.user)
-    except Stock.DoesNotExist:
-        stock = Stock.create(
-            market = order.market,
-            user = order.user,
-            quantity = 0
-            )
-
-    # selling short creates new stocks
-    if stock.quantity < quantity:
-        order.market.volume += quantity - stock.quantity
-
-    stock.quantity -= quantity
-    stock.save()
-
-def do_buy_stock(order, price, quantity):
+    # attribute stocks, selling short creates new stocks
+    settlement.move_stock(order.user_id, -quantity)
+
+def do_buy_stock(order, price, quantity, settlement):
     # resolve monetary transaction
-    bank.execute_transaction(order.user, -price * quantity)
+    settlement.transfer(order.user_id, -price * quantity)
 
     # attribute stocks
-    try:
-        stock = Stock.get(Stock.market == order.market, Stock.user == order.user)
-    except Stock.DoesNotExist:
-        stock = Stock.create(
-            market = order.market,
-            user = order.user,
-            quantity = 0
-            )
-
-    stock.quantity += quantity
-    stock.save()
-
-def do_clear_order(order, price, clearing_quantity):
-    if clearing_quantity < order.quantity:
-        new_order = Order.create(
-            market=order.market, 
-            user=order.user, 
-            price=order.price, 
-            quantity=order.quantity - clearing_quantity,
-            type=order.type,
-            status='pending')
-        new_order.save()
-
-    order.price = price
-    order.quantity = clearing_quantity
-    order.status = 'cleared'
-    order.save()   
-
-def do_clear_sell_orders(sell_orders, price, quantity):
+    settlement.move_stock(order.user_id, quantity)
+
+def do_clear_order(order, price, clearing_quantity, settlement):
+    settlement.clear_order(order, clearing_quantity)
+
+@timed
+def do_clear_sell_orders(sell_orders, price, quantity, settlement):
     sumq = 0
     for order in sell_orders:
         if order.price <= price and sumq < quantity:
             clearing_quantity = min(quantity - sumq, order.quantity)
-            do_sell_stock(order, price, clearing_quantity)
-            do_clear_order(order, price, clearing_quantity)
+            do_sell_stock(order, price, clearing_quantity, settlement)
+            do_clear_order(order, price, clearing_quantity, settlement)
             sumq += clearing_quantity
         else:
             break
 
-def do_clear_buy_orders(buy_orders, price, quantity):
+@timed
+def do_clear_buy_orders(buy_orders, price, quantity, settlement):
     sumq = 0
     for order in buy_orders:
         if order.price >= price and sumq < quantity:
             clearing_quantity = min(quantity - sumq, order.quantity)
-            do_buy_stock(order, price, clearing_quantity)
-            do_clear_order(order, price, clearing_quantity)
+            do_buy_stock(order, price, clearing_quantity, settlement)
+            do_clear_order(order, price, clearing_quantity, settlement)
             sumq += clearing_quantity
         else:
             break
 
+@timed
 def clear_market(market):
-    sell_orders = get_sell_orders(market)
-    buy_orders = get_buy_orders(market)
+    # nothing clears unless the best prices cross, then only the orders
+    # priced within the other side can
+    book = get_order_book(market)
+    with book.lock:
+        if not book.is_crossed():
+            return
+
+        sell_orders = book.get_orders('sell', book.get_best_price('buy'))
+        buy_orders = book.get_orders('buy', book.get_best_price('sell'))
 
     (price, quantity) = get_market_clearing_price(market, sell_orders, buy_orders)
-    if not price:
+    if price is None:
         return
 
     # always clear buy order first because of sell short stock creation
-    do_clear_buy_orders(buy_orders, price, quantity)
-    do_clear_sell_orders(sell_orders, price, quantity)
+    settlement = Settlement(market, price, quantity)
+    do_clear_buy_orders(buy_orders, price, quantity, settlement)
+    do_clear_sell_orders(sell_orders, price, quantity, settlement)
+
+    # levels are read before the book moves cleared orders to the clearing price
+    levels = set((order.type, order.price) for order in settlement.cleared_orders)
+    levels.update((order.type, order.price) for (order, clearing_quantity) in settlement.partial_orders)
+
+    # write orders, stocks, accounts, market and history in one transaction
+    settlement.execute()
+    journal.record_market_cleared(market.id, price, quantity, settlement.fills)
+    invalidate_snapshots(market.id, 'book', 'history', 'market', 'open_markets')
+
+    summary.update_book(market.id)
+    publish_book(market.id, levels)
+    events.publish(market.id, 'trade',
+        date=settlement.date.strftime('%Y-%m-%d %H:%M:%S.%f'),
+        price=price,
+        quantity=quantity)
 
-    # update market
-    market.price = price
-    market.save()
+def update_summary(market_id):
+    # the home page lists the top of every book
+    if summary.update_book(market_id):
+        invalidate_snapshots(market_id, 'open_markets')
 
-    # save market history
-    market_history = MarketHistory.create(
-        market=market,
-        price=price,
-        volume=quantity,
-        date=datetime.datetime.now()
-        )
+def publish_book(market_id, levels):
+    # watchers get the new quantity of every level that moved, 0 when the
+    # level is gone, instead of the whole book
+    if not events.has_subscribers(market_id):
+        return
+
+    book = get_order_book(market_id)
+    events.publish(market_id, 'book', levels=[
+        dict(side=type, price=price, quantity=book.get_level_quantity(type, price))
+        for (type, price) in sorted(levels)
+        ])
 
 def get_market_history(market):
     history = MarketHistory.select().where(MarketHistory.market == market).order_by(MarketHistory.date.desc())
@@ -185,11 +450,119 @@ def get_market_history(market):
 
 def close_market(market):
     now = datetime.datetime.now()
-    if market.closing_date < now:
+    if market.status == 'open' and market.closing_date < now:
         market.status = 'closed'
         market.save()
+        journal.record_markets_closed([market.id])
+        invalidate_snapshots(market.id, 'market', 'open_markets')
         return True
 
     return False
 
-
+def close_markets(market_ids):
+    # bulk version of close_market, markets not due yet are left open
+    now = datetime.datetime.now()
+    closed = 0
+    for ids in chunked(market_ids, 500):
+        # only the markets this call closes are journaled, those closed
+        # before were journaled then
+        with atomic():
+            due_ids = [market.id for market in Market.select(Market.id).where(
+                Market.id << ids,
+                Market.status == 'open',
+                Market.closing_date <= now)]
+            if due_ids:
+                Market.update(status='closed').where(Market.id << due_ids, Market.status == 'open').execute()
+
+        closed += len(due_ids)
+        journal.record_markets_closed(due_ids)
+        for market_id in due_ids:
+            invalidate_snapshots(market_id, 'market', 'open_markets')
+
+    return closed
+
+def get_snapshot(key, load):
+    snapshots.bind(get_database())
+
+    return snapshots.get(key, load)
+
+def invalidate_snapshots(market_id, *kinds):
+    snapshots.delete(*[
+        'open_markets' if kind == 'open_markets' else '%s:%s' % (kind, market_id)
+        for kind in kinds
+        ])
+
+def get_order_values(order):
+    # fields of an order, plain values that can be copied or sent away
+    return dict(
+        id=order.id,
+        market=order.market_id,
+        user=order.user_id,
+        type=order.type,
+        status=order.status,
+        price=order.price,
+        quantity=order.quantity,
+        filled_quantity=order.filled_quantity)
+
+def copy_order(order):
+    # orders of a book are changed in place as they fill, callers get copies
+    return Order(**get_order_values(order))
+
+def get_order_snapshot(order):
+    return dict(
+        id=order.id,
+        type=order.type,
+        price=order.price,
+        quantity=order.quantity,
+        filled_quantity=order.filled_quantity)
+
+def get_order_status(order_id):
+    # status, fills and what is left of an order, as it was committed
+    return get_order_values(Order.get(Order.id == order_id))
+
+def get_market_snapshot(market_id):
+    def load():
+        market = Market.get(Market.id == market_id)
+        return dict(
+            id=market.id,
+            name=market.name,
+            description=market.description,
+            status=market.status,
+            opening_date=market.opening_date,
+            closing_date=market.closing_date,
+            price=market.price,
+            volume=market.volume)
+
+    return get_snapshot('market:%s' % market_id, load)
+
+def get_order_book_snapshot(market_id):
+    def load():
+        book = get_order_book(market_id)
+        with book.lock:
+            return dict(
+                sell_orders=[get_order_snapshot(order) for order in book.get_sell_orders()],
+                buy_orders=[get_order_snapshot(order) for order in book.get_buy_orders()],
+                sell_levels=book.get_levels('sell'),
+                buy_levels=book.get_levels('buy'))
+
+    return get_snapshot('book:%s' % market_id, load)
+
+def get_market_history_snapshot(market_id):
+    def load():
+        market = get_market_snapshot(market_id)
+        candles = history.get_chart(market_id, market['opening_date'], market['closing_date'])
+        return [
+            dict(date=candle.date.strftime('%Y-%m-%d %H:%M:%S'), price=candle.close, volume=candle.volume)
+            for candle in candles
+            ]
+
+    return get_snapshot('history:%s' % market_id, load)
+
+def get_open_markets_snapshot():
+    # one query for the markets and the top of their books
+    return get_snapshot('open_markets', summary.get_open_market_summaries)
+
+def get_leaderboard_snapshot(limit):
+    # trades do not invalidate it, it is at most as old as the time to live
+    # of the snapshots
+    return get_snapshot('leaderboard:%d' % limit, lambda: portfolio.get_leaderboard(limit))
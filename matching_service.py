@@ -0,0 +1,277 @@
+#! /usr/bin/env python
+
+import time
+import contextlib
+import heapq
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from data_model import chunked, Market, Order
+import market_maker
+
+logger = logging.getLogger(__name__)
+
+class MatchingService(object):
+    """Clears markets on a background thread.
+
+    Orders are persisted and added to their book when submitted, then the
+    market is queued for clearing and the caller gets the order back right
+    away. The worker drains the queue in micro-batches and clears every
+    market of a batch once, however many orders it received.
+
+    Markets in 'batch' clearing mode are not queued on every order: their
+    orders accumulate and a single call auction is run once batch_interval
+    milliseconds have passed since the first of them, or as soon as
+    batch_size orders are waiting.
+    """
+
+    def __init__(self, batch_size=100):
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.queued = set()
+        self.queued_lock = threading.Lock()
+        self.market_locks = dict()
+        self.market_locks_lock = threading.Lock()
+        self.auctions = dict()
+        self.deadlines = list()
+        self.auctions_lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='matching-service')
+            self.thread.daemon = True
+            self.thread.start()
+
+        return self
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def get_market_lock(self, market_id):
+        with self.market_locks_lock:
+            lock = self.market_locks.get(market_id)
+            if lock is None:
+                lock = self.market_locks[market_id] = threading.Lock()
+
+        return lock
+
+    def submit(self, market, user, price, quantity, type):
+        market_id = getattr(market, 'id', market)
+        place_order = market_maker.call if type == 'buy' else market_maker.put
+
+        # the worker may clear the order as soon as the lock is released
+        with self.get_market_lock(market_id):
+            order = market_maker.copy_order(place_order(market, user, price, quantity))
+
+        if not isinstance(market, Market):
+            market = Market.get(Market.id == market_id)
+        self.schedule(market)
+
+        return order
+
+    def submit_orders(self, orders):
+        # orders of every market are registered in one transaction, then
+        # each market is scheduled for a single clear
+        orders = list(orders)
+        market_ids = set(getattr(order['market'], 'id', order['market']) for order in orders)
+
+        with self.lock_markets(market_ids):
+            created = [market_maker.copy_order(order) for order in market_maker.submit_orders(orders)]
+
+        self.schedule_orders(created)
+
+        return created
+
+    def cancel_orders(self, orders):
+        order_ids = [getattr(order, 'id', order) for order in orders]
+        market_ids = set()
+        for ids in chunked(order_ids, 500):
+            market_ids.update(order.market_id for order in Order.select(Order.market).where(Order.id << ids))
+
+        # cancelling is serialized with clears, cancelled orders never clear
+        with self.lock_markets(market_ids):
+            return market_maker.cancel_orders(order_ids)
+
+    def cancel_user_orders(self, user, market=None):
+        if market is not None:
+            market_ids = [getattr(market, 'id', market)]
+        else:
+            market_ids = [order.market_id for order in Order.select(Order.market).where(
+                Order.user == getattr(user, 'id', user),
+                Order.status == 'pending').distinct()]
+
+        with self.lock_markets(market_ids):
+            return market_maker.cancel_user_orders(user, market)
+
+    def amend_order(self, order, price=None, quantity=None):
+        order_id = getattr(order, 'id', order)
+        try:
+            market_id = Order.get(Order.id == order_id).market_id
+        except Order.DoesNotExist:
+            return None
+
+        with self.lock_markets([market_id]):
+            amended = market_maker.amend_order(order_id, price, quantity)
+            if amended is not None:
+                amended = market_maker.copy_order(amended)
+
+        # an order registered again may cross the book
+        if amended is not None and amended.id != order_id:
+            self.schedule_orders([amended])
+
+        return amended
+
+    def replace_quotes(self, market, user, quotes):
+        with self.lock_markets([getattr(market, 'id', market)]):
+            created = [market_maker.copy_order(order) for order in market_maker.replace_quotes(market, user, quotes)]
+
+        self.schedule_orders(created)
+
+        return created
+
+    @contextlib.contextmanager
+    def lock_markets(self, market_ids):
+        # locks are always taken in the same order, batches cannot deadlock
+        locks = [self.get_market_lock(market_id) for market_id in sorted(set(market_ids))]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def schedule_orders(self, orders):
+        # each market is scheduled once for all of its new orders
+        counts = dict()
+        for order in orders:
+            counts[order.market_id] = counts.get(order.market_id, 0) + 1
+
+        for ids in chunked(counts, 500):
+            for market in Market.select().where(Market.id << ids):
+                self.schedule(market, counts[market.id])
+
+    def schedule(self, market, count=1):
+        if market.clearing_mode != 'batch' or not (market.batch_interval or market.batch_size):
+            self.enqueue(market.id)
+            return
+
+        wake = False
+        with self.auctions_lock:
+            auction = self.auctions.get(market.id)
+            if auction is None:
+                deadline = None
+                if market.batch_interval:
+                    deadline = time.time() + market.batch_interval / 1000.
+                    heapq.heappush(self.deadlines, (deadline, market.id))
+                    wake = self.deadlines[0][0] == deadline
+                auction = self.auctions[market.id] = [deadline, 0]
+
+            auction[1] += count
+            due = market.batch_size and auction[1] >= market.batch_size
+            if due:
+                del self.auctions[market.id]
+
+        if due:
+            self.enqueue(market.id)
+        elif wake:
+            # the worker may be waiting for a later auction
+            self.queue.put(False)
+
+    def enqueue(self, market_id):
+        # a market waiting to be cleared is queued only once
+        with self.queued_lock:
+            if market_id in self.queued:
+                return
+            self.queued.add(market_id)
+
+        self.queue.put(market_id)
+
+    def pop_auctions(self, force=False):
+        now = time.time()
+        market_ids = list()
+
+        with self.auctions_lock:
+            if force:
+                market_ids = list(self.auctions)
+                self.auctions.clear()
+                self.deadlines = list()
+
+            while self.deadlines and self.deadlines[0][0] <= now:
+                (deadline, market_id) = heapq.heappop(self.deadlines)
+                # auctions already run because of their size leave stale deadlines
+                auction = self.auctions.get(market_id)
+                if auction is not None and auction[0] == deadline:
+                    del self.auctions[market_id]
+                    market_ids.append(market_id)
+
+        return market_ids
+
+    def get_timeout(self):
+        with self.auctions_lock:
+            if not self.deadlines:
+                return None
+
+            return max(self.deadlines[0][0] - time.time(), 0)
+
+    def get_order_status(self, order_id):
+        return market_maker.get_order_status(order_id)
+
+    def get_order_book_snapshot(self, market_id):
+        # books live in the process matching their market
+        return market_maker.get_order_book_snapshot(market_id)
+
+    def flush(self):
+        # run the pending auctions now and wait until every queued market
+        # has been cleared
+        for market_id in self.pop_auctions(force=True):
+            self.enqueue(market_id)
+        self.queue.join()
+
+    def get_batch(self):
+        try:
+            batch = [self.queue.get(timeout=self.get_timeout())]
+        except queue.Empty:
+            return list()
+
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def run(self):
+        stopped = False
+        while not stopped:
+            batch = self.get_batch()
+            try:
+                for market_id in batch + self.pop_auctions():
+                    if market_id is None:
+                        stopped = True
+                    elif market_id is not False:
+                        self.clear(market_id)
+            finally:
+                for market_id in batch:
+                    self.queue.task_done()
+
+    def clear(self, market_id):
+        with self.queued_lock:
+            self.queued.discard(market_id)
+
+        try:
+            with self.get_market_lock(market_id):
+                market = Market.get(Market.id == market_id)
+                market_maker.clear_market(market)
+        except Exception:
+            logger.exception('failed to clear market %s', market_id)
@@ -0,0 +1,160 @@
+#! /usr/bin/env python
+
+import datetime
+
+import peewee
+from playhouse.migrate import SchemaMigrator, migrate as migrate_schema
+
+from data_model import get_database, create_tables, create_indexes, MODELS, SchemaMigration
+from data_model import Market, MarketHistory, MarketCandle, Order, Transaction
+from order_book import MAX_PRICE
+import history
+import summary
+
+def add_columns(database, Model, *names):
+    # returns the names of the columns added, those the table already has
+    # (e.g. created by create_tables) are left alone
+    migrator = SchemaMigrator.from_database(database)
+    table = Model._meta.db_table
+    existing = set(column.name for column in database.get_columns(table))
+
+    fields = [Model._meta.fields[name] for name in names if Model._meta.fields[name].db_column not in existing]
+    migrate_schema(*[migrator.add_column(table, field.db_column, field) for field in fields])
+
+    return [field.name for field in fields]
+
+def add_model_indexes(database):
+    # indexes declared by the models that the database does not have yet
+    for Model in MODELS:
+        table = Model._meta.db_table
+        existing = set(tuple(index.columns) for index in database.get_indexes(table))
+
+        for (field_names, unique) in Model._meta.indexes or ():
+            fields = [Model._meta.fields[name] for name in field_names]
+            if tuple(field.db_column for field in fields) not in existing:
+                database.create_index(Model, fields, unique)
+
+def add_hot_path_indexes(database):
+    add_model_indexes(database)
+    create_indexes()
+
+# prices are rounded to a tick, the small offset absorbs float drift such
+# as 29.999999 left by averaging prices
+FLOOR = 'CAST({0} + 0.000001 AS INTEGER)'
+CEIL = 'CASE WHEN {0} - 0.000001 > CAST({0} - 0.000001 AS INTEGER) THEN CAST({0} - 0.000001 AS INTEGER) + 1 ELSE CAST({0} - 0.000001 AS INTEGER) END'
+
+def convert_to_integer_columns(database, Model, *names, **options):
+    """Rebuild float columns as integer ones.
+
+    Columns are rebuilt since sqlite cannot change the type of a column,
+    those already integers are left alone. Values are rounded down unless
+    options give another rounding, a format of the quoted column, and
+    clamped between the options minimum and maximum when they are given.
+    """
+    migrator = SchemaMigrator.from_database(database)
+    table = Model._meta.db_table
+    types = dict((column.name, column.data_type.lower()) for column in database.get_columns(table))
+
+    for name in names:
+        column = Model._meta.fields[name].db_column
+        if 'int' in types[column]:
+            continue
+
+        quoted = '"%s"' % column
+        value = options.get('rounding', FLOOR).format(quoted)
+        if 'minimum' in options:
+            value = 'CASE WHEN %s < %d THEN %d ELSE %s END' % (quoted, options['minimum'], options['minimum'], value)
+        if 'maximum' in options:
+            value = 'CASE WHEN %s > %d THEN %d ELSE %s END' % (quoted, options['maximum'], options['maximum'], value)
+
+        converted = column + '_integer'
+        migrate_schema(migrator.add_column(table, converted, peewee.IntegerField(default=0)))
+        database.execute_sql('UPDATE "%s" SET "%s" = %s' % (table, converted, value))
+        migrate_schema(
+            migrator.drop_column(table, column),
+            migrator.rename_column(table, converted, column))
+
+def add_market_clearing_mode(database):
+    add_columns(database, Market, 'clearing_mode', 'batch_interval', 'batch_size')
+
+def add_market_resolution(database):
+    add_columns(database, Market, 'resolution_date', 'outcome')
+
+    # markets are resolved one hour after they close, only the columns known
+    # at this step are selected since later steps may add more
+    markets = Market.select(Market.id, Market.closing_date).where(Market.resolution_date >> None)
+    for market in markets:
+        Market.update(
+            resolution_date=market.closing_date + datetime.timedelta(hours=1)
+            ).where(Market.id == market.id).execute()
+
+def add_market_candles(database):
+    for market in Market.select(Market.id):
+        history.rebuild_candles(market.id)
+
+def add_order_filled_quantity(database):
+    added = add_columns(database, Order, 'filled_quantity')
+    add_model_indexes(database)
+
+    # cleared orders used to keep their cleared quantity, the quantity is
+    # now what is left to clear. tables created with the column already
+    # track fills in place
+    if added:
+        Order.update(
+            filled_quantity=Order.quantity,
+            quantity=0
+            ).where(Order.status == 'cleared').execute()
+
+def add_transaction_rollup(database):
+    add_columns(database, Transaction, 'rollup')
+
+def convert_integer_prices(database):
+    # prices used to only be positive, pending orders off the ladder cannot
+    # be booked anymore and are cancelled
+    if 'int' not in dict((column.name, column.data_type.lower()) for column in database.get_columns('order'))['price']:
+        database.execute_sql(
+            'UPDATE "order" SET "status" = \'cancelled\''
+            ' WHERE "status" = \'pending\' AND ("price" < 0 OR "price" > %d)' % MAX_PRICE)
+
+    # buyers never pay more, sellers never get less than their limit
+    ticks = dict(minimum=0, maximum=MAX_PRICE)
+    convert_to_integer_columns(database, Order, 'price',
+        rounding='CASE WHEN "type" = \'sell\' THEN %s ELSE %s END' % (CEIL, FLOOR), **ticks)
+    convert_to_integer_columns(database, Market, 'price', **ticks)
+    convert_to_integer_columns(database, MarketHistory, 'price', **ticks)
+    convert_to_integer_columns(database, MarketCandle, 'open', 'high', 'low', 'close', **ticks)
+
+    # indexes over the rebuilt price columns
+    add_hot_path_indexes(database)
+
+def add_market_summaries(database):
+    summary.rebuild()
+
+# applied in order, each one at most once per database
+MIGRATIONS = (
+    ('0001_hot_path_indexes', add_hot_path_indexes),
+    ('0002_market_clearing_mode', add_market_clearing_mode),
+    ('0003_market_resolution', add_market_resolution),
+    ('0004_market_candles', add_market_candles),
+    ('0005_order_filled_quantity', add_order_filled_quantity),
+    ('0006_transaction_rollup', add_transaction_rollup),
+    ('0007_integer_prices', convert_integer_prices),
+    ('0008_market_summaries', add_market_summaries),
+    )
+
+def migrate():
+    # tables added since the database was created come with all their columns
+    database = get_database()
+    create_tables()
+
+    applied = set(migration.name for migration in SchemaMigration.select())
+    for (name, migration) in MIGRATIONS:
+        if name in applied:
+            continue
+
+        with database.atomic():
+            migration(database)
+            SchemaMigration.create(name=name, date=datetime.datetime.now())
+
+if __name__ == '__main__':
+    migrate()
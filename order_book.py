@@ -0,0 +1,182 @@
+#! /usr/bin/env python
+
+import threading
+import collections
+import peewee
+
+from data_model import Order
+
+# prices are integer ticks, a stock pays 100 or nothing so no order is
+# ever worth more than MAX_PRICE
+MAX_PRICE = 100
+
+class OrderBook(object):
+    """Pending orders of a market kept in memory.
+
+    Prices are bounded integers, so each side is a ladder: a list indexed
+    by price holding the aggregate quantity of every level, next to a list
+    holding the FIFO queue of orders of every level. Best prices are kept
+    as orders come and go, level quantities and best prices are read in
+    constant time, walking the book costs at most one step per tick.
+    """
+
+    def __init__(self, market_id, database=None):
+        self.market_id = market_id
+        self.database = database
+        self.quantities = {'sell': [0] * (MAX_PRICE + 1), 'buy': [0] * (MAX_PRICE + 1)}
+        self.queues = {'sell': [None] * (MAX_PRICE + 1), 'buy': [None] * (MAX_PRICE + 1)}
+        self.best_prices = {'sell': None, 'buy': None}
+        self.lock = threading.RLock()
+
+    @classmethod
+    def load(cls, market_id):
+        book = cls(market_id, Order._meta.database)
+
+        # the status is inlined, sqlite only uses the partial index of
+        # pending orders when the query repeats its condition literally
+        orders = Order.select().where(
+            Order.market == market_id,
+            Order.status == peewee.SQL("'pending'")
+            ).order_by(Order.id.asc())
+
+        for order in orders:
+            book.add(order)
+
+        return book
+
+    def get_prices(self, type, limit_price=None):
+        # occupied prices from the best one on, up to limit_price included
+        best_price = self.best_prices[type]
+        if best_price is None:
+            return []
+
+        queues = self.queues[type]
+        if type == 'buy':
+            prices = range(best_price, -1 if limit_price is None else limit_price - 1, -1)
+        else:
+            prices = range(best_price, MAX_PRICE + 1 if limit_price is None else limit_price + 1)
+
+        return [price for price in prices if queues[price]]
+
+    def add(self, order):
+        # a price off the ladder would index the wrong level, or none
+        if not 0 <= order.price <= MAX_PRICE:
+            raise ValueError('order %s is priced %r, off the 0-%d ladder' % (order.id, order.price, MAX_PRICE))
+
+        with self.lock:
+            queues = self.queues[order.type]
+
+            queue = queues[order.price]
+            if queue is None:
+                queue = queues[order.price] = collections.OrderedDict()
+
+            queue[order.id] = order
+            self.quantities[order.type][order.price] += order.quantity
+
+            best_price = self.best_prices[order.type]
+            if best_price is None or (order.price > best_price if order.type == 'buy' else order.price < best_price):
+                self.best_prices[order.type] = order.price
+
+    def remove(self, order):
+        with self.lock:
+            queues = self.queues[order.type]
+
+            queue = queues[order.price]
+            book_order = queue.pop(order.id, None) if queue is not None else None
+            if book_order is None:
+                return False
+
+            self.quantities[order.type][order.price] -= max(book_order.quantity, 0)
+            if not queue:
+                queues[order.price] = None
+                if order.price == self.best_prices[order.type]:
+                    # the next best price is the first occupied one behind it
+                    prices = self.get_prices(order.type)
+                    self.best_prices[order.type] = prices[0] if prices else None
+
+            return True
+
+    def reduce(self, order, quantity, filled=False):
+        # take quantity off an order in place, it keeps its queue position
+        # until nothing is left of it
+        with self.lock:
+            queue = self.queues[order.type][order.price]
+            book_order = queue.get(order.id) if queue is not None else None
+            if book_order is None:
+                return False
+
+            quantity = min(quantity, book_order.quantity)
+            book_order.quantity -= quantity
+            self.quantities[order.type][order.price] -= quantity
+            if filled:
+                book_order.filled_quantity += quantity
+            if book_order.quantity <= 0:
+                self.remove(book_order)
+
+            return True
+
+    def get_orders(self, type, limit_price=None):
+        # best prices first, then time priority
+        with self.lock:
+            queues = self.queues[type]
+            orders = list()
+            for price in self.get_prices(type, limit_price):
+                orders.extend(queues[price].values())
+
+            return orders
+
+    def get_sell_orders(self):
+        return self.get_orders('sell')
+
+    def get_buy_orders(self):
+        return self.get_orders('buy')
+
+    def get_levels(self, type, limit_price=None):
+        # (price, quantity) levels, best prices first
+        with self.lock:
+            quantities = self.quantities[type]
+            return [(price, quantities[price]) for price in self.get_prices(type, limit_price)]
+
+    def get_level_quantity(self, type, price):
+        with self.lock:
+            return self.quantities[type][price]
+
+    def get_best_price(self, type):
+        with self.lock:
+            return self.best_prices[type]
+
+    def is_crossed(self):
+        # some buy order is at or above some sell order
+        with self.lock:
+            (sell_price, buy_price) = (self.best_prices['sell'], self.best_prices['buy'])
+            return sell_price is not None and buy_price is not None and sell_price <= buy_price
+
+_order_books = dict()
+_order_books_lock = threading.Lock()
+
+def get_order_book(market):
+    market_id = getattr(market, 'id', market)
+
+    with _order_books_lock:
+        book = _order_books.get(market_id)
+
+        # books loaded from another database (e.g. after set_database) are stale
+        if book is None or book.database is not Order._meta.database:
+            book = _order_books[market_id] = OrderBook.load(market_id)
+
+    return book
+
+def set_order_book(book):
+    # e.g. a book rebuilt from the journal instead of loaded from the database
+    with _order_books_lock:
+        _order_books[book.market_id] = book
+
+def drop_order_book(market):
+    market_id = getattr(market, 'id', market)
+
+    with _order_books_lock:
+        _order_books.pop(market_id, None)
+
+def reset_order_books():
+    with _order_books_lock:
+        _order_books.clear()
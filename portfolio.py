@@ -0,0 +1,115 @@
+#! /usr/bin/env python
+
+import itertools
+
+import numpy
+
+from data_model import get_database, Market, Stock, Order, Account
+
+# accounts open with a balance of 0 (see bank.create_account), so the
+# cash plus the positions marked at their market price is the profit and
+# loss of a user since joining
+
+def load_columns(query, n):
+    # rows of query as n float columns, read from the cursor without
+    # building a python object per row through the ORM
+    rows = get_database().execute_sql(*query.sql()).fetchall()
+    array = numpy.fromiter(itertools.chain.from_iterable(rows), numpy.float64, len(rows) * n).reshape(-1, n)
+
+    return [array[:, i] for i in range(n)]
+
+def get_cash(user_id):
+    balance = Account.select(Account.balance).where(Account.user == user_id).scalar()
+
+    return balance or 0.
+
+def get_positions(user_id):
+    # one query for every position of the user and the price of its market
+    stocks = list(Stock.select(Stock.quantity, Market.id, Market.name, Market.status, Market.price).join(Market).where(
+        Stock.user == user_id,
+        Stock.quantity != 0
+        ).order_by(Market.id).tuples())
+
+    quantities = numpy.array([stock[0] for stock in stocks], dtype=numpy.float64)
+    prices = numpy.array([stock[4] for stock in stocks], dtype=numpy.float64)
+    values = quantities * prices
+
+    positions = [
+        dict(market=market_id, name=name, status=status, quantity=quantity, price=price, value=value)
+        for ((quantity, market_id, name, status, price), value) in zip(stocks, values.tolist())
+        ]
+
+    return (positions, float(values.sum()))
+
+def get_open_orders(user_id):
+    orders = Order.select(Order, Market.name).join(Market).where(
+        Order.user == user_id,
+        Order.status == 'pending'
+        ).order_by(Order.id.desc()).naive()
+
+    return [
+        dict(id=order.id, market=order.market_id, name=order.name, type=order.type,
+            price=order.price, quantity=order.quantity, filled_quantity=order.filled_quantity)
+        for order in orders
+        ]
+
+def get_portfolio(user):
+    user_id = getattr(user, 'id', user)
+    cash = get_cash(user_id)
+    (positions, value) = get_positions(user_id)
+
+    return dict(
+        cash=cash,
+        value=value,
+        pnl=cash + value,
+        positions=positions,
+        orders=get_open_orders(user_id))
+
+def get_equities():
+    """Cash and marked positions of every user, by user id.
+
+    Stocks and accounts are each loaded in one query as arrays and summed
+    per user with bincount, rather than walking rows through the ORM.
+    Returns the ids of users with an account or a position, then their
+    cash and the value of their positions indexed by user id.
+    """
+    (stock_user_ids, quantities, prices) = load_columns(
+        Stock.select(Stock.user, Stock.quantity, Market.price).join(Market).where(
+            Stock.user.is_null(False),
+            Stock.quantity != 0),
+        3)
+    (account_user_ids, balances) = load_columns(
+        Account.select(Account.user, Account.balance).where(Account.user.is_null(False)), 2)
+
+    stock_user_ids = stock_user_ids.astype(numpy.int64)
+    account_user_ids = account_user_ids.astype(numpy.int64)
+    size = int(max(stock_user_ids.max() if len(stock_user_ids) else 0,
+        account_user_ids.max() if len(account_user_ids) else 0)) + 1
+
+    values = numpy.bincount(stock_user_ids, weights=quantities * prices, minlength=size)
+    cash = numpy.bincount(account_user_ids, weights=balances, minlength=size)
+    present = numpy.zeros(size, dtype=bool)
+    present[stock_user_ids] = True
+    present[account_user_ids] = True
+    user_ids = numpy.flatnonzero(present)
+
+    return (user_ids, cash, values)
+
+def get_leaderboard(limit=100):
+    (user_ids, cash, values) = get_equities()
+    pnl = (cash + values)[user_ids]
+
+    # only the top limit users are sorted, by pnl then user id
+    if len(user_ids) > limit:
+        top = numpy.argpartition(-pnl, limit - 1)[:limit]
+    else:
+        top = numpy.arange(len(user_ids))
+    top = top[numpy.lexsort((user_ids[top], -pnl[top]))]
+    top_ids = user_ids[top].tolist()
+
+    # emails are not shown to other users, leaders are named by their id
+    return [
+        dict(rank=rank + 1, user=user_id,
+            cash=float(cash[user_id]), value=float(values[user_id]), pnl=float(cash[user_id] + values[user_id]))
+        for (rank, user_id) in enumerate(top_ids)
+        ]
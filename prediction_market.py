@@ -1,7 +1,7 @@
 #! /usr/bin/env/python
 
 # base flask
-from flask import Flask, render_template, redirect, flash, url_for, redirect
+from flask import Flask, Response, render_template, redirect, flash, url_for, redirect, jsonify, abort, request, g
 
 # security
 from flask.ext import login
@@ -10,15 +10,27 @@ from flask.ext.login import current_user, current_app
 
 # forms
 from flask_wtf import Form
-from wtforms import BooleanField, TextField, IntegerField, FloatField, validators
+from wtforms import BooleanField, TextField, IntegerField, validators
 
 # pythia
-from data_model import db, User, Role, UserRoles, Market, Order
+from data_model import db, connect_database, close_database, User, Role, UserRoles, Market, Order
 from admin import build_admin
+from api import build_api
+from matching_service import MatchingService
+from order_book import MAX_PRICE
+import journal
+import risk
+import instrumentation
+from sharding import ShardRouter
+from scheduler import MarketScheduler
 import market_maker
 import gsp_markets
+import history
+import portfolio
 
 import datetime
+import hmac
+import os
 
 app = Flask(__name__)
 
@@ -33,14 +45,91 @@ security = Security(app, user_datastore)
 # admin
 build_admin(app)
 
+# matching and market closing, set RUN_SCHEDULER to False when markets
+# are closed by a standalone scheduler.py
+app.config.setdefault('RUN_SCHEDULER', True)
+
+# markets are matched in this process, or hashed over as many matching
+# processes as PYTHIA_MATCHING_SHARDS says
+app.config.setdefault('MATCHING_SHARDS', int(os.environ.get('PYTHIA_MATCHING_SHARDS', 0)))
+
+# what matching does is journaled to PYTHIA_JOURNAL when it is set, one
+# journal per shard when matching is sharded
+app.config.setdefault('JOURNAL', os.environ.get('PYTHIA_JOURNAL'))
+
+# pre-trade risk limits, each one off unless set: most stocks a user may be
+# short in a market (PYTHIA_MAX_SHORT), most price x quantity of their open
+# orders (PYTHIA_MAX_NOTIONAL) and lowest balance once their orders fill
+# and their shorts pay out (PYTHIA_MIN_BALANCE)
+def get_limit(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+app.config.setdefault('RISK_LIMITS', dict(
+    max_short=get_limit('PYTHIA_MAX_SHORT'),
+    max_notional=get_limit('PYTHIA_MAX_NOTIONAL'),
+    min_balance=get_limit('PYTHIA_MIN_BALANCE')))
+risk.configure(**app.config['RISK_LIMITS'])
+
+if app.config['MATCHING_SHARDS']:
+    matching_service = ShardRouter(
+        app.config['MATCHING_SHARDS'], journal_path=app.config['JOURNAL'], risk_limits=app.config['RISK_LIMITS'])
+else:
+    matching_service = MatchingService()
+market_scheduler = MarketScheduler()
+
+# json api and event streams
+build_api(app, matching_service)
+
+# stage timings and query counts, logged when PYTHIA_INSTRUMENTATION is
+# set, and served at /metrics to scrapers sending the bearer token
+# PYTHIA_METRICS_TOKEN, the endpoint is off without one
+app.config.setdefault('INSTRUMENTATION', bool(int(os.environ.get('PYTHIA_INSTRUMENTATION', 0))))
+app.config.setdefault('METRICS_TOKEN', os.environ.get('PYTHIA_METRICS_TOKEN'))
+
+if app.config['INSTRUMENTATION']:
+    instrumentation.enable()
+
+# one connection per request, handed back to the pool when it ends
+@app.before_request
+def before_request():
+    g.stage = instrumentation.start('request:%s' % request.endpoint)
+    connect_database()
+
+@app.teardown_request
+def teardown_request(exception):
+    close_database()
+    instrumentation.stop(g.pop('stage', None), exception)
+
+@app.before_first_request
+def start_services():
+    if app.config['JOURNAL'] and not app.config['MATCHING_SHARDS']:
+        journal.open_journal(app.config['JOURNAL'])
+        journal.restore_order_books()
+    matching_service.start()
+    if app.config['RUN_SCHEDULER']:
+        market_scheduler.start()
+
+# stage metrics in the prometheus text format
+@app.route('/metrics')
+def metrics():
+    token = app.config['METRICS_TOKEN']
+    if not token:
+        abort(404)
+    authorization = request.headers.get('Authorization', u'')
+    if not hmac.compare_digest(authorization.encode('utf-8'), (u'Bearer %s' % token).encode('utf-8')):
+        abort(401)
+
+    return Response(instrumentation.metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # forms
 class CreateForm(Form):
     name = TextField('Query', [validators.Length(min=3)])
-    price = FloatField('Price', [validators.NumberRange(min=0)])
+    price = IntegerField('Price', [validators.NumberRange(min=0, max=MAX_PRICE)])
     quantity = IntegerField('Quantity', [validators.NumberRange(min=1)])
 
 class OrderForm(Form):
-    price = FloatField('Price', [validators.NumberRange(min=0)])
+    price = IntegerField('Price', [validators.NumberRange(min=0, max=MAX_PRICE)])
     quantity = IntegerField('Quantity', [validators.NumberRange(min=1)])
     action = TextField('Action')
 
@@ -48,12 +137,8 @@ class OrderForm(Form):
 @app.route('/')
 @login_required
 def home():
-    # fetch open markets
-    markets = Market.select().where(Market.status == 'open')
-
-    # close markets
-    if any([market_maker.close_market(market) for market in markets]):
-        markets = Market.select().where(Market.status == 'open')
+    # fetch open markets, they are closed by the scheduler
+    markets = market_maker.get_open_markets_snapshot()
 
     ttl = gsp_markets.time_to_live()
     create_form = CreateForm()
@@ -85,22 +170,20 @@ def market_create():
             status='open',
             opening_date=opening_date,
             closing_date=closing_date,
+            resolution_date=resolution_date,
             price=create_form.price.data,
             volume=0
             )
+        market_scheduler.schedule(market)
+        market_maker.invalidate_snapshots(market.id, 'open_markets')
 
-        order = Order.create(
-            market=market.id, 
-            user=user.id, 
-            price=create_form.price.data, 
-            quantity=create_form.quantity.data,
-            type='buy',
-            status='pending')
+        order = matching_service.submit(
+            market, user.id, create_form.price.data, create_form.quantity.data, 'buy')
 
         flash('Your query has been added and your order have been registered')
         return redirect(url_for('market', id=market.id))
 
-    markets = Market.select()
+    markets = market_maker.get_open_markets_snapshot()
     ttl = gsp_markets.time_to_live()
 
     return render_template('home.html', markets=markets, ttl=ttl, create_form=create_form)
@@ -108,10 +191,11 @@ def market_create():
 @app.route('/market/<int:id>', methods=['GET', 'POST'])
 @login_required
 def market(id):
-    market = Market.get(Market.id == id)
+    # pages are served from snapshots invalidated by market_maker
+    market = market_maker.get_market_snapshot(id)
 
-    # close market if necessary
-    if market_maker.close_market(market):
+    # markets are closed by the scheduler, do not wait for it
+    if market['status'] != 'open' or market['closing_date'] < datetime.datetime.now():
         return redirect(url_for('home'))
 
     user = current_user
@@ -119,48 +203,100 @@ def market(id):
     sell_form = OrderForm()
 
     if buy_form.validate_on_submit():
-        order = Order.create(
-            market=market.id, 
-            user=user.id, 
-            price=buy_form.price.data, 
-            quantity=buy_form.quantity.data,
-            type='buy' if buy_form.action.data == 'BUY' else 'sell',
-            status='pending')
-        flash('Your order have been registered')
-
-        # clear market after each new order
-        market_maker.clear_market(market)
+        # the market is cleared in the background by the matching service
+        try:
+            order = matching_service.submit(
+                id, user.id, buy_form.price.data, buy_form.quantity.data,
+                'buy' if buy_form.action.data == 'BUY' else 'sell')
+        except ValueError as e:
+            flash('Your order was rejected: %s' % e)
+        else:
+            flash('Your order have been registered')
 
-        return redirect(url_for('market', id=market.id))
+        return redirect(url_for('market', id=id))
 
-    sell_orders = market_maker.get_sell_orders(market)
-    buy_orders = market_maker.get_buy_orders(market)
-    market_history =  market_maker.get_market_history(market)
+    book = matching_service.get_order_book_snapshot(id)
+    market_history =  market_maker.get_market_history_snapshot(id)
 
     return render_template('market.html', 
         market=market, user=user, buy_form=buy_form, sell_form=sell_form, 
-        sell_orders=sell_orders, buy_orders=buy_orders, market_history=market_history)
+        sell_orders=book['sell_orders'], buy_orders=book['buy_orders'], market_history=market_history)
 
 @app.route('/market/<int:id>/clear')
 @login_required
 def market_clear(id):
     market = Market.get(Market.id == id)
-    sell_orders = market_maker.get_sell_orders(market)
-    buy_orders = market_maker.get_buy_orders(market)
+    # the book is held by the matching service, maybe in a shard process
+    book = matching_service.get_order_book_snapshot(id)
 
-    (price, quantity) = market_maker.get_market_clearing_price(market, sell_orders, buy_orders)
+    (price, quantity) = market_maker.get_clearing_price(book['sell_levels'], book['buy_levels'])
 
     return render_template('market_clear.html', 
-        market=market, sell_orders=sell_orders, buy_orders=buy_orders, price=price, quantity=quantity)
+        market=market, sell_orders=book['sell_orders'], buy_orders=book['buy_orders'], price=price, quantity=quantity)
 
 @app.route('/market/<int:id>/clear_execute')
 @login_required
 def market_clear_execute(id):
-    market = Market.get(Market.id == id)
-    market_maker.clear_market(market)
+    matching_service.clear(id)
 
     return redirect(url_for('market', id=id))
 
+@app.route('/market/<int:id>/history')
+@login_required
+def market_history(id):
+    # keyset pagination, the next page starts before the last date and id
+    # returned
+    try:
+        (limit, before) = history.parse_page_args(request.args)
+    except ValueError:
+        abort(400)
+
+    resolution = request.args.get('resolution', type=int)
+    if resolution is None:
+        points = [
+            dict(id=point.id, date=point.date, price=point.price, volume=point.volume)
+            for point in history.get_history(id, before, limit)
+            ]
+    elif resolution in history.RESOLUTIONS:
+        points = [
+            dict(id=candle.id, date=candle.date, open=candle.open, high=candle.high,
+                low=candle.low, close=candle.close, volume=candle.volume)
+            for candle in history.get_candles(id, resolution, before, limit)
+            ]
+    else:
+        abort(400)
+
+    for point in points:
+        point['date'] = point['date'].strftime(history.DATE_FORMAT)
+
+    last = points[-1] if len(points) == limit else dict(date=None, id=None)
+    return jsonify(
+        points=points,
+        before=last['date'],
+        before_id=last['id'])
+
+@app.route('/order/<int:id>')
+@login_required
+def order_status(id):
+    try:
+        status = matching_service.get_order_status(id)
+    except Order.DoesNotExist:
+        abort(404)
+
+    if status['user'] != current_user.id:
+        abort(404)
+
+    return jsonify(**status)
+
+@app.route('/portfolio')
+@login_required
+def portfolio_page():
+    # leaders are computed for every user at once, served from a snapshot
+    return render_template('portfolio.html',
+        portfolio=portfolio.get_portfolio(current_user.id),
+        leaderboard=market_maker.get_leaderboard_snapshot(10))
+
 if __name__ == '__main__':
     app.debug = True
-    app.run()
+    # event streams hold their connection open, serve them on threads
+    app.run(threaded=True)
@@ -0,0 +1,108 @@
+#! /usr/bin/env python
+
+import argparse
+import datetime
+
+from data_model import atomic, chunked, Market, Stock, Order
+from order_book import drop_order_book
+import bank
+import market_maker
+import gsp_markets
+import events
+import journal
+import risk
+
+# value of a stock when the query of its market wins
+PAYOUT = 100
+
+def get_payout(outcome):
+    return PAYOUT if outcome else 0
+
+def resolve_markets(outcomes):
+    """Settle every position of the given markets.
+
+    outcomes maps market ids to True when the market pays out. All markets
+    are resolved together: stocks are read in one query, payouts are netted
+    per user and credited with one bulk transfer, and remaining pending
+    orders are cancelled with one UPDATE. Markets already resolved are
+    skipped, so resolving twice never pays twice.
+    """
+    outcomes = dict((getattr(market, 'id', market), outcome) for (market, outcome) in outcomes.items())
+    if not outcomes:
+        return list()
+
+    with atomic():
+        market_ids = list()
+        for ids in chunked(outcomes, 500):
+            market_ids.extend(market.id for market in Market.select(Market.id).where(
+                Market.id << ids,
+                Market.status != 'resolved'))
+
+        if not market_ids:
+            return list()
+
+        transfers = list()
+        for ids in chunked(market_ids, 500):
+            stocks = Stock.select(Stock.market, Stock.user, Stock.quantity).where(
+                Stock.market << ids,
+                Stock.quantity != 0)
+
+            # short positions pay the stocks they created
+            for stock in stocks:
+                payout = get_payout(outcomes[stock.market_id])
+                if payout:
+                    transfers.append((stock.user_id, stock.quantity * payout))
+
+        bank.execute_transfers(transfers)
+
+        for ids in chunked(market_ids, 500):
+            Stock.update(quantity=0).where(Stock.market << ids).execute()
+            Order.update(status='cancelled').where(
+                Order.market << ids,
+                Order.status == 'pending').execute()
+
+        for outcome in (True, False):
+            resolved_ids = [market_id for market_id in market_ids if bool(outcomes[market_id]) == outcome]
+            for ids in chunked(resolved_ids, 500):
+                Market.update(
+                    status='resolved',
+                    outcome=outcome,
+                    price=get_payout(outcome)
+                    ).where(Market.id << ids).execute()
+
+    # positions, orders and balances of many users moved at once, other
+    # processes drop their users exposed to these markets within
+    # risk.RESOLVED_INTERVAL
+    risk.clear()
+    for market_id in market_ids:
+        drop_order_book(market_id)
+        market_maker.invalidate_snapshots(market_id, 'book', 'market', 'open_markets')
+        journal.record_market_resolved(market_id, outcomes[market_id])
+        events.publish(market_id, 'market', status='resolved', outcome=outcomes[market_id])
+
+    return market_ids
+
+def resolve_period(resolution_date, top_query):
+    """Resolve the markets of one hour, the market of the top query wins."""
+    markets = Market.select(Market.id, Market.name).where(
+        Market.resolution_date == resolution_date,
+        Market.status != 'resolved')
+
+    top_query = top_query.strip().lower()
+    outcomes = dict((market.id, market.name.strip().lower() == top_query) for market in markets)
+
+    return resolve_markets(outcomes)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='pay out the markets of an hour')
+    parser.add_argument('top_query', help='top query on Rakuten UK over the hour')
+    parser.add_argument('--date', help='resolution date, YYYY-MM-DD HH:00 (default: the current hour)')
+    args = parser.parse_args()
+
+    if args.date:
+        resolution_date = datetime.datetime.strptime(args.date, '%Y-%m-%d %H:%M')
+    else:
+        resolution_date = gsp_markets.get_opening_date()
+
+    market_ids = resolve_period(resolution_date, args.top_query)
+    print('resolved %d markets' % len(market_ids))
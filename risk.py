@@ -0,0 +1,318 @@
+#! /usr/bin/env python
+
+import contextlib
+import threading
+import time
+
+from data_model import chunked, Market, Stock, Order, Account
+from order_book import MAX_PRICE
+
+# seconds between two looks for markets resolved by other processes, e.g.
+# by resolution.py, their users are stale until then
+RESOLVED_INTERVAL = 1
+
+class RiskLimitExceeded(ValueError):
+    # rejected like any invalid order, nothing of the batch is registered
+    pass
+
+class Limits(object):
+    """Pre-trade limits, each one is off while None.
+
+    max_short: most stocks a user may be short in a market once all of
+    their sell orders fill.
+    max_notional: most price x quantity a user may have in open orders
+    across all markets.
+    min_balance: lowest balance a user may be left with once all of their
+    buy orders fill and their short stocks pay MAX_PRICE, i.e. the cash
+    check, 0 for no credit.
+    """
+
+    def __init__(self, max_short=None, max_notional=None, min_balance=None):
+        self.max_short = max_short
+        self.max_notional = max_notional
+        self.min_balance = min_balance
+
+    def is_enabled(self):
+        return any(limit is not None for limit in (self.max_short, self.max_notional, self.min_balance))
+
+class Exposure(object):
+    # open orders and position of a user in one market
+
+    __slots__ = ('position', 'buy_quantity', 'buy_notional', 'sell_quantity', 'sell_notional')
+
+    def __init__(self, position=0):
+        self.position = position
+        self.buy_quantity = 0
+        self.buy_notional = 0
+        self.sell_quantity = 0
+        self.sell_notional = 0
+
+    def get_short(self):
+        return self.sell_quantity - self.position
+
+    def get_margin(self):
+        # cash the market may take: buys are paid in full, stocks held or
+        # sold short pay MAX_PRICE less what their sale brought
+        margin = self.buy_notional + max(-self.position, 0) * MAX_PRICE
+
+        short_quantity = self.sell_quantity - max(self.position, 0)
+        if short_quantity > 0:
+            # sold at the average price of the sell orders, rounded down
+            proceeds = self.sell_notional * short_quantity // self.sell_quantity
+            margin += short_quantity * MAX_PRICE - proceeds
+
+        return margin
+
+class UserExposure(object):
+    """Exposures of one user, with their totals kept up to date."""
+
+    def __init__(self, balance):
+        self.balance = balance
+        self.markets = dict()
+        self.margin = 0
+        self.notional = 0
+
+    def get_market(self, market_id):
+        exposure = self.markets.get(market_id)
+        if exposure is None:
+            exposure = self.markets[market_id] = Exposure()
+
+        return exposure
+
+    def move(self, market_id, type=None, price=0, quantity=0, position=0):
+        # quantity of an order at price opened (or closed when negative), and
+        # stocks bought (or sold when negative)
+        exposure = self.get_market(market_id)
+        margin = exposure.get_margin()
+
+        if type == 'buy':
+            exposure.buy_quantity += quantity
+            exposure.buy_notional += price * quantity
+        elif type == 'sell':
+            exposure.sell_quantity += quantity
+            exposure.sell_notional += price * quantity
+        exposure.position += position
+
+        self.notional += price * quantity
+        self.margin += exposure.get_margin() - margin
+
+    def get_violation(self, market_id, limits, short, notional, margin):
+        # short, notional and margin are what they were before the orders
+        exposure = self.markets[market_id]
+
+        # only what adds to an exposure already over a limit is rejected
+        if limits.max_short is not None and exposure.get_short() > max(limits.max_short, short):
+            return 'short %d stocks of market %s, at most %d' % (exposure.get_short(), market_id, limits.max_short)
+        if limits.max_notional is not None and self.notional > max(limits.max_notional, notional):
+            return 'open orders of %d, at most %d' % (self.notional, limits.max_notional)
+        if limits.min_balance is not None and self.margin > margin and self.balance - self.margin < limits.min_balance:
+            return 'balance of %.2f once orders fill, at least %d' % (self.balance - self.margin, limits.min_balance)
+
+        return None
+
+def get_values(order):
+    # orders are Order rows or the dicts orders are submitted as
+    if isinstance(order, dict):
+        return (getattr(order['user'], 'id', order['user']), getattr(order['market'], 'id', order['market']),
+            order['type'], int(order['price']), order['quantity'])
+
+    return (order.user_id, order.market_id, order.type, order.price, order.quantity)
+
+class ExposureIndex(object):
+    """Exposures of users, updated as their orders open, fill and cancel.
+
+    A user is loaded from the database the first time one of their orders
+    is checked, then every check is a few additions under a lock instead
+    of aggregates over their orders and stocks. Users are dropped from the
+    index when it cannot tell what the database holds anymore, e.g. when
+    the transaction of a checked order failed, or when one of the markets
+    they are exposed to was resolved. Markets resolved in this process
+    clear the index right away, those resolved by other processes are
+    looked for in one query over the exposed markets at most every
+    resolved_interval seconds, not on every check.
+    """
+
+    def __init__(self, resolved_interval=RESOLVED_INTERVAL):
+        self.users = dict()
+        self.database = None
+        self.resolved_interval = resolved_interval
+        self.resolved_date = 0
+        self.lock = threading.Lock()
+
+    def load_user(self, user_id):
+        # the caller holds the lock
+        if self.database is not Account._meta.database:
+            # users loaded from another database (e.g. after set_database) are stale
+            self.users.clear()
+            self.database = Account._meta.database
+
+        user = self.users.get(user_id)
+        if user is not None:
+            return (user, False)
+
+        balance = Account.select(Account.balance).where(Account.user == user_id).scalar()
+        user = UserExposure(balance or 0)
+        for stock in Stock.select(Stock.market, Stock.quantity).where(Stock.user == user_id, Stock.quantity != 0):
+            user.move(stock.market_id, position=stock.quantity)
+        for order in Order.select(Order.market, Order.type, Order.price, Order.quantity).where(
+                Order.user == user_id,
+                Order.status == 'pending'):
+            user.move(order.market_id, order.type, order.price, order.quantity)
+
+        self.users[user_id] = user
+        return (user, True)
+
+    def drop_resolved(self, user_ids):
+        # the caller holds the lock. markets resolved since their users were
+        # loaded, e.g. by resolution.py from its own process, zeroed their
+        # positions, cancelled their orders and paid them out
+        markets = dict()
+        for user_id in user_ids:
+            user = self.users.get(user_id)
+            if user is None:
+                continue
+            for (market_id, exposure) in user.markets.items():
+                if exposure.position or exposure.buy_quantity or exposure.sell_quantity:
+                    markets.setdefault(market_id, set()).add(user_id)
+
+        for ids in chunked(markets, 500):
+            for market in Market.select(Market.id).where(Market.id << ids, Market.status == 'resolved'):
+                for user_id in markets[market.id]:
+                    self.users.pop(user_id, None)
+
+    def check(self, limits, orders, cancelled=()):
+        orders = [get_values(order) for order in orders]
+        cancelled = [get_values(order) for order in cancelled]
+
+        with self.lock:
+            # users with exposures in resolved markets are read again
+            now = time.time()
+            if self.database is Account._meta.database and now - self.resolved_date >= self.resolved_interval:
+                self.drop_resolved(list(self.users))
+                self.resolved_date = now
+
+            users = dict()
+            for (user_id, market_id, type, price, quantity) in orders:
+                if user_id not in users:
+                    users[user_id] = self.load_user(user_id)
+
+            moves = list()
+            for (user_id, market_id, type, price, quantity) in cancelled:
+                # users loaded in the transaction cancelling their orders are
+                # loaded without them
+                (user, loaded) = users.get(user_id) or (self.users.get(user_id), False)
+                if user is not None and not loaded:
+                    moves.append((user, market_id, type, price, -quantity))
+
+            for (user_id, market_id, type, price, quantity) in orders:
+                moves.append((users[user_id][0], market_id, type, price, quantity))
+
+            (shorts, totals) = (dict(), dict())
+            for (user, market_id, type, price, quantity) in moves:
+                if (user, market_id) not in shorts:
+                    shorts[user, market_id] = user.get_market(market_id).get_short()
+                if user not in totals:
+                    totals[user] = (user.notional, user.margin)
+                user.move(market_id, type, price, quantity)
+
+            for ((user, market_id), short) in shorts.items():
+                violation = user.get_violation(market_id, limits, short, *totals[user])
+                if violation is not None:
+                    for (user, market_id, type, price, quantity) in reversed(moves):
+                        user.move(market_id, type, price, -quantity)
+                    for (user_id, (user, loaded)) in users.items():
+                        if loaded:
+                            del self.users[user_id]
+                    raise RiskLimitExceeded(violation)
+
+    def move(self, moves):
+        # (user id, market id, type, price, quantity, position) of users
+        # already loaded, the others are read up to date when they are
+        with self.lock:
+            for (user_id, market_id, type, price, quantity, position) in moves:
+                user = self.users.get(user_id)
+                if user is not None:
+                    user.move(market_id, type, price, quantity, position)
+
+    def add_cash(self, transfers):
+        with self.lock:
+            for (user_id, amount) in transfers:
+                user = self.users.get(user_id)
+                if user is not None:
+                    user.balance += amount
+
+    def drop_users(self, user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.users.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.users.clear()
+
+limits = Limits()
+index = ExposureIndex()
+
+def configure(max_short=None, max_notional=None, min_balance=None):
+    global limits
+
+    limits = Limits(max_short, max_notional, min_balance)
+    index.clear()
+
+def is_enabled():
+    return limits.is_enabled()
+
+def check_orders(orders, cancelled=()):
+    """Reserve the exposure of new orders, replacing cancelled ones.
+
+    Raises RiskLimitExceeded, and reserves nothing, when an order would
+    take its user over a limit. Does nothing while the limits are off.
+    """
+    if limits.is_enabled():
+        index.check(limits, orders, cancelled)
+
+def release_orders(orders, cancelled=()):
+    # the checked orders were not registered after all
+    if limits.is_enabled():
+        index.drop_users(set(get_values(order)[0] for order in list(orders) + list(cancelled)))
+
+@contextlib.contextmanager
+def reserving(orders, cancelled=()):
+    check_orders(orders, cancelled)
+    try:
+        yield
+    except Exception:
+        release_orders(orders, cancelled)
+        raise
+
+def remove_orders(orders):
+    # cancelled orders
+    if limits.is_enabled():
+        index.move([
+            (user_id, market_id, type, price, -quantity, 0)
+            for (user_id, market_id, type, price, quantity) in map(get_values, orders)
+            ])
+
+def reduce_order(order, quantity):
+    if limits.is_enabled():
+        index.move([(order.user_id, order.market_id, order.type, order.price, -quantity, 0)])
+
+def settle(settlement):
+    """Move the fills of a committed clear from open orders to positions,
+    and its transfers to balances."""
+    if not limits.is_enabled():
+        return
+
+    fills = [(order, order.quantity) for order in settlement.cleared_orders] + settlement.partial_orders
+    market_id = settlement.market.id
+    index.move(
+        [(order.user_id, market_id, order.type, order.price, -quantity, 0) for (order, quantity) in fills] +
+        [(user_id, market_id, None, 0, 0, quantity) for (user_id, quantity) in settlement.stock_moves])
+    index.add_cash(settlement.transfers)
+
+def add_cash(transfers):
+    if limits.is_enabled():
+        index.add_cash(transfers)
+
+def clear():
+    index.clear()
@@ -0,0 +1,124 @@
+#! /usr/bin/env python
+
+import argparse
+import datetime
+import heapq
+import logging
+import threading
+
+from data_model import Market
+import market_maker
+
+logger = logging.getLogger(__name__)
+
+class MarketScheduler(object):
+    """Closes markets when their closing date is reached.
+
+    Open markets are kept in a heap keyed on their closing date, every
+    market due at the same time is closed with one bulk UPDATE. Markets
+    created by other processes are picked up by reloading the open markets
+    every refresh_interval seconds.
+    """
+
+    def __init__(self, refresh_interval=60):
+        self.refresh_interval = refresh_interval
+        self.heap = list()
+        self.scheduled = set()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def schedule(self, market):
+        with self.lock:
+            if market.id in self.scheduled:
+                return
+            self.scheduled.add(market.id)
+            heapq.heappush(self.heap, (market.closing_date, market.id))
+            earliest = self.heap[0][1] == market.id
+
+        if earliest:
+            self.wakeup.set()
+
+    def load(self):
+        markets = Market.select(Market.id, Market.closing_date).where(Market.status == 'open')
+        for market in markets:
+            self.schedule(market)
+
+    def close_due(self, now=None):
+        if now is None:
+            now = datetime.datetime.now()
+
+        market_ids = list()
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                (closing_date, market_id) = heapq.heappop(self.heap)
+                self.scheduled.discard(market_id)
+                market_ids.append(market_id)
+
+        # markets whose closing date moved are rescheduled by the next load
+        if market_ids:
+            market_maker.close_markets(market_ids)
+
+        return market_ids
+
+    def get_timeout(self, now=None):
+        if now is None:
+            now = datetime.datetime.now()
+
+        with self.lock:
+            if not self.heap:
+                return self.refresh_interval
+
+            delay = self.heap[0][0] - now
+            seconds = delay.days * 86400 + delay.seconds + delay.microseconds / 1e6
+
+            return min(max(seconds, 0), self.refresh_interval)
+
+    def run(self):
+        refresh_date = None
+        while not self.stopped.is_set():
+            try:
+                now = datetime.datetime.now()
+                if refresh_date is None or refresh_date <= now:
+                    self.load()
+                    refresh_date = now + datetime.timedelta(seconds=self.refresh_interval)
+
+                closed = self.close_due()
+                if closed:
+                    logger.info('closed %d markets', len(closed))
+            except Exception:
+                logger.exception('failed to close markets')
+
+            self.wakeup.wait(self.get_timeout())
+            self.wakeup.clear()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='market-scheduler')
+            self.thread.daemon = True
+            self.thread.start()
+
+        return self
+
+    def stop(self):
+        if self.thread is not None:
+            self.stopped.set()
+            self.wakeup.set()
+            self.thread.join()
+            self.thread = None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='close markets when they are due')
+    parser.add_argument('--refresh', type=float, default=60, help='seconds between reloads of the open markets')
+    parser.add_argument('--once', action='store_true', help='close the markets due now and exit')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    scheduler = MarketScheduler(args.refresh)
+    if args.once:
+        scheduler.load()
+        print('closed %d markets' % len(scheduler.close_due()))
+    else:
+        scheduler.run()
@@ -0,0 +1,158 @@
+#! /usr/bin/env python
+
+import datetime
+
+from peewee import SQL, Clause, Param
+
+from data_model import atomic, chunked, insert_many
+from data_model import Stock, Order, MarketHistory
+from order_book import get_order_book, drop_order_book
+import bank
+import history
+import summary
+import risk
+from instrumentation import timed
+
+class Settlement(object):
+    """Mutations of one market clear.
+
+    Orders, stocks, accounts and transactions touched while clearing are
+    collected first and written together in a single database transaction,
+    so a clear either fully happens or not at all.
+    """
+
+    def __init__(self, market, price, quantity):
+        self.market = market
+        self.price = price
+        self.quantity = quantity
+        self.date = datetime.datetime.now()
+
+        self.transfers = list()
+        self.stock_moves = list()
+        self.cleared_orders = list()
+        self.partial_orders = list()
+        self.fills = list()
+
+    def transfer(self, user_id, amount):
+        self.transfers.append((user_id, amount))
+
+    def move_stock(self, user_id, quantity):
+        self.stock_moves.append((user_id, quantity))
+
+    def clear_order(self, order, clearing_quantity):
+        self.fills.append((order.id, order.user_id, order.type, clearing_quantity))
+        if clearing_quantity < order.quantity:
+            self.partial_orders.append((order, clearing_quantity))
+        else:
+            self.cleared_orders.append(order)
+
+    @timed
+    def execute(self):
+        market_state = (self.market.price, self.market.volume)
+        try:
+            with atomic():
+                self.write_orders()
+                self.write_stocks()
+                self.write_accounts()
+                self.write_market()
+        except Exception:
+            # the in memory book may not match the database anymore
+            drop_order_book(self.market)
+            bank.clear_account_ids()
+            (self.market.price, self.market.volume) = market_state
+            raise
+
+        # before the book moves cleared orders to the clearing price
+        risk.settle(self)
+        self.update_order_book()
+
+    @timed
+    def write_orders(self):
+        # orders are only cleared while pending, an order cancelled since
+        # the book was read fails the whole clear
+        updated = 0
+        cleared_ids = [order.id for order in self.cleared_orders]
+        for ids in chunked(cleared_ids, 500):
+            updated += Order.update(
+                price=self.price,
+                filled_quantity=Order.filled_quantity + Order.quantity,
+                quantity=0,
+                status='cleared'
+                ).where(Order.id << ids, Order.status == 'pending').execute()
+
+        # partially cleared orders stay pending with what is left of them
+        for (order, clearing_quantity) in self.partial_orders:
+            updated += Order.update(
+                filled_quantity=Order.filled_quantity + clearing_quantity,
+                quantity=Order.quantity - clearing_quantity
+                ).where(Order.id == order.id, Order.status == 'pending').execute()
+
+        if updated != len(self.cleared_orders) + len(self.partial_orders):
+            raise RuntimeError('orders of market %s changed while clearing' % self.market.id)
+
+    @timed
+    def write_stocks(self):
+        user_ids = set(user_id for (user_id, quantity) in self.stock_moves)
+
+        stocks = dict()
+        for ids in chunked(user_ids, 500):
+            for stock in Stock.select().where(Stock.market == self.market, Stock.user << ids):
+                stocks[stock.user_id] = stock
+
+        positions = dict((user_id, stocks[user_id].quantity if user_id in stocks else 0) for user_id in user_ids)
+        for (user_id, quantity) in self.stock_moves:
+            # selling short creates new stocks
+            held = max(positions[user_id], 0)
+            if -quantity > held:
+                self.market.volume += -quantity - held
+
+            positions[user_id] += quantity
+
+        insert_many(Stock, [
+            dict(market=self.market.id, user=user_id, quantity=positions[user_id])
+            for user_id in user_ids if user_id not in stocks
+            ])
+
+        # one update per chunk of moved stocks, each to its own position
+        moved = [
+            (stock.id, positions[user_id])
+            for (user_id, stock) in stocks.items() if stock.quantity != positions[user_id]
+            ]
+        for batch in chunked(moved, 250):
+            quantities = Clause(SQL('CASE'), Stock.id, *[
+                Clause(SQL('WHEN'), Param(stock_id), SQL('THEN'), Param(quantity))
+                for (stock_id, quantity) in batch
+                ] + [SQL('END')])
+            Stock.update(quantity=quantities).where(Stock.id << [stock_id for (stock_id, quantity) in batch]).execute()
+
+    @timed
+    def write_accounts(self):
+        bank.execute_transfers(self.transfers, self.date)
+
+    @timed
+    def write_market(self):
+        self.market.price = self.price
+        self.market.save()
+
+        MarketHistory.create(
+            market=self.market,
+            price=self.price,
+            volume=self.quantity,
+            date=self.date
+            )
+        history.add_trade(self.market, self.date, self.price, self.quantity)
+        summary.add_trade(self.market.id, self.date, self.price)
+
+    @timed
+    def update_order_book(self):
+        book = get_order_book(self.market)
+
+        for order in self.cleared_orders:
+            book.remove(order)
+            order.price = self.price
+            order.filled_quantity += order.quantity
+            order.quantity = 0
+            order.status = 'cleared'
+
+        for (order, clearing_quantity) in self.partial_orders:
+            book.reduce(order, clearing_quantity, filled=True)
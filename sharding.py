@@ -0,0 +1,328 @@
+#! /usr/bin/env python
+
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+import zlib
+
+import data_model
+from data_model import chunked, Order
+from matching_service import MatchingService
+import market_maker
+import events
+import journal
+import risk
+
+logger = logging.getLogger(__name__)
+
+# seconds a call waits for its shard to answer, the shard is checked to be
+# alive every POLL_INTERVAL seconds meanwhile
+CALL_TIMEOUT = 60
+POLL_INTERVAL = 1
+
+def get_shard(market_id, n_shards):
+    # stable across processes and restarts, unlike hash() of a string
+    return (zlib.crc32(str(market_id).encode('ascii')) & 0xffffffff) % n_shards
+
+class ShardWorker(object):
+    """Matching process owning the books of the markets of one shard.
+
+    Requests are (request id, method, arguments) tuples, answers and the
+    events published while matching are sent back on the responses queue.
+    Orders cross the process boundary as plain dicts.
+    """
+
+    def __init__(self, database_url, requests, responses, journal_path=None, risk_limits=None):
+        self.database_url = database_url
+        self.journal_path = journal_path
+        self.risk_limits = risk_limits
+        self.requests = requests
+        self.responses = responses
+        self.service = None
+
+    def run(self):
+        data_model.set_database(self.database_url)
+        if self.risk_limits:
+            risk.configure(**self.risk_limits)
+        if self.journal_path:
+            journal.open_journal(self.journal_path)
+            journal.restore_order_books()
+        self.service = MatchingService().start()
+        events.bus.add_listener(lambda event: self.responses.put(('event', None, event)))
+
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+
+            (request_id, method, args) = request
+            try:
+                result = getattr(self, method)(*args)
+            except ValueError as e:
+                self.responses.put(('error', request_id, ValueError(str(e))))
+            except Exception as e:
+                logger.exception('shard request %s failed', method)
+                self.responses.put(('error', request_id, RuntimeError(str(e))))
+            else:
+                self.responses.put(('result', request_id, result))
+
+        self.service.stop()
+        journal.close_journal()
+
+    def submit(self, market_id, user_id, price, quantity, type):
+        return market_maker.get_order_values(self.service.submit(market_id, user_id, price, quantity, type))
+
+    def submit_orders(self, orders):
+        return [market_maker.get_order_values(order) for order in self.service.submit_orders(orders)]
+
+    def cancel_orders(self, order_ids):
+        return [market_maker.get_order_values(order) for order in self.service.cancel_orders(order_ids)]
+
+    def cancel_user_orders(self, user_id, market_id):
+        return [market_maker.get_order_values(order) for order in self.service.cancel_user_orders(user_id, market_id)]
+
+    def amend_order(self, order_id, price, quantity):
+        order = self.service.amend_order(order_id, price, quantity)
+
+        return market_maker.get_order_values(order) if order is not None else None
+
+    def replace_quotes(self, market_id, user_id, quotes):
+        return [market_maker.get_order_values(order) for order in self.service.replace_quotes(market_id, user_id, quotes)]
+
+    def clear(self, market_id):
+        self.service.clear(market_id)
+
+    def flush(self):
+        self.service.flush()
+
+    def get_order_book_snapshot(self, market_id):
+        return self.service.get_order_book_snapshot(market_id)
+
+def run_shard(database_url, requests, responses, journal_path=None, risk_limits=None):
+    ShardWorker(database_url, requests, responses, journal_path, risk_limits).run()
+
+class ShardRouter(object):
+    """Matches markets in n_shards processes instead of in this one.
+
+    Markets are hashed to shards, each shard is a process with its own
+    MatchingService owning the books of its markets, so matching spreads
+    over all cores. The router has the interface of MatchingService: calls
+    are forwarded to the shard of their market and wait for its answer.
+    Every shard works on the same database, which should be one several
+    processes write efficiently (sqlite in wal mode, postgresql).
+
+    Events published by the shards are published again in this process,
+    where they feed event streams and invalidate the snapshots built from
+    what changed.
+
+    Risk limits are checked by the shards. A shard follows the orders of
+    its own markets, and sees those of the other shards as they were when
+    it loaded their user, so the short limit is exact but the notional and
+    cash limits over all markets of a user are only approximate.
+    """
+
+    def __init__(self, n_shards, database_url=None, journal_path=None, risk_limits=None):
+        self.n_shards = n_shards
+        self.database_url = database_url or data_model.DATABASE_URL
+        self.journal_path = journal_path
+        self.risk_limits = risk_limits
+        self.processes = list()
+        self.requests = list()
+        self.responses = None
+        self.answers = dict()
+        self.answers_lock = threading.Lock()
+        self.request_ids = itertools.count()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return self
+
+        self.responses = multiprocessing.Queue()
+        for i in range(self.n_shards):
+            requests = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=run_shard, name='matching-shard-%d' % i,
+                args=(self.database_url, requests, self.responses,
+                      '%s.%d' % (self.journal_path, i) if self.journal_path else None, self.risk_limits))
+            process.daemon = True
+            process.start()
+            self.requests.append(requests)
+            self.processes.append(process)
+
+        self.thread = threading.Thread(target=self.run, name='shard-router')
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        if self.thread is None:
+            return
+
+        for requests in self.requests:
+            requests.put(None)
+        for process in self.processes:
+            process.join()
+
+        self.responses.put(None)
+        self.thread.join()
+        self.thread = None
+        self.processes = list()
+        self.requests = list()
+
+    def run(self):
+        while True:
+            response = self.responses.get()
+            if response is None:
+                return
+
+            (kind, request_id, value) = response
+            if kind == 'event':
+                self.forward_event(value)
+                continue
+
+            with self.answers_lock:
+                answer = self.answers.pop(request_id, None)
+            if answer is None:
+                # the call gave up waiting for it
+                continue
+            answer[1:] = [kind, value]
+            answer[0].set()
+
+    def forward_event(self, event):
+        market_id = event.pop('market')
+        type = event.pop('type')
+        event.pop('id')
+
+        # snapshots of this process are built from what the shard changed
+        if type == 'trade':
+            market_maker.invalidate_snapshots(market_id, 'history', 'market', 'open_markets')
+        elif type == 'market':
+            market_maker.invalidate_snapshots(market_id, 'market', 'open_markets')
+        elif type == 'book':
+            # the shard wrote the new top of the book to the summary
+            market_maker.invalidate_snapshots(market_id, 'open_markets')
+
+        events.publish(market_id, type, **event)
+
+    def call(self, shard, method, *args, **options):
+        timeout = options.get('timeout', CALL_TIMEOUT)
+        request_id = next(self.request_ids)
+        answer = [threading.Event(), None, None]
+        with self.answers_lock:
+            self.answers[request_id] = answer
+
+        self.requests[shard].put((request_id, method, args))
+        deadline = time.time() + timeout
+        while not answer[0].wait(min(POLL_INTERVAL, max(deadline - time.time(), 0))):
+            process = self.processes[shard]
+            if process.is_alive() and time.time() < deadline:
+                continue
+
+            with self.answers_lock:
+                waiting = self.answers.pop(request_id, None) is not None
+            if not waiting:
+                # answered meanwhile
+                answer[0].wait()
+            elif not process.is_alive():
+                raise RuntimeError('matching shard %d exited with code %s' % (shard, process.exitcode))
+            else:
+                raise RuntimeError('matching shard %d did not answer %s within %s seconds' % (shard, method, timeout))
+
+        (event, kind, value) = answer
+        if kind == 'error':
+            raise value
+
+        return value
+
+    def get_market_shard(self, market):
+        return get_shard(getattr(market, 'id', market), self.n_shards)
+
+    def get_order_shards(self, orders):
+        # order ids grouped by the shard of their market
+        order_ids = [getattr(order, 'id', order) for order in orders]
+        shards = dict()
+        for ids in chunked(order_ids, 500):
+            for order in Order.select(Order.id, Order.market).where(Order.id << ids):
+                shards.setdefault(self.get_market_shard(order.market_id), list()).append(order.id)
+
+        return shards
+
+    def submit(self, market, user, price, quantity, type):
+        values = self.call(
+            self.get_market_shard(market), 'submit',
+            getattr(market, 'id', market), getattr(user, 'id', user), price, quantity, type)
+
+        return Order(**values)
+
+    def submit_orders(self, orders):
+        # the whole batch is validated here, each shard registers its part
+        # of it in one transaction
+        orders = market_maker.validate_orders(orders)
+
+        shards = dict()
+        for order in orders:
+            order = dict(order,
+                market=getattr(order['market'], 'id', order['market']),
+                user=getattr(order['user'], 'id', order['user']))
+            shards.setdefault(self.get_market_shard(order['market']), list()).append(order)
+
+        created = list()
+        for (shard, shard_orders) in sorted(shards.items()):
+            created.extend(Order(**values) for values in self.call(shard, 'submit_orders', shard_orders))
+
+        return created
+
+    def cancel_orders(self, orders):
+        cancelled = list()
+        for (shard, order_ids) in sorted(self.get_order_shards(orders).items()):
+            cancelled.extend(Order(**values) for values in self.call(shard, 'cancel_orders', order_ids))
+
+        return cancelled
+
+    def cancel_user_orders(self, user, market=None):
+        user_id = getattr(user, 'id', user)
+        if market is not None:
+            shards = [self.get_market_shard(market)]
+            market = getattr(market, 'id', market)
+        else:
+            shards = range(self.n_shards)
+
+        cancelled = list()
+        for shard in shards:
+            cancelled.extend(Order(**values) for values in self.call(shard, 'cancel_user_orders', user_id, market))
+
+        return cancelled
+
+    def amend_order(self, order, price=None, quantity=None):
+        shards = self.get_order_shards([order])
+        if not shards:
+            return None
+
+        ((shard, (order_id, )), ) = shards.items()
+        values = self.call(shard, 'amend_order', order_id, price, quantity)
+
+        return Order(**values) if values is not None else None
+
+    def replace_quotes(self, market, user, quotes):
+        values = self.call(
+            self.get_market_shard(market), 'replace_quotes',
+            getattr(market, 'id', market), getattr(user, 'id', user), list(quotes))
+
+        return [Order(**order) for order in values]
+
+    def clear(self, market_id):
+        self.call(self.get_market_shard(market_id), 'clear', market_id)
+
+    def flush(self):
+        for shard in range(self.n_shards):
+            self.call(shard, 'flush')
+
+    def get_order_status(self, order_id):
+        return market_maker.get_order_status(order_id)
+
+    def get_order_book_snapshot(self, market_id):
+        return self.call(self.get_market_shard(market_id), 'get_order_book_snapshot', market_id)
@@ -0,0 +1,163 @@
+#! /usr/bin/env python
+
+import argparse
+import datetime
+import threading
+
+import peewee
+from peewee import fn, JOIN
+
+from data_model import atomic, insert_many, Market, MarketHistory, MarketSummary, Order
+from order_book import get_order_book
+
+# the volume of a summary is what traded over this window, as of the last
+# trade of the market or the last rebuild
+VOLUME_WINDOW = datetime.timedelta(days=1)
+
+# top of the book last written for every market, the summary is only
+# written again when it moves
+_tops = dict()
+_tops_database = None
+_tops_lock = threading.Lock()
+
+def write_summary(market_id, **values):
+    # the row of a market is created by the first change written to it
+    updated = MarketSummary.update(**values).where(MarketSummary.market == market_id).execute()
+    if updated:
+        return
+
+    try:
+        with atomic():
+            MarketSummary.create(market=market_id, **values)
+    except peewee.IntegrityError:
+        # created concurrently since
+        MarketSummary.update(**values).where(MarketSummary.market == market_id).execute()
+
+def get_top(book):
+    with book.lock:
+        (best_bid, best_ask) = (book.get_best_price('buy'), book.get_best_price('sell'))
+        return (
+            best_bid, book.get_level_quantity('buy', best_bid) if best_bid is not None else 0,
+            best_ask, book.get_level_quantity('sell', best_ask) if best_ask is not None else 0)
+
+def update_book(market_id):
+    """Write the top of the book of a market to its summary.
+
+    Returns True when the summary changed, orders placed or cancelled
+    behind the best prices leave it as it is.
+    """
+    global _tops_database
+
+    top = get_top(get_order_book(market_id))
+    with _tops_lock:
+        # tops written to another database (e.g. after set_database) are stale
+        if _tops_database is not MarketSummary._meta.database:
+            _tops.clear()
+            _tops_database = MarketSummary._meta.database
+        if _tops.get(market_id) == top:
+            return False
+
+    (best_bid, bid_quantity, best_ask, ask_quantity) = top
+    write_summary(market_id,
+        best_bid=best_bid, bid_quantity=bid_quantity,
+        best_ask=best_ask, ask_quantity=ask_quantity)
+
+    with _tops_lock:
+        _tops[market_id] = top
+
+    return True
+
+def add_trade(market_id, date, price):
+    # run in the transaction writing the trade to the history
+    volume = MarketHistory.select(fn.Sum(MarketHistory.volume)).where(
+        MarketHistory.market == market_id,
+        MarketHistory.date > date - VOLUME_WINDOW).scalar() or 0
+
+    write_summary(market_id, last_price=price, last_date=date, volume=volume)
+
+def get_open_market_summaries():
+    # one query for every open market and its summary
+    markets = Market.select(Market, MarketSummary).join(
+        MarketSummary, JOIN.LEFT_OUTER, on=(MarketSummary.market == Market.id).alias('summary')
+        ).where(Market.status == 'open').order_by(Market.id)
+
+    summaries = list()
+    for market in markets:
+        summary = getattr(market, 'summary', None)
+        if summary is None or summary.id is None:
+            # no order nor trade yet
+            summary = MarketSummary()
+        summaries.append(dict(
+            id=market.id,
+            name=market.name,
+            price=market.price,
+            best_bid=summary.best_bid,
+            bid_quantity=summary.bid_quantity,
+            best_ask=summary.best_ask,
+            ask_quantity=summary.ask_quantity,
+            last_price=summary.last_price,
+            last_date=summary.last_date,
+            volume=summary.volume))
+
+    return summaries
+
+def rebuild(now=None):
+    """Recompute every summary from the orders and the history.
+
+    Pending orders are read in one pass grouped by market, side and price,
+    the history in one pass grouped by market, instead of a query per
+    market.
+    """
+    now = now or datetime.datetime.now()
+    summaries = dict()
+
+    def get_summary(market_id):
+        return summaries.setdefault(market_id, dict(
+            market=market_id, best_bid=None, bid_quantity=0, best_ask=None, ask_quantity=0,
+            last_price=None, last_date=None, volume=0))
+
+    levels = Order.select(
+        Order.market, Order.type, Order.price, fn.Sum(Order.quantity).alias('level_quantity')
+        ).where(Order.status == 'pending', Order.market.is_null(False)
+        ).group_by(Order.market, Order.type, Order.price).tuples()
+    for (market_id, type, price, quantity) in levels:
+        summary = get_summary(market_id)
+        if type == 'buy' and (summary['best_bid'] is None or price > summary['best_bid']):
+            (summary['best_bid'], summary['bid_quantity']) = (price, quantity)
+        elif type == 'sell' and (summary['best_ask'] is None or price < summary['best_ask']):
+            (summary['best_ask'], summary['ask_quantity']) = (price, quantity)
+
+    # last trade of every market, then its price and the recent volume
+    last_dates = MarketHistory.select(
+        MarketHistory.market, fn.Max(MarketHistory.date).alias('last_date')
+        ).group_by(MarketHistory.market).alias('last_trades')
+    trades = MarketHistory.select(MarketHistory.market, MarketHistory.date, MarketHistory.price).join(
+        last_dates, on=(
+            (MarketHistory.market == last_dates.c.market_id) &
+            (MarketHistory.date == last_dates.c.last_date))
+        ).tuples()
+    for (market_id, date, price) in trades:
+        summary = get_summary(market_id)
+        (summary['last_price'], summary['last_date']) = (price, date)
+
+    volumes = MarketHistory.select(
+        MarketHistory.market, fn.Sum(MarketHistory.volume).alias('window_volume')
+        ).where(MarketHistory.date > now - VOLUME_WINDOW).group_by(MarketHistory.market).tuples()
+    for (market_id, volume) in volumes:
+        get_summary(market_id)['volume'] = volume
+
+    with atomic():
+        MarketSummary.delete().execute()
+        insert_many(MarketSummary, list(summaries.values()))
+
+    with _tops_lock:
+        _tops.clear()
+
+    return len(summaries)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='recompute the market summaries from the orders and the history')
+    parser.add_argument('command', choices=('rebuild', ))
+    args = parser.parse_args()
+
+    print('%d market summaries rebuilt' % rebuild())
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path as osp
+import tempfile
+import shutil
+import peewee
+import datetime
+import json
+
+from flask import Flask
+from flask.ext.login import LoginManager
+
+TEST = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(TEST)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import Market, MarketHistory
+from matching_service import MatchingService
+import api
+
+class ApiUnittests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        db = peewee.SqliteDatabase(osp.join(self.temp_dir, 'pythia.sqlite'), check_same_thread=False)
+
+        data_model.set_database(db)
+        data_model.create_tables()
+
+        self.start = datetime.datetime(2016, 1, 1, 12)
+        self.market = Market.create(
+            name= 'unittest',
+            description = 'unittest',
+            status = 'open',
+            opening_date = self.start,
+            closing_date = self.start + datetime.timedelta(hours=1),
+            price = 0,
+            volume = 0
+            )
+
+        app = Flask(__name__)
+        app.config['LOGIN_DISABLED'] = True
+        LoginManager(app)
+        api.build_api(app, MatchingService())
+        self.client = app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def get_json(self, url):
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+
+        return json.loads(response.data.decode('utf-8'))
+
+    def test_trades(self):
+
+        for i in range(3):
+            MarketHistory.create(market=self.market, date=self.start, price=i, volume=1)
+
+        page = self.get_json('/api/markets/%d/trades?limit=2' % self.market.id)
+        self.assertEqual([2, 1], [trade['price'] for trade in page['trades']])
+
+        page = self.get_json('/api/markets/%d/trades?before=%s&before_id=%d' % (
+            self.market.id, page['before'].replace(' ', '%20'), page['before_id']))
+        self.assertEqual([0], [trade['price'] for trade in page['trades']])
+        self.assertEqual(None, page['before'])
+
+        # pages hold at least one trade
+        for limit in (0, -1):
+            page = self.get_json('/api/markets/%d/trades?limit=%d' % (self.market.id, limit))
+            self.assertEqual([2], [trade['price'] for trade in page['trades']])
+
+        self.assertEqual(400, self.client.get('/api/markets/%d/trades?before=yesterday' % self.market.id).status_code)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path as osp
+import tempfile
+import shutil
+import peewee
+import datetime
+
+TEST = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(TEST)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import User, Market, MarketHistory, Order, Account, Transaction
+import market_maker
+import archive
+
+class ArchiveUnittests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        db = peewee.SqliteDatabase(osp.join(self.temp_dir, 'pythia.sqlite'), check_same_thread=False)
+
+        data_model.set_database(db)
+        data_model.create_tables()
+
+        archive.set_archive_database(peewee.SqliteDatabase(osp.join(self.temp_dir, 'archive.sqlite')))
+
+        self.user1 = User.create(
+            email = 'unitest1',
+            password = 'unittest1'
+            )
+
+        self.user2 = User.create(
+            email = 'unitest2',
+            password = 'unittest2'
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def create_market(self):
+        market = Market.create(
+            name= 'unittest',
+            description = 'unittest',
+            status = 'open',
+            opening_date = datetime.datetime.now(),
+            closing_date = datetime.datetime.now() + datetime.timedelta(1),
+            price = 0,
+            volume = 0
+            )
+
+        for i in range(3):
+            market_maker.put(market, self.user1, 10, 1)
+            market_maker.call(market, self.user2, 20, 1)
+            market_maker.clear_market(market)
+        market_maker.put(market, self.user1, 30, 1)
+
+        return market
+
+    def get_ledger(self):
+        return dict(
+            (account.user_id, sum(transaction.amount for transaction in account.transactions))
+            for account in Account.select())
+
+    def test_archive(self):
+
+        closed = self.create_market()
+        opened = self.create_market()
+        Market.update(
+            status='closed',
+            closing_date=datetime.datetime.now() - datetime.timedelta(1)
+            ).where(Market.id == closed.id).execute()
+
+        ledger = self.get_ledger()
+        self.assertEqual(12, Transaction.select().count())
+
+        counts = archive.archive(datetime.datetime.now(), batch_size=4)
+        self.assertEqual(dict(markets=1, orders=6, history=3, transactions=12), counts)
+
+        # pending orders and open markets are left alone
+        self.assertEqual([closed.id], [order.market_id for order in Order.select().where(
+            Order.market == closed.id)])
+        self.assertEqual(7, Order.select().where(Order.market == opened.id).count())
+        self.assertEqual(0, MarketHistory.select().where(MarketHistory.market == closed.id).count())
+        self.assertEqual(3, MarketHistory.select().where(MarketHistory.market == opened.id).count())
+        self.assertEqual(6, archive.ArchivedOrder.select().count())
+        self.assertEqual(3, archive.ArchivedMarketHistory.select().count())
+
+        # the ledger of every account is rolled up into one row
+        self.assertEqual(2, Transaction.select().count())
+        self.assertEqual(12, archive.ArchivedTransaction.select().count())
+        self.assertEqual(ledger, self.get_ledger())
+        for account in Account.select():
+            self.assertEqual(account.balance, self.get_ledger()[account.user_id])
+
+        # new transactions are added to the same rollups
+        market_maker.call(opened, self.user2, 40, 1)
+        market_maker.clear_market(opened)
+        ledger = self.get_ledger()
+        archive.archive(datetime.datetime.now())
+        self.assertEqual(2, Transaction.select().count())
+        self.assertEqual(14, archive.ArchivedTransaction.select().count())
+        self.assertEqual(ledger, self.get_ledger())
+
+        # nothing is left to move
+        self.assertEqual(
+            dict(markets=1, orders=0, history=0, transactions=0),
+            archive.archive(datetime.datetime.now()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,7 @@ import os
 import os.path as osp
 import tempfile
 import shutil
+import threading
 import peewee
 
 TEST = osp.abspath(osp.dirname(__file__))
@@ -14,7 +15,7 @@ ROOT = osp.dirname(TEST)
 sys.path.append(ROOT)
 
 import data_model
-from data_model import User
+from data_model import User, Account
 import bank
 
 class BankUnittests(unittest.TestCase):
@@ -52,5 +53,64 @@ class BankUnittests(unittest.TestCase):
         self.assertEqual(n, 2)
         self.assertEqual(s, 300)
 
+    def test_execute_transfers(self):
+
+        user1 = User.create(
+            email = 'unitest1',
+            password = 'unittest1'
+            )
+
+        user2 = User.create(
+            email = 'unitest2',
+            password = 'unittest2'
+            )
+
+        bank.execute_transaction(user1, 100)
+        bank.execute_transfers([(user1, 10), (user2, -7), (user1, -4), (user1.id, 1)])
+
+        account1 = user1.account.get()
+        self.assertEqual(107, account1.balance)
+        self.assertEqual(4, account1.transactions.count())
+
+        account2 = user2.account.get()
+        self.assertEqual(-7, account2.balance)
+        self.assertEqual([-7], [transaction.amount for transaction in account2.transactions])
+
+    def test_concurrent_transactions(self):
+
+        user = User.create(
+            email = 'unitest',
+            password = 'unittest'
+            )
+        bank.create_account(user)
+
+        def execute_transactions():
+            for i in range(25):
+                bank.execute_transaction(user, 1)
+
+        threads = [threading.Thread(target=execute_transactions) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # no update is lost between concurrent writers
+        account = user.account.get()
+        self.assertEqual(100, account.balance)
+        self.assertEqual(100, account.transactions.count())
+
+    def test_account_ids(self):
+
+        users = [User.create(email = 'unitest%d' % i, password = 'unittest') for i in range(3)]
+        bank.create_account(users[0])
+
+        account_ids = bank.get_account_ids(user.id for user in users)
+        self.assertEqual(3, Account.select().count())
+        for user in users:
+            self.assertEqual(user.account.get().id, account_ids[user.id])
+            self.assertEqual(user.account.get().id, bank.get_account_id(user))
+
+        self.assertEqual(3, Account.select().count())
+
 if __name__ == '__main__':
     unittest.main()    
@@ -0,0 +1,80 @@
+#! /usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path as osp
+import time
+
+TEST = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(TEST)
+sys.path.append(ROOT)
+
+from cache import Cache, LocalBackend
+
+class CacheUnittests(unittest.TestCase):
+
+    def test_local_backend(self):
+
+        backend = LocalBackend(max_size=2)
+        backend.set('a', 1)
+        backend.set('b', 2)
+        self.assertEqual(1, backend.get('a'))
+
+        # the least recently used entry is evicted
+        backend.set('c', 3)
+        self.assertEqual(None, backend.get('b'))
+        self.assertEqual(1, backend.get('a'))
+        self.assertEqual(3, backend.get('c'))
+
+        backend.set('d', 4, 0.01)
+        time.sleep(0.02)
+        self.assertEqual(None, backend.get('d'))
+
+        backend.delete('a')
+        self.assertEqual(None, backend.get('a'))
+
+    def test_cache(self):
+
+        loads = list()
+        def load():
+            loads.append(1)
+            return len(loads)
+
+        cache = Cache()
+        self.assertEqual(1, cache.get('key', load))
+        self.assertEqual(1, cache.get('key', load))
+
+        cache.delete('key')
+        self.assertEqual(2, cache.get('key', load))
+
+        # binding to another source drops everything
+        cache.bind(object())
+        self.assertEqual(3, cache.get('key', load))
+
+    def test_invalidated_while_loading(self):
+
+        cache = Cache()
+        def load():
+            cache.delete('key')
+            return 'stale'
+
+        self.assertEqual('stale', cache.get('key', load))
+        self.assertEqual('fresh', cache.get('key', lambda: 'fresh'))
+
+    def test_locked_store(self):
+
+        # the check of a load and its store are not split by an invalidation
+        class Backend(LocalBackend):
+            def set(self, key, value, time_to_live=0):
+                stored.append(cache.lock.locked())
+                LocalBackend.set(self, key, value, time_to_live)
+
+        stored = list()
+        cache = Cache(Backend())
+        cache.get('key', lambda: 'value')
+        self.assertEqual([True], stored)
+
+if __name__ == '__main__':
+    unittest.main()    
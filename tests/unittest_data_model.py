@@ -0,0 +1,53 @@
+#! /usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path as osp
+import tempfile
+import shutil
+import peewee
+
+TEST = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(TEST)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import User
+
+class DataModelUnittests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_open_database(self):
+
+        database = data_model.open_database('sqlite:///%s' % osp.join(self.temp_dir, 'wal.sqlite'))
+        self.assertTrue(isinstance(database, peewee.SqliteDatabase))
+        self.assertEqual(('wal', ), database.pragma('journal_mode'))
+        self.assertEqual((1, ), database.pragma('synchronous'))
+
+        # the url overrides the default pragmas
+        database = data_model.open_database('sqlite:///%s?journal_mode=delete' % osp.join(self.temp_dir, 'delete.sqlite'))
+        self.assertEqual(('delete', ), database.pragma('journal_mode'))
+
+    def test_set_database_url(self):
+
+        database = data_model.set_database('sqlite+pool:///%s?max_connections=2' % osp.join(self.temp_dir, 'pool.sqlite'))
+        self.assertTrue(database is data_model.get_database())
+        data_model.create_tables()
+
+        # connections go back to the pool once closed
+        for i in range(3):
+            data_model.connect_database()
+            User.create(email='unittest%d' % i, password='unittest')
+            data_model.close_database()
+        self.assertEqual(3, User.select().count())
+        self.assertTrue(len(database._connections) <= 2)
+
+if __name__ == '__main__':
+    unittest.main()
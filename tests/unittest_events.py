@@ -0,0 +1,118 @@
+#! /usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path as osp
+import tempfile
+import shutil
+import peewee
+import datetime
+
+TEST = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(TEST)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import User, Market
+import market_maker
+import events
+
+class EventsUnittests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        db = peewee.SqliteDatabase(osp.join(self.temp_dir, 'pythia.sqlite'), check_same_thread=False)
+
+        data_model.set_database(db)
+        data_model.create_tables()
+
+        self.market = Market.create(
+            name= 'unittest',
+            description = 'unittest',
+            status = 'open',
+            opening_date = datetime.datetime.now(),
+            closing_date = datetime.datetime.now() + datetime.timedelta(1),
+            price = 0,
+            volume = 0
+            )
+
+        self.user = User.create(
+            email = 'unitest',
+            password = 'unittest'
+            )
+
+        self.subscription = events.subscribe(self.market.id)
+
+    def tearDown(self):
+        events.unsubscribe(self.subscription)
+        shutil.rmtree(self.temp_dir)
+
+    def get_events(self):
+        received = list()
+        while True:
+            event = self.subscription.get(0)
+            if event is None:
+                return received
+            received.append(event)
+
+    def test_bus(self):
+
+        bus = events.EventBus(max_pending=2)
+        subscription = bus.subscribe(1)
+        other = bus.subscribe(2)
+
+        bus.publish(1, 'trade', price=10)
+        bus.publish(1, 'trade', price=20)
+        self.assertEqual(None, other.get(0))
+        self.assertEqual(2, bus.get_sequence(1))
+
+        event = subscription.get(0)
+        self.assertEqual((1, 1, 'trade', 10), (event['id'], event['market'], event['type'], event['price']))
+        self.assertEqual(2, subscription.get(0)['id'])
+
+        # a subscriber that does not keep up stops receiving
+        for i in range(3):
+            bus.publish(1, 'trade', price=i)
+        self.assertTrue(subscription.overflowed)
+
+        bus.unsubscribe(subscription)
+        bus.unsubscribe(other)
+        self.assertFalse(bus.has_subscribers(1))
+
+    def test_book_deltas_and_trades(self):
+
+        market_maker.put(self.market, self.user, 10, 3)
+        market_maker.put(self.market, self.user, 10, 2)
+        market_maker.call(self.market, self.user, 20, 4)
+
+        received = self.get_events()
+        self.assertEqual(['book', 'book', 'book'], [event['type'] for event in received])
+        self.assertEqual([dict(side='sell', price=10, quantity=5)], received[1]['levels'])
+        self.assertEqual([dict(side='buy', price=20, quantity=4)], received[2]['levels'])
+
+        market_maker.clear_market(self.market)
+
+        # only the levels that moved are sent, with their new quantity
+        (book, trade) = self.get_events()
+        self.assertEqual([
+            dict(side='buy', price=20, quantity=0),
+            dict(side='sell', price=10, quantity=1),
+            ], book['levels'])
+        self.assertEqual((15, 4), (trade['price'], trade['quantity']))
+        self.assertEqual(book['id'] + 1, trade['id'])
+
+    def test_book_snapshot_levels(self):
+
+        market_maker.put(self.market, self.user, 10, 3)
+        market_maker.put(self.market, self.user, 10, 2)
+        market_maker.put(self.market, self.user, 12, 1)
+        market_maker.call(self.market, self.user, 5, 4)
+
+        book = market_maker.get_order_book_snapshot(self.market.id)
+        self.assertEqual([(10, 5), (12, 1)], book['sell_levels'])
+        self.assertEqual([(5, 4)], book['buy_levels'])
+
+if __name__ == '__main__':
+    unittest.main()
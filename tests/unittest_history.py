@@ -0,0 +1,119 @@
+#! /usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path as osp
+import tempfile
+import shutil
+import peewee
+import datetime
+from werkzeug.datastructures import MultiDict
+
+TEST = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(TEST)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import Market, MarketHistory, MarketCandle
+import history
+
+class HistoryUnittests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        db = peewee.SqliteDatabase(osp.join(self.temp_dir, 'pythia.sqlite'), check_same_thread=False)
+
+        data_model.set_database(db)
+        data_model.create_tables()
+
+        self.start = datetime.datetime(2016, 1, 1, 12)
+        self.market = Market.create(
+            name= 'unittest',
+            description = 'unittest',
+            status = 'open',
+            opening_date = self.start,
+            closing_date = self.start + datetime.timedelta(hours=1),
+            price = 0,
+            volume = 0
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def add_trades(self, trades):
+        with data_model.atomic():
+            for (seconds, price, volume) in trades:
+                date = self.start + datetime.timedelta(seconds=seconds)
+                MarketHistory.create(market=self.market, date=date, price=price, volume=volume)
+                history.add_trade(self.market, date, price, volume)
+
+    def get_candles(self, resolution):
+        return [
+            (candle.date, candle.open, candle.high, candle.low, candle.close, candle.volume)
+            for candle in history.get_candles(self.market, resolution)
+            ]
+
+    def test_add_trade(self):
+
+        self.add_trades([(0, 50, 1), (10, 70, 2), (30, 40, 1), (70, 60, 3)])
+
+        minute = datetime.timedelta(minutes=1)
+        self.assertEqual([
+            (self.start + minute, 60, 60, 60, 60, 3),
+            (self.start, 50, 70, 40, 40, 4),
+            ], self.get_candles(60))
+        self.assertEqual([(self.start, 50, 70, 40, 60, 7)], self.get_candles(3600))
+        self.assertEqual(4, len(self.get_candles(1)))
+
+        # rebuilding from the history gives the same candles
+        candles = dict((resolution, self.get_candles(resolution)) for resolution in history.RESOLUTIONS)
+        history.rebuild_candles(self.market)
+        for resolution in history.RESOLUTIONS:
+            self.assertEqual(candles[resolution], self.get_candles(resolution))
+
+    def test_pagination(self):
+
+        # trades cleared together share their date across pages
+        self.add_trades([(i // 3, i, 1) for i in range(25)])
+
+        pages = list()
+        before = None
+        while True:
+            page = list(history.get_history(self.market, before, 10))
+            pages.append([point.price for point in page])
+            if len(page) < 10:
+                break
+            before = (page[-1].date, page[-1].id)
+
+        self.assertEqual([list(range(24, 14, -1)), list(range(14, 4, -1)), list(range(4, -1, -1))], pages)
+
+    def test_page_args(self):
+
+        self.assertEqual((100, None), history.parse_page_args(MultiDict()))
+        self.assertEqual((history.MAX_PAGE, (self.start, 7)), history.parse_page_args(MultiDict(dict(
+            limit='5000', before=self.start.strftime(history.DATE_FORMAT), before_id='7'))))
+        self.assertEqual((1, None), history.parse_page_args(MultiDict(dict(limit='0'))))
+        self.assertEqual((1, None), history.parse_page_args(MultiDict(dict(limit='-1'))))
+
+        # a date without its id is no cursor
+        self.assertRaises(ValueError, history.parse_page_args, MultiDict(dict(before=self.start.strftime(history.DATE_FORMAT))))
+        self.assertRaises(ValueError, history.parse_page_args, MultiDict(dict(before='yesterday', before_id='7')))
+
+    def test_chart(self):
+
+        self.add_trades([(i * 10, i % 100, 1) for i in range(360)])
+
+        # one hour fits 300 points at one minute
+        chart = history.get_chart(self.market, self.market.opening_date, self.market.closing_date)
+        self.assertEqual(60, len(chart))
+        self.assertEqual(self.start, chart[0].date)
+
+        # and 10 points at fifteen minutes
+        chart = history.get_chart(self.market, self.market.opening_date, self.market.closing_date, 10)
+        self.assertEqual(4, len(chart))
+        self.assertEqual(self.start, chart[0].date)
+
+if __name__ == '__main__':
+    unittest.main()    
@@ -0,0 +1,115 @@
+#! /usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path as osp
+import tempfile
+import shutil
+import peewee
+import datetime
+
+TEST = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(TEST)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import User, Market, Stock
+import market_maker
+import instrumentation
+
+class InstrumentationUnittests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = peewee.SqliteDatabase(osp.join(self.temp_dir, 'pythia.sqlite'), check_same_thread=False)
+
+        data_model.set_database(self.db)
+        data_model.create_tables()
+
+        self.market = Market.create(
+            name= 'unittest',
+            description = 'unittest',
+            status = 'open',
+            opening_date = datetime.datetime.now(),
+            closing_date = datetime.datetime.now() + datetime.timedelta(1),
+            price = 0,
+            volume = 0
+            )
+
+        self.user = User.create(
+            email = 'unitest',
+            password = 'unittest'
+            )
+
+        instrumentation.reset()
+        instrumentation.enable()
+
+    def tearDown(self):
+        instrumentation.disable()
+        shutil.rmtree(self.temp_dir)
+
+    def test_stages(self):
+
+        market_maker.put(self.market, self.user, 10, 1)
+        market_maker.call(self.market, self.user, 20, 1)
+        market_maker.clear_market(self.market)
+
+        metrics = instrumentation.metrics
+        self.assertEqual(2, metrics.seconds['market_maker.place_order'].count)
+        # the first order loads the book and creates the summary of the market,
+        # each order then moves the top of the book
+        self.assertEqual(7, metrics.queries['market_maker.place_order'].sum)
+        for name in ('market_maker.clear_market', 'market_maker.do_clear_buy_orders',
+                'settlement.execute', 'settlement.write_orders', 'bank.execute_transfers'):
+            self.assertEqual(1, metrics.seconds[name].count, name)
+
+        # a stage counts the queries of the stages it runs
+        self.assertTrue(metrics.queries['market_maker.clear_market'].sum >= metrics.queries['settlement.execute'].sum > 0)
+
+        text = metrics.render()
+        self.assertIn('pythia_stage_seconds_count{stage="market_maker.clear_market"} 1', text)
+        self.assertIn('pythia_stage_queries_bucket{stage="market_maker.place_order",le="2"} 1', text)
+
+    def test_n_plus_one(self):
+
+        with instrumentation.stage('unittest'):
+            for i in range(instrumentation.N_PLUS_ONE_THRESHOLD):
+                list(Stock.select().where(Stock.user == i))
+            list(Market.select())
+
+        self.assertEqual(1, len(instrumentation.metrics.n_plus_one))
+        ((name, sql), count), = instrumentation.metrics.n_plus_one.items()
+        self.assertEqual('unittest', name)
+        self.assertIn('"stock"', sql)
+        self.assertEqual(instrumentation.N_PLUS_ONE_THRESHOLD, count)
+
+    def test_clear_stocks(self):
+
+        # stocks held by many users move with one update, not one per user
+        users = [User.create(email='unittest%d' % i, password='unittest') for i in range(2 * instrumentation.N_PLUS_ONE_THRESHOLD)]
+        for (i, user) in enumerate(users):
+            Stock.create(market=self.market, user=user, quantity=i)
+            if i % 2:
+                market_maker.put(self.market, user, 10, 1)
+            else:
+                market_maker.call(self.market, user, 20, 1)
+        market_maker.clear_market(self.market)
+
+        self.assertEqual([], [sql for (name, sql) in instrumentation.metrics.n_plus_one if '"stock"' in sql])
+        self.assertEqual(
+            [i - 1 if i % 2 else i + 1 for i in range(len(users))],
+            [Stock.get(Stock.user == user).quantity for user in users])
+
+    def test_disable(self):
+
+        instrumentation.disable()
+        self.assertFalse('execute_sql' in type(self.db).__dict__)
+        self.assertTrue(instrumentation.stage('unittest') is instrumentation.NULL_STAGE)
+
+        market_maker.put(self.market, self.user, 10, 1)
+        self.assertEqual({}, instrumentation.metrics.seconds)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+#! /usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path as osp
+import tempfile
+import shutil
+import datetime
+
+TEST = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(TEST)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import User, Market, Order
+import market_maker
+import resolution
+import journal
+from order_book import get_order_book, drop_order_book
+
+class JournalUnittests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        data_model.set_database('sqlite:///%s' % osp.join(self.temp_dir, 'pythia.sqlite'))
+        data_model.create_tables()
+
+        self.path = osp.join(self.temp_dir, 'pythia.journal')
+        journal.open_journal(self.path, snapshot_interval=0)
+
+    def tearDown(self):
+        journal.close_journal()
+        data_model.close_database()
+        shutil.rmtree(self.temp_dir)
+
+    def create_market(self):
+        return Market.create(
+            name= 'unittest',
+            description = 'unittest',
+            status = 'open',
+            opening_date = datetime.datetime.now(),
+            closing_date = datetime.datetime.now() + datetime.timedelta(1),
+            price = 0,
+            volume = 0
+            )
+
+    def create_user(self, name):
+        return User.create(
+            email = name,
+            password = name
+            )
+
+    def trade(self):
+        # two markets, one cleared and resolved, one with pending orders
+        (market1, market2) = (self.create_market(), self.create_market())
+        (user1, user2) = (self.create_user('unittest1'), self.create_user('unittest2'))
+
+        market_maker.put(market1, user1, 10, 3)
+        market_maker.call(market1, user2, 20, 2)
+        market_maker.clear_market(market1)
+        resolution.resolve_markets({market1.id: True})
+
+        market_maker.put(market2, user1, 30, 2)
+        market_maker.call(market2, user2, 20, 5)
+        orders = market_maker.submit_orders([
+            dict(market=market2, user=user1, type='sell', price=40, quantity=1),
+            dict(market=market2, user=user2, type='buy', price=10, quantity=4)])
+        market_maker.cancel_orders([orders[0]])
+        market_maker.amend_order(orders[1], quantity=2)
+
+        return (market1, market2)
+
+    def test_encode(self):
+
+        record = journal.encode(journal.ORDER_PLACED, (1, 2, 3, 0, 10, 7))
+        (type, date, values, fills) = journal.decode(record[journal.HEADER.size:])
+        self.assertEqual(journal.ORDER_PLACED, type)
+        self.assertEqual((1, 2, 3, 0, 10, 7), values)
+
+        fills = [(1, 2, 0, 3), (4, 5, 1, 3)]
+        record = journal.encode(journal.MARKET_CLEARED, (1, 15, 3, 2), fills)
+        (type, date, values, decoded_fills) = journal.decode(record[journal.HEADER.size:])
+        self.assertEqual(fills, decoded_fills)
+
+    def test_replay(self):
+
+        (market1, market2) = self.trade()
+
+        (state, offset) = journal.replay(self.path)
+        self.assertEqual([], journal.verify(state))
+        self.assertEqual(osp.getsize(self.path), offset)
+
+        # the cleared and resolved market left nothing pending
+        self.assertEqual([market2.id], list(state.get_market_orders()))
+        pending = Order.select().where(Order.status == 'pending').order_by(Order.id)
+        self.assertEqual(
+            [(order.id, order.quantity) for order in pending],
+            [(order_id, order[4]) for (order_id, order) in state.get_market_orders()[market2.id]])
+        self.assertEqual({}, state.positions)
+
+    def test_close_markets(self):
+
+        markets = [self.create_market() for i in range(3)]
+        for market in markets[:2]:
+            market.closing_date = datetime.datetime.now() - datetime.timedelta(1)
+            market.save()
+
+        # markets already closed are not journaled again
+        self.assertEqual(1, market_maker.close_markets([markets[0].id]))
+        self.assertEqual(1, market_maker.close_markets([market.id for market in markets]))
+        self.assertEqual(0, market_maker.close_markets([market.id for market in markets]))
+
+        closed = [values[0] for (offset, type, date, values, fills) in journal.read_records(self.path)
+            if type == journal.MARKET_CLOSED]
+        self.assertEqual([markets[0].id, markets[1].id], closed)
+
+    def test_snapshot(self):
+
+        self.trade()
+        journal.get_journal().snapshot()
+        market = self.create_market()
+        user = self.create_user('unittest3')
+        market_maker.put(market, user, 10, 1)
+        market_maker.call(market, user, 10, 1)
+        market_maker.clear_market(market)
+
+        # the snapshot and the records written after it
+        (state, offset) = journal.replay(self.path)
+        self.assertEqual([], journal.verify(state))
+        self.assertEqual({(market.id, user.id): 0}, state.positions)
+
+        # without the journal only the snapshot is left
+        os.remove(self.path)
+        (state, offset) = journal.replay(self.path)
+        self.assertEqual(Order.select().count() - 2, state.last_order_id)
+
+    def test_torn_tail(self):
+
+        self.trade()
+        journal.close_journal()
+        size = osp.getsize(self.path)
+        with open(self.path, 'ab') as f:
+            f.write(journal.encode(journal.ORDER_CANCELLED, (1, 1))[:-3])
+
+        (state, offset) = journal.replay(self.path)
+        self.assertEqual(size, offset)
+        self.assertEqual([], journal.verify(state))
+
+        # reopening drops the torn record before appending
+        journal.open_journal(self.path, snapshot_interval=0)
+        self.assertEqual(size, osp.getsize(self.path))
+
+    def test_restore_order_books(self):
+
+        (market1, market2) = self.trade()
+        book = get_order_book(market2.id)
+        orders = [(order.id, order.quantity) for order in book.get_sell_orders() + book.get_buy_orders()]
+        journal.open_journal(self.path)
+
+        drop_order_book(market2.id)
+        self.assertEqual(1, journal.restore_order_books())
+        book = get_order_book(market2.id)
+        self.assertEqual(orders, [(order.id, order.quantity) for order in book.get_sell_orders() + book.get_buy_orders()])
+
+        # a journal behind the database does not restore anything
+        Order.create(market=market2, user=None, type='buy', status='pending', price=10, quantity=1)
+        self.assertEqual(0, journal.restore_order_books())
+
+    def test_restore_after_resolution(self):
+
+        (market1, market2) = self.trade()
+        journal.close_journal()
+
+        # resolved by resolution.py, which does not open the journal
+        resolution.resolve_markets({market2.id: False})
+
+        journal.open_journal(self.path)
+        self.assertEqual(0, journal.restore_order_books())
+        book = get_order_book(market2.id)
+        self.assertEqual([], book.get_sell_orders() + book.get_buy_orders())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,8 @@ import tempfile
 import shutil
 import peewee
 import datetime
+import random
+import collections
 
 TEST = osp.abspath(osp.dirname(__file__))
 
@@ -15,8 +17,38 @@ ROOT = osp.dirname(TEST)
 sys.path.append(ROOT)
 
 import data_model
-from data_model import User, Market, Order, Stock
+from data_model import User, Market, Order, Stock, Transaction
 import market_maker
+import settlement
+
+def get_unit_market_clearing_price(sell_orders, buy_orders):
+    # reference implementation expanding every order into unit orders
+    unit_sell_orders = list()
+    for order in sell_orders:
+        for i in range(order.quantity):
+            unit_sell_orders.append(order.price)
+
+    unit_buy_orders = list()
+    for order in buy_orders:
+        for i in range(order.quantity):
+            unit_buy_orders.append(order.price)
+
+    price = None
+    quantity = None
+    k = 0
+    K = min(len(unit_sell_orders), len(unit_buy_orders))
+    while (k < K and unit_sell_orders[k] <= unit_buy_orders[k]):
+        k+=1
+
+    if k > 0:
+        quantity = k
+        last_buy_price = unit_buy_orders[k-1]
+        last_sell_price = unit_sell_orders[k-1]
+        price = (last_buy_price + last_sell_price) // 2
+
+    return price, quantity
+
+UnitOrder = collections.namedtuple('UnitOrder', ['price', 'quantity'])
 
 class MarketMakerUnittests(unittest.TestCase):
 
@@ -195,7 +227,7 @@ class MarketMakerUnittests(unittest.TestCase):
 
         market_maker.clear_market(market)
         self.assertEqual(market.price, 30)
-        #self.assertEqual(market.volume, 6)
+        self.assertEqual(market.volume, 6)
 
         account1 = user1.account.get()
         self.assertEqual(180, account1.balance)
@@ -209,5 +241,202 @@ class MarketMakerUnittests(unittest.TestCase):
         stock2 = Stock.get(Stock.market==market, Stock.user==user2)
         self.assertEqual(6, stock2.quantity)
 
+    def test_clear_market_zero_price(self):
+
+        market = Market.create(
+            name= 'unittest',
+            description = 'unittest',
+            status = 'open',
+            opening_date = datetime.datetime.now(),
+            closing_date = datetime.datetime.now() + datetime.timedelta(1),
+            price = 50,
+            volume = 0
+            )
+
+        user1 = User.create(email = 'unitest1', password = 'unittest1')
+        user2 = User.create(email = 'unitest2', password = 'unittest2')
+
+        # the midpoint of 0 and 1 is rounded down to a clearing price of 0
+        market_maker.put(market, user1, 0, 2)
+        market_maker.call(market, user2, 1, 2)
+        market_maker.clear_market(market)
+
+        self.assertEqual((0, 2), (market.price, market.volume))
+        self.assertEqual(0, Order.select().where(Order.status == 'pending').count())
+        self.assertEqual(2, Stock.get(Stock.market == market, Stock.user == user2).quantity)
+        self.assertFalse(market_maker.get_order_book(market).is_crossed())
+
+    def test_clear_market_atomic(self):
+
+        market = Market.create(
+            name= 'unittest',
+            description = 'unittest',
+            status = 'open',
+            opening_date = datetime.datetime.now(),
+            closing_date = datetime.datetime.now() + datetime.timedelta(1),
+            price = 0,
+            volume = 0
+            )
+
+        user1 = User.create(
+            email = 'unitest1',
+            password = 'unittest1'
+            )
+
+        user2 = User.create(
+            email = 'unitest2',
+            password = 'unittest2'
+            )
+
+        market_maker.put(market, user1, 10, 2)
+        market_maker.call(market, user2, 20, 1)
+
+        def write_market(self):
+            raise RuntimeError('crash')
+
+        original_write_market = settlement.Settlement.write_market
+        settlement.Settlement.write_market = write_market
+        try:
+            self.assertRaises(RuntimeError, market_maker.clear_market, market)
+        finally:
+            settlement.Settlement.write_market = original_write_market
+
+        # nothing of the failed clear has been written
+        self.assertEqual(2, Order.select().where(Order.status == 'pending').count())
+        self.assertEqual(0, Stock.select().count())
+        self.assertEqual(0, Transaction.select().count())
+
+        market_maker.clear_market(market)
+        self.assertEqual(15, market.price)
+        self.assertEqual(1, market.volume)
+        self.assertEqual(15, user1.account.get().balance)
+        self.assertEqual(-15, user2.account.get().balance)
+        self.assertEqual(1, len(market_maker.get_sell_orders(market)))
+        self.assertEqual(0, len(market_maker.get_buy_orders(market)))
+
+    def test_submit_orders(self):
+
+        market1 = Market.create(
+            name= 'unittest',
+            description = 'unittest',
+            status = 'open',
+            opening_date = datetime.datetime.now(),
+            closing_date = datetime.datetime.now() + datetime.timedelta(1),
+            price = 0,
+            volume = 0
+            )
+
+        market2 = Market.create(
+            name= 'unittest',
+            description = 'unittest',
+            status = 'closed',
+            opening_date = datetime.datetime.now(),
+            closing_date = datetime.datetime.now() + datetime.timedelta(1),
+            price = 0,
+            volume = 0
+            )
+
+        user = User.create(
+            email = 'unitest',
+            password = 'unittest'
+            )
+
+        def order(market, type, price, quantity):
+            return dict(market=market, user=user, type=type, price=price, quantity=quantity)
+
+        # a single invalid order rejects the whole batch
+        for invalid in (
+            order(market1, 'hold', 10, 1),
+            order(market1, 'buy', -1, 1),
+            order(market1, 'buy', 10, 0),
+            order(market1, 'buy', 10, 1.5),
+            order(market2, 'buy', 10, 1),
+            ):
+            self.assertRaises(ValueError, market_maker.submit_orders, [order(market1, 'sell', 10, 1), invalid])
+        self.assertEqual(0, Order.select().count())
+
+        orders = market_maker.submit_orders([
+            order(market1, 'sell', 10, 1),
+            order(market1.id, 'sell', 12, 2),
+            order(market1, 'buy', 11, 1),
+            ])
+        self.assertEqual(3, Order.select().where(Order.status == 'pending').count())
+        self.assertEqual([orders[0].id, orders[1].id], [o.id for o in market_maker.get_sell_orders(market1)])
+        self.assertEqual([orders[2].id], [o.id for o in market_maker.get_buy_orders(market1)])
+
+        # batches are inserted many rows at a time, the ids handed back are
+        # those of the rows
+        orders = market_maker.submit_orders([order(market1, 'sell', 50 + i % 10, i + 1) for i in range(250)])
+        self.assertEqual(
+            [(o.id, o.price, o.quantity) for o in orders],
+            [(o.id, o.price, o.quantity) for o in Order.select().where(Order.id << [o.id for o in orders]).order_by(Order.id)])
+        self.assertEqual(list(range(1, 251)), [o.quantity for o in orders])
+
+    def test_snapshots(self):
+
+        market = Market.create(
+            name= 'unittest',
+            description = 'unittest',
+            status = 'open',
+            opening_date = datetime.datetime.now(),
+            closing_date = datetime.datetime.now() - datetime.timedelta(1),
+            price = 0,
+            volume = 0
+            )
+
+        user = User.create(
+            email = 'unitest',
+            password = 'unittest'
+            )
+
+        self.assertEqual([market.id], [m['id'] for m in market_maker.get_open_markets_snapshot()])
+        self.assertEqual([], market_maker.get_order_book_snapshot(market.id)['sell_orders'])
+
+        market_maker.put(market, user, 10, 2)
+        market_maker.call(market, user, 20, 1)
+        book = market_maker.get_order_book_snapshot(market.id)
+        self.assertEqual([(10, 2)], [(o['price'], o['quantity']) for o in book['sell_orders']])
+        self.assertEqual([(20, 1)], [(o['price'], o['quantity']) for o in book['buy_orders']])
+        self.assertEqual([], market_maker.get_market_history_snapshot(market.id))
+        self.assertEqual(0, market_maker.get_market_snapshot(market.id)['price'])
+
+        market_maker.clear_market(market)
+        book = market_maker.get_order_book_snapshot(market.id)
+        self.assertEqual([(10, 1)], [(o['price'], o['quantity']) for o in book['sell_orders']])
+        self.assertEqual([], book['buy_orders'])
+        self.assertEqual([15], [p['price'] for p in market_maker.get_market_history_snapshot(market.id)])
+        self.assertEqual(15, market_maker.get_market_snapshot(market.id)['price'])
+        self.assertEqual([15], [m['price'] for m in market_maker.get_open_markets_snapshot()])
+
+        market_maker.close_market(market)
+        self.assertEqual('closed', market_maker.get_market_snapshot(market.id)['status'])
+        self.assertEqual([], market_maker.get_open_markets_snapshot())
+
+    def test_get_market_clearing_price_equivalence(self):
+
+        rng = random.Random(0)
+        for i in range(500):
+            sell_orders = sorted([
+                UnitOrder(rng.randint(0, 20) * 5, rng.randint(0, 10))
+                for j in range(rng.randint(1, 12))
+                ], key=lambda order: order.price)
+            buy_orders = sorted([
+                UnitOrder(rng.randint(0, 20) * 5, rng.randint(0, 10))
+                for j in range(rng.randint(1, 12))
+                ], key=lambda order: -order.price)
+
+            self.assertEqual(
+                get_unit_market_clearing_price(sell_orders, buy_orders),
+                market_maker.get_market_clearing_price(None, sell_orders, buy_orders))
+
+    def test_get_market_clearing_price_large_quantity(self):
+
+        sell_orders = [UnitOrder(10, 1000000), UnitOrder(60, 1000000)]
+        buy_orders = [UnitOrder(50, 1500000), UnitOrder(20, 1000000)]
+
+        (price, quantity) = market_maker.get_market_clearing_price(None, sell_orders, buy_orders)
+        self.assertEqual(price, 30)
+        self.assertEqual(quantity, 1000000)
+
 if __name__ == '__main__':
     unittest.main()    
@@ -0,0 +1,175 @@
+#! /usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path as osp
+import tempfile
+import shutil
+import peewee
+import datetime
+import time
+
+TEST = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(TEST)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import User, Market, Stock
+from matching_service import MatchingService
+import market_maker
+
+class MatchingServiceUnittests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        db = peewee.SqliteDatabase(osp.join(self.temp_dir, 'pythia.sqlite'), check_same_thread=False)
+
+        data_model.set_database(db)
+        data_model.create_tables()
+
+        self.service = MatchingService().start()
+
+    def tearDown(self):
+        self.service.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def create_market(self, **kwargs):
+        return Market.create(
+            name= 'unittest',
+            description = 'unittest',
+            status = 'open',
+            opening_date = datetime.datetime.now(),
+            closing_date = datetime.datetime.now() + datetime.timedelta(1),
+            price = 0,
+            volume = 0,
+            **kwargs
+            )
+
+    def test_submit(self):
+
+        market1 = self.create_market()
+        market2 = self.create_market()
+
+        user1 = User.create(
+            email = 'unitest1',
+            password = 'unittest1'
+            )
+
+        user2 = User.create(
+            email = 'unitest2',
+            password = 'unittest2'
+            )
+
+        orders = list()
+        for market in (market1, market2):
+            orders.append(self.service.submit(market, user1, 10, 1, 'sell'))
+            orders.append(self.service.submit(market, user1, 20, 1, 'sell'))
+            orders.append(self.service.submit(market, user2, 20, 2, 'buy'))
+
+        # orders are acknowledged before being cleared
+        for order in orders:
+            self.assertEqual('pending', order.status)
+
+        self.service.flush()
+
+        for order in orders:
+            self.assertEqual('cleared', self.service.get_order_status(order.id)['status'])
+
+        for market in (market1, market2):
+            market = Market.get(Market.id == market.id)
+            self.assertEqual(20, market.price)
+            self.assertEqual(2, Stock.get(Stock.market == market, Stock.user == user2).quantity)
+            self.assertEqual([], market_maker.get_sell_orders(market))
+
+        self.assertEqual(80, user1.account.get().balance)
+        self.assertEqual(-80, user2.account.get().balance)
+
+    def test_submit_orders(self):
+
+        market1 = self.create_market()
+        market2 = self.create_market(clearing_mode='batch', batch_size=3)
+
+        user1 = User.create(
+            email = 'unitest1',
+            password = 'unittest1'
+            )
+
+        user2 = User.create(
+            email = 'unitest2',
+            password = 'unittest2'
+            )
+
+        cleared = list()
+        original_clear = self.service.clear
+        def clear(market_id):
+            cleared.append(market_id)
+            original_clear(market_id)
+        self.service.clear = clear
+
+        orders = list()
+        for market in (market1, market2):
+            orders.append(dict(market=market.id, user=user1.id, type='sell', price=10, quantity=1))
+            orders.append(dict(market=market.id, user=user1.id, type='sell', price=20, quantity=1))
+            orders.append(dict(market=market.id, user=user2.id, type='buy', price=20, quantity=2))
+
+        orders = self.service.submit_orders(orders)
+        self.assertEqual(6, len(orders))
+        self.service.flush()
+
+        # every market is cleared once for the whole batch
+        self.assertEqual(sorted([market1.id, market2.id]), sorted(cleared))
+        for market in (market1, market2):
+            self.assertEqual(20, Market.get(Market.id == market.id).price)
+            self.assertEqual(2, Stock.get(Stock.market == market, Stock.user == user2).quantity)
+
+    def test_batch_size_auction(self):
+
+        market = self.create_market(clearing_mode='batch', batch_size=3)
+
+        user = User.create(
+            email = 'unitest',
+            password = 'unittest'
+            )
+
+        cleared = list()
+        original_clear = self.service.clear
+        def clear(market_id):
+            cleared.append(market_id)
+            original_clear(market_id)
+        self.service.clear = clear
+
+        self.service.submit(market, user, 10, 1, 'sell')
+        self.service.submit(market, user, 20, 1, 'buy')
+        time.sleep(0.05)
+        self.assertEqual([], cleared)
+
+        # the third order triggers a single auction for all of them
+        self.service.submit(market, user, 15, 1, 'buy')
+        self.service.flush()
+        self.assertEqual([market.id], cleared)
+        self.assertEqual(15, Market.get(Market.id == market.id).price)
+
+    def test_batch_interval_auction(self):
+
+        market = self.create_market(clearing_mode='batch', batch_interval=50)
+
+        user = User.create(
+            email = 'unitest',
+            password = 'unittest'
+            )
+
+        self.service.submit(market, user, 10, 1, 'sell')
+        self.service.submit(market, user, 20, 1, 'buy')
+        self.assertEqual(0, Market.get(Market.id == market.id).price)
+
+        # the auction runs on its own once the interval has passed
+        for i in range(100):
+            time.sleep(0.01)
+            if Market.get(Market.id == market.id).price:
+                break
+        self.assertEqual(15, Market.get(Market.id == market.id).price)
+
+if __name__ == '__main__':
+    unittest.main()    
@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path as osp
+import tempfile
+import shutil
+import peewee
+import datetime
+
+TEST = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(TEST)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import Order, Stock, Account, SchemaMigration
+import migrations
+
+class MigrationsUnittests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = peewee.SqliteDatabase(osp.join(self.temp_dir, 'pythia.sqlite'), check_same_thread=False)
+
+        data_model.set_database(self.db)
+        data_model.create_tables()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def get_index_columns(self, Model):
+        return set(tuple(index.columns) for index in self.db.get_indexes(Model._meta.db_table))
+
+    def test_add_hot_path_indexes(self):
+
+        # database created before the indexes were declared
+        for Model in data_model.MODELS:
+            for (field_names, unique) in Model._meta.indexes or ():
+                self.db.drop_index(Model, [Model._meta.fields[name] for name in field_names])
+        self.db.execute_sql('DROP INDEX "order_pending"')
+        self.assertNotIn(('market_id', 'user_id'), self.get_index_columns(Stock))
+
+        migrations.migrate()
+        self.assertIn(('market_id', 'user_id'), self.get_index_columns(Stock))
+        self.assertIn(('market_id', 'type', 'status', 'price'), self.get_index_columns(Order))
+        self.assertIn(('market_id', 'type', 'price', 'id'), self.get_index_columns(Order))
+        self.assertEqual(set([('user_id', )]), self.get_index_columns(Account))
+
+        # running it again is a no-op
+        migrations.migrate()
+        self.assertEqual(len(migrations.MIGRATIONS), SchemaMigration.select().count())
+
+    def test_add_order_filled_quantity(self):
+
+        # orders table created before partial fills were tracked in place
+        self.db.execute_sql('DROP TABLE "order"')
+        self.db.execute_sql(
+            'CREATE TABLE "order" ("id" INTEGER NOT NULL PRIMARY KEY, "market_id" INTEGER,'
+            ' "user_id" INTEGER, "price" REAL NOT NULL, "quantity" INTEGER NOT NULL,'
+            ' "type" TEXT NOT NULL, "status" TEXT NOT NULL)')
+        self.db.execute_sql(
+            'INSERT INTO "order" ("price", "quantity", "type", "status")'
+            " VALUES (10, 3, 'sell', 'cleared'), (20, 2, 'buy', 'pending')")
+
+        migrations.migrate()
+        self.assertEqual(
+            [(0, 3, 'cleared'), (2, 0, 'pending')],
+            [(o.quantity, o.filled_quantity, o.status) for o in Order.select().order_by(Order.id)])
+        self.assertIn(('user_id', 'status'), self.get_index_columns(Order))
+
+    def test_migrate_current_schema(self):
+
+        # tables created by create_tables, with no migration recorded
+        self.db.execute_sql(
+            'INSERT INTO "order" ("price", "quantity", "filled_quantity", "type", "status")'
+            " VALUES (10, 0, 3, 'sell', 'cleared'), (20, 1, 1, 'buy', 'pending')")
+
+        migrations.migrate()
+        self.assertEqual(
+            [(0, 3, 'cleared'), (1, 1, 'pending')],
+            [(o.quantity, o.filled_quantity, o.status) for o in Order.select().order_by(Order.id)])
+
+    def test_convert_integer_prices(self):
+
+        # prices stored as floats before they were integer ticks
+        self.db.execute_sql('DROP TABLE "order"')
+        self.db.execute_sql(
+            'CREATE TABLE "order" ("id" INTEGER NOT NULL PRIMARY KEY, "market_id" INTEGER,'
+            ' "user_id" INTEGER, "price" REAL NOT NULL, "quantity" INTEGER NOT NULL,'
+            ' "filled_quantity" INTEGER NOT NULL, "type" TEXT NOT NULL, "status" TEXT NOT NULL)')
+        self.db.execute_sql(
+            'INSERT INTO "order" ("price", "quantity", "filled_quantity", "type", "status")'
+            " VALUES (10.0, 3, 0, 'sell', 'pending'), (29.999999999, 2, 0, 'buy', 'pending'), (57.5, 0, 1, 'buy', 'cleared'),"
+            " (42.5, 1, 0, 'sell', 'pending'), (150, 1, 0, 'buy', 'pending'), (-3, 1, 0, 'sell', 'pending')")
+        # the database was migrated up to the previous step
+        for (name, migration) in migrations.MIGRATIONS:
+            if name == '0007_integer_prices':
+                break
+            SchemaMigration.create(name=name, date=datetime.datetime.now())
+
+        migrations.migrate()
+        # sells are rounded up, buys down, pending orders off the ladder cancelled
+        self.assertEqual(
+            [(10, 3, 'sell', 'pending'), (30, 2, 'buy', 'pending'), (57, 0, 'buy', 'cleared'),
+             (43, 1, 'sell', 'pending'), (100, 1, 'buy', 'cancelled'), (0, 1, 'sell', 'cancelled')],
+            [(o.price, o.quantity, o.type, o.status) for o in Order.select().order_by(Order.id)])
+        self.assertEqual('INTEGER', [c.data_type for c in self.db.get_columns('order') if c.name == 'price'][0])
+        self.assertIn(('market_id', 'type', 'status', 'price'), self.get_index_columns(Order))
+        self.assertIn(('market_id', 'type', 'price', 'id'), self.get_index_columns(Order))
+
+    def test_migrate_new_database(self):
+
+        migrations.migrate()
+        migrations.migrate()
+        self.assertEqual(len(migrations.MIGRATIONS), SchemaMigration.select().count())
+
+if __name__ == '__main__':
+    unittest.main()    
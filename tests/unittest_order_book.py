@@ -0,0 +1,257 @@
+#! /usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path as osp
+import tempfile
+import shutil
+import peewee
+import datetime
+
+TEST = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(TEST)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import User, Market, Order
+import market_maker
+import order_book
+
+class OrderBookUnittests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        db = peewee.SqliteDatabase(osp.join(self.temp_dir, 'pythia.sqlite'), check_same_thread=False)
+
+        data_model.set_database(db)
+        data_model.create_tables()
+
+        self.market = Market.create(
+            name= 'unittest',
+            description = 'unittest',
+            status = 'open',
+            opening_date = datetime.datetime.now(),
+            closing_date = datetime.datetime.now() + datetime.timedelta(1),
+            price = 0,
+            volume = 0
+            )
+
+        self.user = User.create(
+            email = 'unitest',
+            password = 'unittest'
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_price_time_priority(self):
+
+        o1 = market_maker.put(self.market, self.user, 20, 1)
+        o2 = market_maker.put(self.market, self.user, 10, 1)
+        o3 = market_maker.put(self.market, self.user, 20, 1)
+        o4 = market_maker.call(self.market, self.user, 5, 1)
+        o5 = market_maker.call(self.market, self.user, 8, 1)
+        o6 = market_maker.call(self.market, self.user, 5, 1)
+
+        book = order_book.get_order_book(self.market)
+        self.assertEqual([o2.id, o1.id, o3.id], [o.id for o in book.get_sell_orders()])
+        self.assertEqual([o5.id, o4.id, o6.id], [o.id for o in book.get_buy_orders()])
+        self.assertEqual(10, book.get_best_price('sell'))
+        self.assertEqual(8, book.get_best_price('buy'))
+
+        book.remove(o2)
+        book.remove(o5)
+        self.assertEqual(20, book.get_best_price('sell'))
+        self.assertEqual(5, book.get_best_price('buy'))
+
+        # a freshly loaded book matches the incrementally maintained one
+        order_book.drop_order_book(self.market)
+        book = order_book.get_order_book(self.market)
+        self.assertEqual([o2.id, o1.id, o3.id], [o.id for o in book.get_sell_orders()])
+        self.assertEqual([o5.id, o4.id, o6.id], [o.id for o in book.get_buy_orders()])
+
+    def test_price_ladder(self):
+
+        market_maker.put(self.market, self.user, 60, 2)
+        o2 = market_maker.put(self.market, self.user, 40, 3)
+        market_maker.put(self.market, self.user, 40, 1)
+        market_maker.call(self.market, self.user, 50, 4)
+        market_maker.call(self.market, self.user, 0, 1)
+        market_maker.put(self.market, self.user, order_book.MAX_PRICE, 1)
+
+        book = order_book.get_order_book(self.market)
+        self.assertEqual([(40, 4), (60, 2), (100, 1)], book.get_levels('sell'))
+        self.assertEqual([(50, 4), (0, 1)], book.get_levels('buy'))
+        self.assertEqual(4, book.get_level_quantity('sell', 40))
+        self.assertEqual(0, book.get_level_quantity('sell', 50))
+        self.assertTrue(book.is_crossed())
+
+        # only the part of a side within the other one crosses
+        self.assertEqual([(40, 4)], book.get_levels('sell', book.get_best_price('buy')))
+        self.assertEqual([(50, 4)], book.get_levels('buy', book.get_best_price('sell')))
+
+        book.reduce(o2, 2)
+        self.assertEqual(2, book.get_level_quantity('sell', 40))
+        self.assertEqual((45, 2), market_maker.get_market_clearing_price(self.market))
+
+        market_maker.clear_market(self.market)
+        self.assertEqual([(60, 2), (100, 1)], book.get_levels('sell'))
+        self.assertEqual([(50, 2), (0, 1)], book.get_levels('buy'))
+        self.assertEqual(60, book.get_best_price('sell'))
+        self.assertFalse(book.is_crossed())
+        self.assertEqual((None, None), market_maker.get_market_clearing_price(self.market))
+
+        # prices are whole ticks between 0 and the payout
+        for price in (-1, 10.5, order_book.MAX_PRICE + 1, '10'):
+            self.assertRaises(ValueError, market_maker.validate_order, 'buy', price, 1)
+        market_maker.validate_order('buy', 10.0, 1)
+
+        # and books never index a price off their ladder
+        for price in (-3, order_book.MAX_PRICE + 1):
+            self.assertRaises(ValueError, book.add, Order(id=1000, type='sell', price=price, quantity=1))
+        self.assertEqual([(60, 2), (100, 1)], book.get_levels('sell'))
+
+    def test_clear_market_updates_book(self):
+
+        market_maker.put(self.market, self.user, 10, 3)
+        o2 = market_maker.put(self.market, self.user, 10, 2)
+        market_maker.call(self.market, self.user, 20, 4)
+
+        market_maker.clear_market(self.market)
+
+        book = order_book.get_order_book(self.market)
+        sell_orders = book.get_sell_orders()
+        self.assertEqual(1, len(sell_orders))
+        self.assertEqual(1, sell_orders[0].quantity)
+        self.assertEqual([], book.get_buy_orders())
+
+        # the book is consistent with the database
+        pending = Order.select().where(Order.status == 'pending')
+        self.assertEqual([o.id for o in sell_orders], [o.id for o in pending])
+
+    def test_partial_fill_in_place(self):
+
+        o1 = market_maker.put(self.market, self.user, 10, 3)
+        market_maker.call(self.market, self.user, 20, 1)
+        market_maker.clear_market(self.market)
+        market_maker.call(self.market, self.user, 20, 1)
+        market_maker.clear_market(self.market)
+
+        # remainders are not registered as new orders
+        self.assertEqual(3, Order.select().count())
+        order = Order.get(Order.id == o1.id)
+        self.assertEqual(('pending', 1, 2), (order.status, order.quantity, order.filled_quantity))
+        self.assertEqual([o1.id], [o.id for o in market_maker.get_sell_orders(self.market)])
+        self.assertEqual(1, market_maker.get_sell_orders(self.market)[0].quantity)
+
+        market_maker.call(self.market, self.user, 20, 1)
+        market_maker.clear_market(self.market)
+        order = Order.get(Order.id == o1.id)
+        self.assertEqual(('cleared', 0, 3), (order.status, order.quantity, order.filled_quantity))
+        self.assertEqual([], market_maker.get_sell_orders(self.market))
+
+    def test_cancel_orders(self):
+
+        other = User.create(
+            email = 'other',
+            password = 'other'
+            )
+
+        o1 = market_maker.put(self.market, self.user, 10, 1)
+        o2 = market_maker.put(self.market, self.user, 10, 1)
+        o3 = market_maker.call(self.market, self.user, 5, 1)
+        o4 = market_maker.call(self.market, other, 5, 1)
+
+        self.assertTrue(market_maker.cancel_order(o1))
+        self.assertFalse(market_maker.cancel_order(o1))
+        self.assertEqual([o2.id], [o.id for o in market_maker.get_sell_orders(self.market)])
+
+        cancelled = market_maker.cancel_user_orders(self.user, self.market)
+        self.assertEqual(set([o2.id, o3.id]), set(o.id for o in cancelled))
+        self.assertEqual([o4.id], [o.id for o in market_maker.get_buy_orders(self.market)])
+        self.assertEqual(3, Order.select().where(Order.status == 'cancelled').count())
+
+        # cancelled orders are not loaded back
+        order_book.drop_order_book(self.market)
+        self.assertEqual([], market_maker.get_sell_orders(self.market))
+        self.assertEqual([o4.id], [o.id for o in market_maker.get_buy_orders(self.market)])
+
+    def test_cancelled_order_does_not_clear(self):
+
+        o1 = market_maker.put(self.market, self.user, 10, 1)
+        market_maker.call(self.market, self.user, 20, 1)
+        sell_orders = market_maker.get_sell_orders(self.market)
+
+        # cancelled by another process after the book was read
+        Order.update(status='cancelled').where(Order.id == o1.id).execute()
+        original_get_sell_orders = market_maker.get_sell_orders
+        market_maker.get_sell_orders = lambda market: sell_orders
+        try:
+            self.assertRaises(RuntimeError, market_maker.clear_market, self.market)
+        finally:
+            market_maker.get_sell_orders = original_get_sell_orders
+
+        self.assertEqual('cancelled', Order.get(Order.id == o1.id).status)
+        self.assertEqual([], market_maker.get_sell_orders(self.market))
+
+    def test_amend_order(self):
+
+        o1 = market_maker.put(self.market, self.user, 10, 3)
+        o2 = market_maker.put(self.market, self.user, 10, 1)
+
+        # reducing the quantity keeps the queue position
+        amended = market_maker.amend_order(o1, quantity=2)
+        self.assertEqual(o1.id, amended.id)
+        self.assertEqual([o1.id, o2.id], [o.id for o in market_maker.get_sell_orders(self.market)])
+        self.assertEqual(2, market_maker.get_sell_orders(self.market)[0].quantity)
+        self.assertEqual(2, Order.get(Order.id == o1.id).quantity)
+
+        # increasing it queues a new order behind the others
+        amended = market_maker.amend_order(o1, quantity=4)
+        self.assertNotEqual(o1.id, amended.id)
+        self.assertEqual([o2.id, amended.id], [o.id for o in market_maker.get_sell_orders(self.market)])
+        self.assertEqual('cancelled', Order.get(Order.id == o1.id).status)
+
+        amended = market_maker.amend_order(amended, price=12)
+        self.assertEqual(12, amended.price)
+        self.assertEqual(4, amended.quantity)
+        self.assertEqual([o2.id, amended.id], [o.id for o in market_maker.get_sell_orders(self.market)])
+
+        self.assertRaises(ValueError, market_maker.amend_order, amended, quantity=0)
+        self.assertEqual(None, market_maker.amend_order(o1, quantity=1))
+
+    def test_replace_quotes(self):
+
+        market_maker.put(self.market, self.user, 12, 1)
+        market_maker.call(self.market, self.user, 8, 1)
+
+        created = market_maker.replace_quotes(self.market, self.user, [
+            dict(type='sell', price=11, quantity=2),
+            dict(type='buy', price=9, quantity=2),
+            ])
+        self.assertEqual([created[0].id], [o.id for o in market_maker.get_sell_orders(self.market)])
+        self.assertEqual([created[1].id], [o.id for o in market_maker.get_buy_orders(self.market)])
+        self.assertEqual(2, Order.select().where(Order.status == 'pending').count())
+
+        # invalid quotes leave the previous ones in place
+        self.assertRaises(ValueError, market_maker.replace_quotes, self.market, self.user, [
+            dict(type='sell', price=-1, quantity=2),
+            ])
+        self.assertEqual(2, Order.select().where(Order.status == 'pending').count())
+
+    def test_stale_database(self):
+
+        market_maker.put(self.market, self.user, 10, 1)
+        self.assertEqual(1, len(market_maker.get_sell_orders(self.market)))
+
+        # switching database discards books loaded from the previous one
+        db = peewee.SqliteDatabase(osp.join(self.temp_dir, 'other.sqlite'), check_same_thread=False)
+        data_model.set_database(db)
+        data_model.create_tables()
+
+        self.assertEqual(0, len(market_maker.get_sell_orders(self.market)))
+
+if __name__ == '__main__':
+    unittest.main()    
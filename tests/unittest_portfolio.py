@@ -0,0 +1,105 @@
+#! /usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path as osp
+import tempfile
+import shutil
+import peewee
+import datetime
+
+TEST = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(TEST)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import User, Market, Stock, Account
+import market_maker
+import portfolio
+
+class PortfolioUnittests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = peewee.SqliteDatabase(osp.join(self.temp_dir, 'pythia.sqlite'), check_same_thread=False)
+
+        data_model.set_database(self.db)
+        data_model.create_tables()
+
+        self.market = Market.create(
+            name= 'unittest',
+            description = 'unittest',
+            status = 'open',
+            opening_date = datetime.datetime.now(),
+            closing_date = datetime.datetime.now() + datetime.timedelta(1),
+            price = 0,
+            volume = 0
+            )
+
+        self.users = [
+            User.create(email = 'unitest%d' % i, password = 'unittest')
+            for i in range(3)
+            ]
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_portfolio(self):
+
+        (buyer, seller, other) = self.users
+        market_maker.call(self.market, buyer, 40, 3)
+        market_maker.put(self.market, seller, 30, 2)
+        market_maker.clear_market(self.market)
+        market_maker.put(self.market, seller, 60, 1)
+
+        # cleared at 35, the buyer paid 70 for 2 stocks now worth 35 each
+        p = portfolio.get_portfolio(buyer)
+        self.assertEqual((-70, 70, 0), (p['cash'], p['value'], p['pnl']))
+        self.assertEqual([(self.market.id, 2, 35, 70)],
+            [(s['market'], s['quantity'], s['price'], s['value']) for s in p['positions']])
+        self.assertEqual([('buy', 40, 1)], [(o['type'], o['price'], o['quantity']) for o in p['orders']])
+
+        p = portfolio.get_portfolio(seller)
+        self.assertEqual((70, -70, 0), (p['cash'], p['value'], p['pnl']))
+        self.assertEqual([('sell', 60, 1)], [(o['type'], o['price'], o['quantity']) for o in p['orders']])
+
+        # users who never traded have nothing
+        p = portfolio.get_portfolio(other)
+        self.assertEqual((0, 0, 0, [], []), (p['cash'], p['value'], p['pnl'], p['positions'], p['orders']))
+
+    def test_leaderboard(self):
+
+        markets = [self.market, Market.create(
+            name='unittest2', description='unittest', status='open',
+            opening_date=datetime.datetime.now(), closing_date=datetime.datetime.now() + datetime.timedelta(1),
+            price=80, volume=0)]
+        self.market.price = 20
+        self.market.save()
+
+        (first, second, third) = self.users
+        Account.create(user=first, balance=-100)
+        Account.create(user=second, balance=50)
+        Account.create(user=third, balance=10)
+        Stock.create(market=markets[0], user=first, quantity=2)
+        Stock.create(market=markets[1], user=first, quantity=3)
+        Stock.create(market=markets[1], user=third, quantity=-1)
+
+        # same as valuing every position row by row
+        expected = dict()
+        for account in Account.select():
+            expected[account.user_id] = account.balance
+        for stock in Stock.select():
+            expected[stock.user_id] = expected.get(stock.user_id, 0) + stock.quantity * stock.market.price
+
+        leaders = portfolio.get_leaderboard()
+        self.assertEqual([first.id, second.id, third.id], [leader['user'] for leader in leaders])
+        self.assertEqual([expected[leader['user']] for leader in leaders], [leader['pnl'] for leader in leaders])
+        self.assertEqual([180, 50, -70], [leader['pnl'] for leader in leaders])
+        self.assertEqual((-100, 280), (leaders[0]['cash'], leaders[0]['value']))
+
+        self.assertEqual([first.id, second.id], [leader['user'] for leader in portfolio.get_leaderboard(2)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#! /usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path as osp
+import tempfile
+import shutil
+import peewee
+import datetime
+
+TEST = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(TEST)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import User, Market, Order, Stock, Transaction
+import market_maker
+import resolution
+
+class ResolutionUnittests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        db = peewee.SqliteDatabase(osp.join(self.temp_dir, 'pythia.sqlite'), check_same_thread=False)
+
+        data_model.set_database(db)
+        data_model.create_tables()
+
+        self.resolution_date = datetime.datetime(2016, 1, 1, 12)
+        self.user1 = User.create(
+            email = 'unitest1',
+            password = 'unittest1'
+            )
+        self.user2 = User.create(
+            email = 'unitest2',
+            password = 'unittest2'
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def create_market(self, name):
+        market = Market.create(
+            name= name,
+            description = 'unittest',
+            status = 'open',
+            opening_date = datetime.datetime.now(),
+            closing_date = datetime.datetime.now() + datetime.timedelta(1),
+            resolution_date = self.resolution_date,
+            price = 0,
+            volume = 0
+            )
+
+        # user1 sells 3 stocks short to user2 at 40
+        market_maker.put(market, self.user1, 40, 3)
+        market_maker.call(market, self.user2, 40, 3)
+        market_maker.clear_market(market)
+        market_maker.call(market, self.user2, 10, 1)
+
+        return market
+
+    def test_resolve_markets(self):
+
+        market = self.create_market('shoes')
+        self.assertEqual(120, self.user1.account.get().balance)
+        self.assertEqual(-120, self.user2.account.get().balance)
+
+        self.assertEqual([market.id], resolution.resolve_markets({market: True}))
+
+        # the long position is paid out by the short one
+        self.assertEqual(-180, self.user1.account.get().balance)
+        self.assertEqual(180, self.user2.account.get().balance)
+        self.assertEqual(0, Stock.select().where(Stock.quantity != 0).count())
+        self.assertEqual(0, Order.select().where(Order.status == 'pending').count())
+        self.assertEqual([], market_maker.get_buy_orders(market))
+
+        market = Market.get(Market.id == market.id)
+        self.assertEqual('resolved', market.status)
+        self.assertEqual(True, market.outcome)
+        self.assertEqual(100, market.price)
+
+        # resolving again pays nothing
+        transactions = Transaction.select().count()
+        self.assertEqual([], resolution.resolve_markets({market: True}))
+        self.assertEqual([], resolution.resolve_markets({market: False}))
+        self.assertEqual(transactions, Transaction.select().count())
+        self.assertEqual(-180, self.user1.account.get().balance)
+
+    def test_resolve_period(self):
+
+        market1 = self.create_market('shoes')
+        market2 = self.create_market('hats')
+
+        resolution.resolve_period(self.resolution_date, ' Hats')
+
+        self.assertEqual(False, Market.get(Market.id == market1.id).outcome)
+        self.assertEqual(True, Market.get(Market.id == market2.id).outcome)
+        self.assertEqual(240 - 300, self.user1.account.get().balance)
+        self.assertEqual(-240 + 300, self.user2.account.get().balance)
+
+if __name__ == '__main__':
+    unittest.main()    
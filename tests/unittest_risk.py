@@ -0,0 +1,188 @@
+#! /usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path as osp
+import tempfile
+import shutil
+import peewee
+import datetime
+import time
+import multiprocessing
+
+TEST = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(TEST)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import User, Market, Stock, Order, Account
+import market_maker
+import bank
+import resolution
+import risk
+import instrumentation
+
+def resolve_markets(path, outcomes):
+    data_model.set_database('sqlite:///%s' % path)
+    resolution.resolve_markets(outcomes)
+    data_model.close_database()
+
+class RiskUnittests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = peewee.SqliteDatabase(osp.join(self.temp_dir, 'pythia.sqlite'), check_same_thread=False)
+
+        data_model.set_database(self.db)
+        data_model.create_tables()
+
+        self.markets = [
+            Market.create(
+                name= 'unittest%d' % i,
+                description = 'unittest',
+                status = 'open',
+                opening_date = datetime.datetime.now(),
+                closing_date = datetime.datetime.now() + datetime.timedelta(1),
+                price = 0,
+                volume = 0
+                )
+            for i in range(2)
+            ]
+        self.market = self.markets[0]
+
+        self.user = User.create(
+            email = 'unitest',
+            password = 'unittest'
+            )
+        self.other = User.create(
+            email = 'unitest2',
+            password = 'unittest'
+            )
+
+    def tearDown(self):
+        risk.configure()
+        risk.index.resolved_interval = risk.RESOLVED_INTERVAL
+        shutil.rmtree(self.temp_dir)
+
+    def assertIndexed(self, user):
+        # what was kept up to date is what would be loaded now
+        user_id = getattr(user, 'id', user)
+        index = risk.ExposureIndex()
+        with index.lock:
+            (loaded, fresh) = index.load_user(user_id)
+        indexed = risk.index.users[user_id]
+
+        self.assertEqual((loaded.balance, loaded.margin, loaded.notional), (indexed.balance, indexed.margin, indexed.notional))
+        for market_id in set(loaded.markets) | set(indexed.markets):
+            self.assertEqual(
+                [getattr(loaded.get_market(market_id), name) for name in risk.Exposure.__slots__],
+                [getattr(indexed.get_market(market_id), name) for name in risk.Exposure.__slots__])
+
+    def test_off(self):
+
+        self.assertFalse(risk.is_enabled())
+        market_maker.put(self.market, self.user, 50, 1000)
+        self.assertEqual({}, risk.index.users)
+
+    def test_max_short(self):
+
+        risk.configure(max_short=3)
+        Stock.create(market=self.market, user=self.user, quantity=2)
+
+        # held stocks are sold first
+        market_maker.put(self.market, self.user, 50, 4)
+        self.assertRaises(risk.RiskLimitExceeded, market_maker.put, self.market, self.user, 50, 2)
+        self.assertEqual(1, Order.select().count())
+
+        # other markets and users have their own limit
+        market_maker.put(self.markets[1], self.user, 50, 3)
+        market_maker.put(self.market, self.other, 50, 3)
+
+        market_maker.cancel_user_orders(self.user, self.market)
+        market_maker.put(self.market, self.user, 50, 5)
+        self.assertIndexed(self.user)
+
+    def test_max_notional(self):
+
+        risk.configure(max_notional=100)
+        market_maker.call(self.market, self.user, 20, 3)
+
+        # a batch over the limit registers nothing
+        self.assertRaises(risk.RiskLimitExceeded, market_maker.submit_orders, [
+            dict(market=self.markets[1], user=self.user, type='sell', price=10, quantity=3),
+            dict(market=self.markets[1], user=self.user, type='buy', price=10, quantity=2),
+            ])
+        self.assertEqual(1, Order.select().count())
+
+        # replaced quotes do not count
+        market_maker.replace_quotes(self.market, self.user, [dict(type='buy', price=25, quantity=4)])
+        self.assertEqual(100, risk.index.users[self.user.id].notional)
+        self.assertIndexed(self.user)
+
+    def test_min_balance(self):
+
+        risk.configure(min_balance=0)
+        Account.create(user=self.user, balance=100)
+
+        market_maker.call(self.market, self.user, 40, 2)
+        self.assertRaises(risk.RiskLimitExceeded, market_maker.call, self.market, self.user, 30, 1)
+
+        bank.execute_transaction(self.user, 40)
+
+        # a short pays 100 at worst for the 60 it sells at
+        market_maker.put(self.markets[1], self.user, 60, 1)
+        self.assertRaises(risk.RiskLimitExceeded, market_maker.put, self.markets[1], self.user, 60, 1)
+        self.assertIndexed(self.user)
+
+    def test_clear(self):
+
+        risk.configure(max_short=10, min_balance=-1000)
+        market_maker.call(self.market, self.user, 40, 3)
+        market_maker.put(self.market, self.other, 30, 5)
+        market_maker.put(self.market, self.other, 35, 1)
+        market_maker.clear_market(self.market)
+
+        # fills moved from orders to positions and cash
+        self.assertEqual(3, Stock.get(Stock.user == self.user).quantity)
+        self.assertIndexed(self.user)
+        self.assertIndexed(self.other)
+
+    def test_queries(self):
+
+        risk.configure(max_notional=100)
+        market_maker.call(self.market, self.user, 40, 1)
+
+        # users loaded once are checked without asking the database
+        instrumentation.reset()
+        instrumentation.enable()
+        try:
+            with instrumentation.stage('unittest'):
+                risk.check_orders([dict(market=self.market, user=self.user, type='buy', price=10, quantity=1)])
+        finally:
+            instrumentation.disable()
+        self.assertEqual(0, instrumentation.metrics.queries['unittest'].sum)
+
+    def test_resolved_elsewhere(self):
+
+        risk.configure(max_notional=100)
+        risk.index.resolved_interval = 0.1
+        market_maker.call(self.market, self.user, 40, 2)
+
+        # resolved by resolution.py, in its own process with its own index
+        process = multiprocessing.Process(target=resolve_markets, args=(
+            osp.join(self.temp_dir, 'pythia.sqlite'), {self.market.id: False}))
+        process.start()
+        process.join()
+        self.assertEqual(0, process.exitcode)
+        self.assertEqual('cancelled', Order.get().status)
+
+        # the cancelled order does not hold the limit anymore once the
+        # index looked for resolved markets
+        time.sleep(0.1)
+        market_maker.call(self.markets[1], self.user, 40, 2)
+        self.assertIndexed(self.user)
+
+if __name__ == '__main__':
+    unittest.main()
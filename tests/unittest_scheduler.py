@@ -0,0 +1,85 @@
+#! /usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path as osp
+import tempfile
+import shutil
+import peewee
+import datetime
+import time
+
+TEST = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(TEST)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import Market
+from scheduler import MarketScheduler
+
+class SchedulerUnittests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        db = peewee.SqliteDatabase(osp.join(self.temp_dir, 'pythia.sqlite'), check_same_thread=False)
+
+        data_model.set_database(db)
+        data_model.create_tables()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def create_market(self, closing_date):
+        return Market.create(
+            name= 'unittest',
+            description = 'unittest',
+            status = 'open',
+            opening_date = datetime.datetime.now(),
+            closing_date = closing_date,
+            price = 0,
+            volume = 0
+            )
+
+    def get_status(self, market):
+        return Market.get(Market.id == market.id).status
+
+    def test_close_due(self):
+
+        now = datetime.datetime.now()
+        market1 = self.create_market(now - datetime.timedelta(minutes=1))
+        market2 = self.create_market(now - datetime.timedelta(minutes=2))
+        market3 = self.create_market(now + datetime.timedelta(minutes=1))
+
+        scheduler = MarketScheduler()
+        scheduler.load()
+        self.assertEqual([market2.id, market1.id], scheduler.close_due(now))
+
+        self.assertEqual('closed', self.get_status(market1))
+        self.assertEqual('closed', self.get_status(market2))
+        self.assertEqual('open', self.get_status(market3))
+        self.assertEqual([], scheduler.close_due(now))
+
+        # a market whose closing date moved is not closed
+        Market.update(closing_date=now + datetime.timedelta(hours=1)).where(Market.id == market3.id).execute()
+        self.assertEqual([market3.id], scheduler.close_due(now + datetime.timedelta(minutes=2)))
+        self.assertEqual('open', self.get_status(market3))
+
+    def test_run(self):
+
+        scheduler = MarketScheduler().start()
+        try:
+            market = self.create_market(datetime.datetime.now() + datetime.timedelta(seconds=0.1))
+            scheduler.schedule(market)
+
+            for i in range(100):
+                time.sleep(0.01)
+                if self.get_status(market) == 'closed':
+                    break
+            self.assertEqual('closed', self.get_status(market))
+        finally:
+            scheduler.stop()
+
+if __name__ == '__main__':
+    unittest.main()    
@@ -0,0 +1,126 @@
+#! /usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path as osp
+import tempfile
+import shutil
+import datetime
+
+TEST = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(TEST)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import User, Market, Order, Stock
+from sharding import ShardRouter, get_shard
+import events
+
+class ShardingUnittests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        url = 'sqlite:///%s' % osp.join(self.temp_dir, 'pythia.sqlite')
+
+        data_model.set_database(url)
+        data_model.create_tables()
+
+        self.router = ShardRouter(2, url).start()
+
+    def tearDown(self):
+        self.router.stop()
+        data_model.close_database()
+        shutil.rmtree(self.temp_dir)
+
+    def create_market(self):
+        return Market.create(
+            name= 'unittest',
+            description = 'unittest',
+            status = 'open',
+            opening_date = datetime.datetime.now(),
+            closing_date = datetime.datetime.now() + datetime.timedelta(1),
+            price = 0,
+            volume = 0
+            )
+
+    def test_get_shard(self):
+
+        shards = [get_shard(market_id, 4) for market_id in range(1000)]
+        self.assertEqual(set(range(4)), set(shards))
+        self.assertEqual(shards, [get_shard(market_id, 4) for market_id in range(1000)])
+
+    def test_router(self):
+
+        markets = [self.create_market() for i in range(4)]
+        self.assertEqual(set([0, 1]), set(self.router.get_market_shard(market) for market in markets))
+
+        user1 = User.create(
+            email = 'unitest1',
+            password = 'unittest1'
+            )
+
+        user2 = User.create(
+            email = 'unitest2',
+            password = 'unittest2'
+            )
+
+        subscription = events.subscribe(markets[0].id)
+        try:
+            orders = list()
+            for market in markets:
+                orders.append(self.router.submit(market, user1, 10, 1, 'sell'))
+                orders.append(self.router.submit(market, user2, 20, 2, 'buy'))
+            self.assertTrue(all(order.id for order in orders))
+            self.router.flush()
+
+            # books are held by the shards
+            for market in markets:
+                book = self.router.get_order_book_snapshot(market.id)
+                self.assertEqual([], book['sell_orders'])
+                self.assertEqual([(20, 1)], book['buy_levels'])
+                self.assertEqual(15, Market.get(Market.id == market.id).price)
+                self.assertEqual(1, Stock.get(Stock.market == market, Stock.user == user2).quantity)
+
+            # events of the shards are published again in this process
+            received = list()
+            while True:
+                event = subscription.get(1)
+                received.append(event['type'])
+                if event['type'] == 'trade':
+                    break
+            self.assertEqual(['book', 'book', 'book', 'trade'], received)
+        finally:
+            events.unsubscribe(subscription)
+
+        self.assertRaises(ValueError, self.router.submit_orders, [
+            dict(market=markets[0].id, user=user1.id, type='sell', price=10, quantity=0)])
+
+        created = self.router.submit_orders([
+            dict(market=market.id, user=user1.id, type='sell', price=30, quantity=1)
+            for market in markets])
+        self.assertEqual(4, len(created))
+
+        cancelled = self.router.cancel_user_orders(user1)
+        self.assertEqual(set(order.id for order in created), set(order.id for order in cancelled))
+
+        amended = self.router.amend_order(orders[0], quantity=1)
+        self.assertEqual(None, amended)
+        amended = self.router.amend_order(orders[3], price=25)
+        self.assertEqual(25, amended.price)
+        self.assertEqual([(25, 1)], self.router.get_order_book_snapshot(markets[1].id)['buy_levels'])
+        self.assertEqual('cancelled', self.router.get_order_status(orders[3].id)['status'])
+
+    def test_dead_shard(self):
+
+        market = self.create_market()
+        shard = self.router.get_market_shard(market)
+        self.router.processes[shard].terminate()
+        self.router.processes[shard].join()
+
+        # calls to it fail instead of waiting forever
+        self.assertRaises(RuntimeError, self.router.get_order_book_snapshot, market.id)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path as osp
+import tempfile
+import shutil
+import peewee
+import datetime
+
+TEST = osp.abspath(osp.dirname(__file__))
+
+ROOT = osp.dirname(TEST)
+sys.path.append(ROOT)
+
+import data_model
+from data_model import User, Market, MarketSummary
+import market_maker
+import summary
+
+class SummaryUnittests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = peewee.SqliteDatabase(osp.join(self.temp_dir, 'pythia.sqlite'), check_same_thread=False)
+
+        data_model.set_database(self.db)
+        data_model.create_tables()
+
+        self.markets = [
+            Market.create(
+                name= 'unittest%d' % i,
+                description = 'unittest',
+                status = 'open',
+                opening_date = datetime.datetime.now(),
+                closing_date = datetime.datetime.now() + datetime.timedelta(1),
+                price = 0,
+                volume = 0
+                )
+            for i in range(2)
+            ]
+        self.market = self.markets[0]
+
+        self.user = User.create(
+            email = 'unitest',
+            password = 'unittest'
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def get_summaries(self):
+        return [
+            (s.market_id, s.best_bid, s.bid_quantity, s.best_ask, s.ask_quantity, s.last_price, s.last_date, s.volume)
+            for s in MarketSummary.select().order_by(MarketSummary.market)
+            ]
+
+    def test_incremental(self):
+
+        market_maker.call(self.market, self.user, 40, 2)
+        market_maker.call(self.market, self.user, 40, 3)
+        order = market_maker.put(self.market, self.user, 60, 1)
+
+        s = MarketSummary.get(MarketSummary.market == self.market)
+        self.assertEqual((40, 5, 60, 1, None, 0), (s.best_bid, s.bid_quantity, s.best_ask, s.ask_quantity, s.last_price, s.volume))
+
+        # orders behind the top of the book do not write the summary
+        self.assertFalse(summary.update_book(self.market.id))
+
+        market_maker.cancel_order(order)
+        s = MarketSummary.get(MarketSummary.market == self.market)
+        self.assertEqual((None, 0), (s.best_ask, s.ask_quantity))
+
+        market_maker.put(self.market, self.user, 30, 4)
+        market_maker.clear_market(self.market)
+
+        s = MarketSummary.get(MarketSummary.market == self.market)
+        self.assertEqual((40, 1, None, 0, 35, 4), (s.best_bid, s.bid_quantity, s.best_ask, s.ask_quantity, s.last_price, s.volume))
+
+        # the home page reads every open market in one query
+        markets = summary.get_open_market_summaries()
+        self.assertEqual([self.market.id, self.markets[1].id], [market['id'] for market in markets])
+        self.assertEqual((40, 35), (markets[0]['best_bid'], markets[0]['last_price']))
+        self.assertEqual((None, 0, 0), (markets[1]['best_bid'], markets[1]['bid_quantity'], markets[1]['volume']))
+
+    def test_rebuild(self):
+
+        market_maker.call(self.market, self.user, 40, 2)
+        market_maker.put(self.market, self.user, 30, 1)
+        market_maker.clear_market(self.market)
+        market_maker.call(self.markets[1], self.user, 20, 3)
+        market_maker.put(self.markets[1], self.user, 70, 2)
+
+        incremental = self.get_summaries()
+        MarketSummary.delete().execute()
+
+        self.assertEqual(2, summary.rebuild())
+        self.assertEqual(incremental, self.get_summaries())
+
+if __name__ == '__main__':
+    unittest.main()